@@ -1,90 +1,255 @@
-from flask import Flask, jsonify, request
+import os
+from flask import Flask, request
 from flask_restful import Resource, Api
-from flask_jwt import JWT, jwt_required 
-from security import authenticate, identity
+from flask_jwt import JWT, jwt_required
+from security import authenticate, identity, identityCache
+from events import eventBus
+from occupancy import occupancyIndex
+from openlobbies import openLobbies
+from db import db
+from schema import upgradeSchema
+import storage
+import sharding
+import replicas
+import metrics
+import profiling
+import representations
+import gamestate
+import onboarding
+import compaction
+import ticks
+import models.versions
 from datetime import timedelta
-from resources.player import PlayerRegister, Player, PlayerLocation, PlayerAction, PlayerConfrontation
-from resources.lobby   import CreateLobby, Lobby
+from sqlalchemy.orm import configure_mappers
+from resources.player import PlayerRegister, PlayerRegisterBatch, Player, PlayerLocation, PlayerAction, PlayerActionBatch, PlayerConfrontation, PlayerConfrontationBatch, PlayerOdds
+from resources.lobby   import CreateLobby, CreateLobbyBatch, Lobby, LobbyEventStream, Matchmaking
 from resources.locations import Location
 
-# app will have the value "app.py"
-app = Flask(__name__)
 
-#Allow us to add resources for our Restfult_API
-api = Api(app)
+def create_app(config=None):
+    """ Builds the Flask application.
 
-# Key that will help with decryption
-app.secret_key = 'Edwin'
+        Note:
+            Importing this module does nothing but define create_app, so gunicorn can preload it
+            and spawn workers cheaply. The schema is brought up to date here rather than on the
+            first request (see bootstrapSchema), so that request isn't slower than the others.
 
-# Lets SQLALCHEMY know where to locate the database
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///data.db' 
+            gunicorn 'app:create_app()'       or       gunicorn wsgi:app
 
-# Disabled, but it's purpose is to track modification of objects and emit signals.
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        Args:
+            config: dict of app.config values that override the defaults below, read before
+                    any extension is set up, e.g. {'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db'}.
 
-# If Flask-JWT raises an error, then the Flask app will not see the error, unless this is true
-app.config['PROPAGATE_EXCEPTIONS'] = True
+        Return:
+            Flask application.
+    """
+    # app will have the value "app.py"
+    app = Flask(__name__)
+
+    #Allow us to add resources for our Restfult_API
+    api = Api(app)
 
-#config JWT to expire within hald an hour
-app.config['JWT_EXPIRATION_DELTA'] = timedelta(seconds = 1800)
-
-#config JWT auth key name to be 'email' instead of default 'username'
-app.config['JWT_AUTH_USERNAME_KEY'] = 'playerName'
-
-# config JWT auth password key will change from default 'password' to 'secretKey'
-app.config['JWT_AUTH_PASSWORD_KEY'] = 'secretKey'
-
-
-#JWT: Will create a new endpoint
-    #we send JWT a user name and a password
-        #then it will call the authenticate method
-        #if authentication is good, a JWT token will be sent back and stored in jwt
-    #JWT will only use the identity_function when it sends a JWT token
-jwt = JWT(app, authenticate, identity) # /auth, /login after 'JWT_AUTH_URL_RULE'
-
-
-@app.route("/", methods=['GET'])
-def homePage():
-    return "Dawn's API, nothing to see here"
-
-# Specify what fields to returb after succesful auth
-@jwt.auth_response_handler
-def customized_response_handler(access_token, identity):
-    return jsonify({
-        'authorization' : access_token.decode('utf-8'),
-        'playerId': identity.id
-    })
-
-# With this flask decorator will run the method below it before the first request
-# db.create_all() will create all the tables in the database
-@app.before_first_request
-def create_tables():
-    db.create_all()
-
-# This line of code makes the resource accesible to the API
-api.add_resource(PlayerRegister, '/player-register')
-api.add_resource(Player, '/player/<string:playerName>')
-
-api.add_resource(CreateLobby, '/create-lobby')
-api.add_resource(Lobby, '/lobby/<int:lobby_id>')
-
-# Player location logic
-api.add_resource(PlayerLocation, '/player-location')
-
-# Player actions logic
-api.add_resource(PlayerAction, '/action')
-
-# Location endpoints
-api.add_resource(Location, '/location/<int:location_id>')
-
-# Confrontation endpoint
-api.add_resource(PlayerConfrontation, '/confront')
-
-
-if __name__ == '__main__':
-    from db import db
+    # Key that will help with decryption
+    app.secret_key = 'Edwin'
+
+    # Lets SQLALCHEMY know where to locate the database
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///data.db'
+
+    # SQLite tuning profile, see storage.py: 'default' or 'production' (WAL, pooled connections, pragmas)
+    app.config['STORAGE_PROFILE'] = os.environ.get('STORAGE_PROFILE', 'default')
+
+    # Disabled, but it's purpose is to track modification of objects and emit signals.
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # If Flask-JWT raises an error, then the Flask app will not see the error, unless this is true
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+
+    #config JWT to expire within hald an hour
+    app.config['JWT_EXPIRATION_DELTA'] = timedelta(seconds = 1800)
+
+    #config JWT auth key name to be 'email' instead of default 'username'
+    app.config['JWT_AUTH_USERNAME_KEY'] = 'playerName'
+
+    # config JWT auth password key will change from default 'password' to 'secretKey'
+    app.config['JWT_AUTH_PASSWORD_KEY'] = 'secretKey'
+
+    # Identities looked up by @jwt_required are kept in memory: at most 1024 players, for 30 seconds each
+    app.config['IDENTITY_CACHE_SIZE'] = 1024
+    app.config['IDENTITY_CACHE_TTL'] = 30
+
+    # Who is at the locations played recently, for attacks and confrontations: at most 4096 locations. See occupancy.py
+    app.config['OCCUPANCY_CACHE_SIZE'] = 4096
+
+    # Players a lobby holds. POST /matchmaking places players in the fullest lobbies that aren't full, whose
+    # list is read again at most every MATCHMAKING_RELOAD_INTERVAL seconds when it runs out. See openlobbies.py
+    app.config['LOBBY_CAPACITY'] = 3
+    app.config['MATCHMAKING_RELOAD_INTERVAL'] = 10
+
+    # Lobby event streams: events a client can fall behind before it must resync, listeners per lobby
+    # and seconds between keepalives
+    app.config['EVENTS_QUEUE_SIZE'] = 100
+    app.config['EVENTS_MAX_SUBSCRIBERS'] = 100
+    app.config['EVENTS_HEARTBEAT'] = 15
+
+    # Per-endpoint latency, SQL and identity lookup measurements served on GET /metrics, see metrics.py
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+    # Requests sent with 'X-Profile: <PROFILING_TOKEN>' (ignored without a token), and PROFILING_SAMPLE_RATE of the
+    # others, run under cProfile and leave a pstats dump and their SQL timings in PROFILING_DIRECTORY, which keeps
+    # the last PROFILING_MAX_CAPTURES of them. See profiling.py
+    app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED', '0') != '0'
+    app.config['PROFILING_HEADER'] = 'X-Profile'
+    app.config['PROFILING_TOKEN'] = os.environ.get('PROFILING_TOKEN') or None
+    app.config['PROFILING_SAMPLE_RATE'] = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+    app.config['PROFILING_DIRECTORY'] = os.environ.get('PROFILING_DIRECTORY', 'profiles')
+    app.config['PROFILING_MAX_CAPTURES'] = int(os.environ.get('PROFILING_MAX_CAPTURES', 500))
+
+    # Encoder of the JSON responses: 'orjson', 'json' or None for the fastest one installed, see representations.py
+    app.config['JSON_BACKEND'] = os.environ.get('JSON_BACKEND') or None
+
+    # 'memory' keeps the lobbies being played in memory and writes them back every GAME_STATE_FLUSH_INTERVAL
+    # seconds, 'database' runs every action against SQLite. See gamestate.py
+    app.config['GAME_STATE'] = os.environ.get('GAME_STATE', 'database')
+    app.config['GAME_STATE_FLUSH_INTERVAL'] = 1.0
+    # Lock file that keeps a second process from running the game in memory on the same database, None puts
+    # it next to the database file
+    app.config['GAME_STATE_LOCK'] = os.environ.get('GAME_STATE_LOCK') or None
+
+    # Create the missing tables, columns and indexes when the app is built. Deployments that manage
+    # the schema themselves turn it off and run 'flask bootstrap-schema' instead
+    app.config['SCHEMA_BOOTSTRAP'] = os.environ.get('SCHEMA_BOOTSTRAP', '1') != '0'
+
+    # Number of SQLite files the lobbies are spread over, 0 keeps everything in SQLALCHEMY_DATABASE_URI.
+    # With shards that database only holds the player accounts, see sharding.py. The shards are SHARD_DATABASE_URI
+    # formatted with their index, None puts them next to that database: data-shard0.db, data-shard1.db...
+    app.config['SHARDS'] = int(os.environ.get('SHARDS', 0))
+    app.config['SHARD_DATABASE_URI'] = os.environ.get('SHARD_DATABASE_URI') or None
+
+    # GET endpoints read through a pool of read-only connections of their own: the same SQLite files
+    # opened with mode=ro, or the replicas of READ_DATABASE_URI / READ_SHARD_DATABASE_URI. See replicas.py
+    app.config['READ_ROUTING'] = os.environ.get('READ_ROUTING', '1') != '0'
+    app.config['READ_DATABASE_URI'] = os.environ.get('READ_DATABASE_URI') or None
+    app.config['READ_SHARD_DATABASE_URI'] = None
+    app.config['READ_POOL_SIZE'] = 8
+
+    # Most players or lobbies POST /player-register-batch and POST /create-lobby-batch take per request
+    app.config['BULK_MAX_ITEMS'] = 10000
+
+    # Seconds between two collections of the locations and NPCs of deleted lobbies, 0 leaves it to
+    # 'flask compact'. Rows are deleted COMPACTION_BATCH_SIZE at a time, see compaction.py
+    app.config['COMPACTION_INTERVAL'] = float(os.environ.get('COMPACTION_INTERVAL', 0))
+    app.config['COMPACTION_BATCH_SIZE'] = 500
+
+    # Seconds between two game ticks, 0 turns them off. A tick gives sleeping players stamina back up to
+    # TICK_MAX_STAMINA, wakes those with TICK_WAKE_STAMINA and puts the exhausted to sleep. See ticks.py
+    app.config['TICK_INTERVAL'] = float(os.environ.get('TICK_INTERVAL', 0))
+    app.config['TICK_STAMINA_REGEN'] = 10
+    app.config['TICK_MAX_STAMINA'] = 100
+    app.config['TICK_WAKE_STAMINA'] = 100
+
+    app.config.update(config or {})
+
+    storage.init_app(app)
+    sharding.init_app(app)
+    replicas.init_app(app)
     db.init_app(app)
-    app.run(port=5000, debug =True)
-
+    identityCache.configure(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+    occupancyIndex.configure(app.config['OCCUPANCY_CACHE_SIZE'])
+    openLobbies.configure(app.config['LOBBY_CAPACITY'], app.config['MATCHMAKING_RELOAD_INTERVAL'])
+    eventBus.configure(app.config['EVENTS_QUEUE_SIZE'], app.config['EVENTS_MAX_SUBSCRIBERS'])
+    metrics.init_app(app)
+    profiling.init_app(app)
+    representations.init_app(app, api)
+
+
+    #JWT: Will create a new endpoint
+        #we send JWT a user name and a password
+            #then it will call the authenticate method
+            #if authentication is good, a JWT token will be sent back and stored in jwt
+        #JWT will only use the identity_function when it sends a JWT token
+    jwt = JWT(app, authenticate, metrics.timeIdentity(identity)) # /auth, /login after 'JWT_AUTH_URL_RULE'
+
+
+    @app.route("/", methods=['GET'])
+    def homePage():
+        return "Dawn's API, nothing to see here"
+
+    # Specify what fields to returb after succesful auth
+    @jwt.auth_response_handler
+    def customized_response_handler(access_token, identity):
+        return representations.jsonResponse({
+            'authorization' : access_token.decode('utf-8'),
+            'playerId': identity.id
+        })
+
+    # flask register-players and flask create-lobbies
+    onboarding.init_app(app)
+
+    # flask compact, and the background compaction
+    compaction.init_app(app)
+
+    @app.cli.command('bootstrap-schema')
+    def bootstrap_schema_command():
+        """ Creates the missing tables, columns and indexes. """
+        bootstrapSchema(app)
+
+    # This line of code makes the resource accesible to the API
+    api.add_resource(PlayerRegister, '/player-register')
+    api.add_resource(PlayerRegisterBatch, '/player-register-batch')
+    api.add_resource(Player, '/player/<string:playerName>')
+
+    api.add_resource(CreateLobby, '/create-lobby')
+    api.add_resource(CreateLobbyBatch, '/create-lobby-batch')
+    api.add_resource(Lobby, '/lobby/<int:lobby_id>')
+    api.add_resource(LobbyEventStream, '/lobby/<int:lobby_id>/events')
+    api.add_resource(Matchmaking, '/matchmaking')
+
+    # Player location logic
+    api.add_resource(PlayerLocation, '/player-location')
+
+    # Player actions logic
+    api.add_resource(PlayerAction, '/action')
+    api.add_resource(PlayerActionBatch, '/action-batch')
+
+    # Location endpoints
+    api.add_resource(Location, '/location/<int:location_id>')
+
+    # Confrontation endpoint
+    api.add_resource(PlayerConfrontation, '/confront')
+    api.add_resource(PlayerConfrontationBatch, '/confront-batch')
+    api.add_resource(PlayerOdds, '/odds')
+
+    # Relationships between the models are resolved now instead of by the first query, with gunicorn
+    # --preload this happens once in the master process
+    configure_mappers()
+
+    if(app.config['SCHEMA_BOOTSTRAP']):
+        bootstrapSchema(app)
+
+    # Started last: the write-behind thread and the tick scheduler must not run before the schema exists
+    gamestate.init_app(app)
+    ticks.init_app(app)
+    return app
+
+
+def bootstrapSchema(app):
+    """ Creates the tables of the application's database and the columns and indexes they are missing.
+
+        Note:
+            db.create_all() creates the missing tables, upgradeSchema() adds the indexes and columns
+            that databases created by older versions don't have, in the database and in every shard.
+            The connections opened for it are closed, a preloading gunicorn master must not hand
+            SQLite connections to its workers.
+
+        Args:
+            app: Flask application.
+    """
+    with app.app_context():
+        db.create_all()
+        upgradeSchema(db.engine)
+        db.engine.dispose()
+    sharding.shards.bootstrap(app)
 
 
+if __name__ == '__main__':
+    create_app().run(port=5000, debug =True)
@@ -0,0 +1,322 @@
+""" Load test and benchmark of every endpoint of the API.
+
+    Seeds a synthetic world (lobbies full of players, empty locations and players
+    without a lobby), then drives each endpoint in turn and reports p50/p95/p99
+    latency, requests per second and SQL statements/commits per request.
+
+    Requests go through Flask's test client by default. With --mode server the
+    application is served by a threaded werkzeug server on a local port and
+    every worker thread talks HTTP to it.
+
+    Results are compared with a baseline file (benchmarks/baseline.json), so
+    regressions in median latency or statement/commit counts stand out.
+    --save-baseline writes the current results as the new baseline, --check
+    exits with status 1 if anything regressed.
+
+    Usage:
+        python -m benchmarks.endpoints [--requests 300] [--threads 1] [--mode client|server]
+                                       [--lobbies 20] [--players 25] [--save-baseline] [--check]
+"""
+import argparse
+import collections
+import http.client
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy
+
+from sqlalchemy.engine import Engine
+from werkzeug.serving import make_server
+
+from db import db
+from models.player import PlayerModel
+from benchmarks.support import createBenchmarkApp, seedWorld, StatementCounter
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+#: Request spec: (method, url, json body, token or None)
+Request = collections.namedtuple('Request', ['method', 'url', 'body', 'token'])
+
+
+class World:
+    """ Everything the scenarios need to build valid requests.
+
+    """
+    def __init__(self, lobbies, freePlayers):
+        #: list of (lobbyId, locationIds, playerNames)
+        self.lobbies     = lobbies
+        self.freePlayers = freePlayers
+        self.tokens      = {}
+        self.playerIds   = {}
+        self.registered  = itertools.count()
+        self.lock        = threading.Lock()
+
+    def member(self):
+        """ Random (token, lobbyId, locationIds) of a player that is part of a lobby.
+
+        """
+        lobbyId, locationIds, names = random.choice(self.lobbies)
+        return self.tokens[random.choice(names)], lobbyId, locationIds
+
+    def takeFreePlayer(self):
+        with self.lock:
+            return self.freePlayers.pop()
+
+
+def authRequest(world, i):
+    name = random.choice(random.choice(world.lobbies)[2])
+    return Request('POST', '/auth', {'playerName': name, 'secretKey': 'secret'}, None)
+
+
+def registerRequest(world, i):
+    return Request('POST', '/player-register', {'playerName': 'new{}'.format(next(world.registered)), 'secretKey': 'secret'}, None)
+
+
+def createLobbyRequest(world, i):
+    return Request('POST', '/create-lobby', None, world.tokens[world.takeFreePlayer()])
+
+
+def lobbyRequest(world, i):
+    return Request('GET', '/lobby/{}'.format(random.choice(world.lobbies)[0]), None, None)
+
+
+def moveRequest(world, i):
+    token, _, locationIds = world.member()
+    return Request('POST', '/player-location', {'locationId': random.choice(locationIds)}, token)
+
+
+def locationRequest(world, i):
+    return Request('GET', '/player-location', None, world.member()[0])
+
+
+def actionRequest(world, i):
+    return Request('POST', '/action', {'action': random.choice(['sleep', 'wakeup'])}, world.member()[0])
+
+
+def actionBatchRequest(world, i):
+    token, _, locationIds = world.member()
+    actions = [{'action': 'move', 'locationId': random.choice(locationIds)}, {'action': 'sleep'}, {'action': 'wakeup'},
+               {'action': 'move', 'locationId': random.choice(locationIds)}]
+    return Request('POST', '/action-batch', {'actions': actions}, token)
+
+
+def confrontRequest(world, i):
+    token, _, _ = world.member()
+    return Request('POST', '/confront', {'player': str(random.choice(list(world.playerIds.values())))}, token)
+
+
+#: endpoint name -> function building the i-th request of that endpoint
+SCENARIOS = collections.OrderedDict([
+    ('POST /auth',            authRequest),
+    ('POST /player-register', registerRequest),
+    ('POST /create-lobby',    createLobbyRequest),
+    ('GET /lobby/<id>',       lobbyRequest),
+    ('POST /player-location', moveRequest),
+    ('GET /player-location',  locationRequest),
+    ('POST /action',          actionRequest),
+    ('POST /action-batch',    actionBatchRequest),
+    ('POST /confront',        confrontRequest),
+])
+
+
+def seed(app, args):
+    """ Creates the world and logs every player in.
+
+    """
+    with app.app_context():
+        lobbies = seedWorld(args.lobbies, args.players, 5)
+        free = ['free{}'.format(i) for i in range(args.requests)]
+        db.session.bulk_insert_mappings(PlayerModel, [{
+            'playerName': name, 'secretKey': 'secret', 'role': 'player', 'status': 'none', 'heldItem': 'none',
+            'strength': 100, 'stamina': 100, 'currentLobby': -1, 'homeId': -1, 'locationId': -1
+        } for name in free])
+        db.session.commit()
+        world = World(lobbies, free)
+        world.playerIds = dict(db.session.query(PlayerModel.playerName, PlayerModel.id))
+
+    client = app.test_client()
+    for name in itertools.chain(free, *(names for _, _, names in lobbies)):
+        response = client.post('/auth', json={'playerName': name, 'secretKey': 'secret'})
+        world.tokens[name] = response.get_json()['authorization']
+    return world
+
+
+def clientSender(app):
+    """ Returns a function sending a Request through a test client of the calling thread, returns the status code.
+
+    """
+    local = threading.local()
+
+    def send(request):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        headers = {'Authorization': 'JWT ' + request.token} if request.token else {}
+        return getattr(local.client, request.method.lower())(request.url, json=request.body, headers=headers).status_code
+
+    return send
+
+
+def serverSender(port):
+    """ Returns a function sending a Request over HTTP to the server listening on 'port', returns the status code.
+
+    """
+    def send(request):
+        headers = {'Content-Type': 'application/json'}
+        if request.token:
+            headers['Authorization'] = 'JWT ' + request.token
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        body = json.dumps(request.body) if request.body is not None else None
+        connection.request(request.method, request.url, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        return response.status
+
+    return send
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def drive(app, world, send, build, args):
+    """ Sends args.requests requests built by 'build' from args.threads threads.
+
+        Return:
+            dict with the measurements of the endpoint
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    numbers = iter(range(args.requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(numbers, None)
+            if i is None:
+                return
+            request = build(world, i)
+            start = time.perf_counter()
+            try:
+                failed = send(request) >= 500
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += failed
+
+    # Every engine is counted, GET requests read through the ones of replicas.py
+    with StatementCounter(Engine) as counter:
+        threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    return {
+        'requests'  : len(latencies),
+        'rps'       : len(latencies) / elapsed,
+        'p50'       : percentile(latencies, .50) * 1e3,
+        'p95'       : percentile(latencies, .95) * 1e3,
+        'p99'       : percentile(latencies, .99) * 1e3,
+        'statements': counter.statements / len(latencies),
+        'commits'   : counter.commits / len(latencies),
+        'errors'    : errors[0]
+    }
+
+
+def regressions(name, result, baseline, tolerance):
+    """ Describes how 'result' regressed compared to the baseline of the endpoint, empty if it didn't.
+
+    """
+    if name not in baseline:
+        return []
+    before = baseline[name]
+    found = []
+    if result['statements'] > before['statements'] + 1e-9:
+        found.append('statements {:.2f} -> {:.2f}'.format(before['statements'], result['statements']))
+    if result['commits'] > before['commits'] + 1e-9:
+        found.append('commits {:.2f} -> {:.2f}'.format(before['commits'], result['commits']))
+    # p50 rather than p95, the tail of a few hundred requests moves too much from run to run
+    if result['p50'] > before['p50'] * (1 + tolerance):
+        found.append('p50 {:.2f}ms -> {:.2f}ms'.format(before['p50'], result['p50']))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=300, help='requests per endpoint')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--mode', choices=['client', 'server'], default='client')
+    parser.add_argument('--lobbies', type=int, default=20)
+    parser.add_argument('--players', type=int, default=25, help='players per lobby')
+    parser.add_argument('--profile', default='default', help='storage profile, see storage.py')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random choices, keeps single threaded runs comparable')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=.5, help='allowed p50 growth before it counts as a regression')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 if an endpoint regressed')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    numpy.random.seed(args.seed)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = createBenchmarkApp(os.path.join(directory, 'bench.db'), STORAGE_PROFILE=args.profile)
+        world = seed(app, args)
+
+        server = None
+        if args.mode == 'server':
+            # One access log line per request would dominate the output and the timings
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            send = serverSender(server.server_port)
+        else:
+            send = clientSender(app)
+
+        print('{:<24} {:>8} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8} {:>7}  {}'.format(
+            'endpoint', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'sql/req', 'commits', 'errors', 'vs baseline'))
+        results = {}
+        regressed = False
+        for name, build in SCENARIOS.items():
+            result = results[name] = drive(app, world, send, build, args)
+            found = regressions(name, result, baseline, args.tolerance)
+            regressed = regressed or bool(found)
+            print('{:<24} {:>8} {:>9.0f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.2f} {:>8.2f} {:>7}  {}'.format(
+                name, result['requests'], result['rps'], result['p50'], result['p95'], result['p99'],
+                result['statements'], result['commits'], result['errors'],
+                'REGRESSED: ' + ', '.join(found) if found else ('ok' if name in baseline else '-')))
+
+        if server is not None:
+            server.shutdown()
+        with app.app_context():
+            db.engine.dispose()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baselineFile:
+            json.dump(results, baselineFile, indent=4, sort_keys=True)
+        print('Baseline written to {}'.format(args.baseline))
+
+    if args.check and regressed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+""" Query plan and timing benchmark for the model finders.
+
+    Builds throwaway SQLite databases with 1k, 100k and 1M players, prints the
+    EXPLAIN QUERY PLAN of every hot finder and times it before and after
+    schema.upgradeSchema() creates the indexes declared on the models.
+
+    Usage:
+        python -m benchmarks.finder_indexes [--sizes 1000,100000,1000000] [--repeat 100]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Query
+
+from db import db
+from schema import upgradeSchema
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+# Unused, imported so that create_all() also creates the locations table seed() fills
+from models.locations import LocationModel  # noqa: F401
+
+# Every lobby holds its owner plus the store clerk and the cop, like CreateLobby.post does
+PLAYERS_PER_LOBBY = 3
+
+# finder name -> function building the query it issues for a random key
+FINDERS = {
+    'PlayerModel.findByPlayerName': lambda n: Query(PlayerModel).filter_by(playerName='player{}'.format(random.randrange(n))).limit(1),
+    'PlayerModel.findByPlayerId':   lambda n: Query(PlayerModel).filter_by(id=random.randrange(1, n + 1)).limit(1),
+    'LobbyModel.findByOwner':       lambda n: Query(LobbyModel).filter_by(lobbyOwner='player{}'.format(random.randrange(n))),
+    'LobbyModel.players':           lambda n: Query(PlayerModel).filter(PlayerModel.currentLobby == random.randrange(1, n // PLAYERS_PER_LOBBY + 1)),
+    'LocationModel.players':        lambda n: Query(PlayerModel).filter(PlayerModel.locationId == random.randrange(1, n + 1)),
+    'LocationModel.home':           lambda n: Query(PlayerModel).filter(PlayerModel.homeId == random.randrange(1, n + 1)),
+}
+
+
+def seed(engine, size):
+    """ Creates the tables without secondary indexes and fills them with 'size' players.
+
+    """
+    db.metadata.create_all(engine)
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            cursor.execute('DROP INDEX IF EXISTS "{}"'.format(index.name))
+
+    lobbies = size // PLAYERS_PER_LOBBY
+    cursor.executemany(
+        'INSERT INTO lobbies ("lobbyId", "lobbyOwner", "lobbySize") VALUES (?, ?, 1)',
+        ((i + 1, 'player{}'.format(i * PLAYERS_PER_LOBBY)) for i in range(lobbies))
+    )
+    cursor.executemany(
+        'INSERT INTO locations (id, "locationName", "locationOwner", "numOfPlayers") VALUES (?, ?, ?, 1)',
+        ((i + 1, 'home', 'player{}'.format(i)) for i in range(size))
+    )
+    cursor.executemany(
+        'INSERT INTO players (id, "playerName", "secretKey", role, status, "heldItem", strength, stamina, '
+        '"currentLobby", "homeId", "locationId") VALUES (?, ?, ?, ?, ?, ?, 100, 100, ?, ?, ?)',
+        ((i + 1, 'player{}'.format(i), 'key', 'player' if i % PLAYERS_PER_LOBBY == 0 else 'npc', 'none', 'none',
+          i // PLAYERS_PER_LOBBY + 1, i + 1, i + 1) for i in range(size))
+    )
+    connection.commit()
+    cursor.execute('ANALYZE')
+    connection.close()
+
+
+def compileQuery(query, engine):
+    return str(query.statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def measure(engine, size, repeat):
+    """ Prints the plan of every finder and returns the mean time in microseconds it took to run.
+
+    """
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+    timings = {}
+    for name, build in FINDERS.items():
+        plan = cursor.execute('EXPLAIN QUERY PLAN ' + compileQuery(build(size), engine)).fetchall()
+        print('    {:<30} {}'.format(name, ' | '.join(row[-1] for row in plan)))
+
+        statements = [compileQuery(build(size), engine) for _ in range(repeat)]
+        start = time.perf_counter()
+        for statement in statements:
+            cursor.execute(statement).fetchall()
+        timings[name] = (time.perf_counter() - start) / repeat * 1e6
+    connection.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    for size in (int(value) for value in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine('sqlite:///' + os.path.join(directory, 'bench.db'))
+            seed(engine, size)
+
+            print('{} players, without indexes'.format(size))
+            before = measure(engine, size, args.repeat)
+
+            upgradeSchema(engine)
+            print('{} players, after upgradeSchema'.format(size))
+            after = measure(engine, size, args.repeat)
+
+            print('    {:<30} {:>12} {:>12} {:>9}'.format('finder', 'before (us)', 'after (us)', 'speedup'))
+            for name in FINDERS:
+                print('    {:<30} {:>12.1f} {:>12.1f} {:>8.1f}x'.format(name, before[name], after[name], before[name] / after[name]))
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
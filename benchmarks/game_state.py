@@ -0,0 +1,174 @@
+""" Latency of moves and actions with the in-memory game state, and its recovery guarantees.
+
+    Runs the same random moves and sleep/wakeup actions against the database path and
+    the in-memory store of gamestate.py, timing the requests and the store calls alone.
+    Then checks that:
+
+        - after a flush every row equals its record in memory and every location's
+          numOfPlayers equals the number of players standing in it.
+        - a flush doesn't overwrite a player changed in the database behind the store: the
+          lobby is dropped from memory instead.
+        - a second process can't start the store on the same database.
+        - after a crash (records dropped without a flush) the tables hold the state of
+          the last flush, and the next action carries on from it.
+
+    Exits with status 1 if a check fails.
+
+    Usage:
+        python -m benchmarks.game_state [--lobbies 10] [--players 20] [--requests 2000]
+"""
+import argparse
+import collections
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from db import db
+from gamestate import gameState
+from models.player import PlayerModel
+from models.locations import LocationModel
+from benchmarks.support import createBenchmarkApp, seedWorld, StatementCounter
+
+
+def snapshot():
+    """ (players, locations) rows that the game changes, by id.
+
+    """
+    players = {row.id: tuple(row) for row in db.session.query(
+        PlayerModel.id, PlayerModel.status, PlayerModel.strength, PlayerModel.stamina, PlayerModel.locationId, PlayerModel.version)}
+    locations = {row.id: tuple(row) for row in db.session.query(LocationModel.id, LocationModel.numOfPlayers, LocationModel.version)}
+    return players, locations
+
+
+def drifted():
+    """ Locations whose numOfPlayers differs from the players standing in them.
+
+    """
+    standing = collections.Counter(locationId for (locationId,) in db.session.query(PlayerModel.locationId))
+    return [(row.id, row.numOfPlayers, standing[row.id]) for row in db.session.query(LocationModel.id, LocationModel.numOfPlayers)
+            if row.numOfPlayers != standing[row.id]]
+
+
+def run(app, client, world, tokens, requests):
+    """ Sends 'requests' random moves and actions, returns (mean ms per request, statements per request).
+
+    """
+    random.seed(0)
+    with app.app_context():
+        engine = db.engine
+    with StatementCounter(engine) as counter:
+        start = time.perf_counter()
+        for _ in range(requests):
+            lobbyId, locationIds, names = random.choice(world)
+            headers = {'Authorization': 'JWT ' + tokens[random.choice(names)]}
+            if random.random() < .5:
+                client.post('/player-location', json={'locationId': random.choice(locationIds)}, headers=headers)
+            else:
+                client.post('/action', json={'action': random.choice(['sleep', 'wakeup'])}, headers=headers)
+        elapsed = time.perf_counter() - start
+    return elapsed / requests * 1e3, counter.statements / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lobbies', type=int, default=10)
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+    failures = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = createBenchmarkApp(os.path.join(directory, 'bench.db'))
+        with app.app_context():
+            world = seedWorld(args.lobbies, args.players, 5)
+            ids = dict(db.session.query(PlayerModel.playerName, PlayerModel.id))
+        client = app.test_client()
+        tokens = {name: client.post('/auth', json={'playerName': name, 'secretKey': 'secret'}).get_json()['authorization']
+                  for _, _, names in world for name in names}
+
+        print('{:<10} {:>14} {:>10}'.format('mode', 'ms / request', 'sql / req'))
+        latency, statements = run(app, client, world, tokens, args.requests)
+        print('{:<10} {:>14.3f} {:>10.2f}'.format('database', latency, statements))
+
+        # A long interval so that the flushes below are the only ones
+        gameState.start(app, 3600)
+        latency, statements = run(app, client, world, tokens, args.requests)
+        print('{:<10} {:>14.3f} {:>10.2f}'.format('memory', latency, statements))
+
+        with app.app_context():
+            lobbyId, locationIds, names = world[0]
+            playerId = ids[names[0]]
+            calls = 10000
+            start = time.perf_counter()
+            for i in range(calls):
+                gameState.move(playerId, locationIds[i % len(locationIds)])
+            print('store call alone: {:.2f} us / move'.format((time.perf_counter() - start) / calls * 1e6))
+
+            start = time.perf_counter()
+            written = gameState.flush()
+            print('flush: {} rows in {:.2f} ms'.format(written, (time.perf_counter() - start) * 1e3))
+
+            # Every row must equal its record once flushed
+            players, locations = snapshot()
+            for player in gameState.players.values():
+                if players[player.id] != (player.id, player.status, player.strength, player.stamina, player.locationId, player.version):
+                    failures.append('player {} differs from its record'.format(player.id))
+            for location in gameState.locations.values():
+                if locations[location.id] != (location.id, location.numOfPlayers, location.version):
+                    failures.append('location {} differs from its record'.format(location.id))
+            failures += ['location {} counts {} players, {} are standing in it'.format(*row) for row in drifted()]
+
+            # Another writer kills a player that moves in memory, the next flush must not bring it back
+            otherLobbyId, otherLocationIds, otherNames = world[1]
+            victimId = ids[otherNames[0]]
+            gameState.move(victimId, otherLocationIds[0])
+            gameState.flush()
+            PlayerModel.query.filter_by(id=victimId).update(
+                {'status': 'dead', 'version': PlayerModel.version + 1}, synchronize_session=False)
+            db.session.commit()
+            gameState.move(victimId, otherLocationIds[1])
+            gameState.flush()
+            if db.session.query(PlayerModel.status).filter_by(id=victimId).scalar() != 'dead':
+                failures.append('a flush overwrote a player changed in the database')
+            if otherLobbyId in gameState.lobbies:
+                failures.append('the lobby of a player changed in the database was kept in memory')
+            failures += ['location {} counts {} players, {} are standing in it'.format(*row) for row in drifted()]
+
+            # Only one process runs the store on a database
+            second = subprocess.run([sys.executable, '-c', 'from benchmarks.support import createBenchmarkApp; '
+                                     'createBenchmarkApp({!r}, GAME_STATE="memory")'.format(os.path.join(directory, 'bench.db'))],
+                                    capture_output=True, text=True)
+            if second.returncode == 0 or 'another process' not in second.stderr:
+                failures.append('a second process started the store on the same database')
+
+            # Crash: keep playing, then drop the records without flushing
+            flushed = snapshot()
+        run(app, client, world, tokens, args.requests // 10)
+        with app.app_context():
+            gameState.clear()
+            if snapshot() != flushed:
+                failures.append('tables changed without a flush')
+
+            # Recovery: the next move starts from the flushed row
+            stamina = db.session.query(PlayerModel.stamina).filter_by(id=playerId).scalar()
+            location = db.session.query(PlayerModel.locationId).filter_by(id=playerId).scalar()
+            target = next(locationId for locationId in locationIds if locationId != location)
+            gameState.move(playerId, target)
+            if gameState.players[playerId].stamina != stamina - 10:
+                failures.append('the record reloaded after the crash is not the flushed row')
+            gameState.stop(app)
+            failures += ['location {} counts {} players, {} are standing in it'.format(*row) for row in drifted()]
+            db.engine.dispose()
+
+    for failure in failures:
+        print('FAILED: {}'.format(failure))
+    print('OK' if not failures else '{} checks failed'.format(len(failures)))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
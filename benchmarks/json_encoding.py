@@ -0,0 +1,53 @@
+""" Serialization time of large lobby payloads with every JSON backend of representations.py.
+
+    For lobbies of growing size, times the encoding of LobbyModel.json() alone and a
+    whole GET /lobby/<id> through the test client, once per installed backend. Every
+    backend must produce a document equal to the stdlib one.
+
+    Usage:
+        python -m benchmarks.json_encoding [--sizes 10,100,1000,10000] [--repeat 50]
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import representations
+from db import db
+from models.lobby import LobbyModel
+from benchmarks.support import createBenchmarkApp, seedLobby, timeit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    print('{:>8} {:<8} {:>10} {:>12} {:>14}'.format('players', 'backend', 'bytes', 'encode ms', 'GET lobby ms'))
+    for size in (int(value) for value in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as directory:
+            app = createBenchmarkApp(os.path.join(directory, 'bench.db'))
+            client = app.test_client()
+            with app.app_context():
+                lobbyId, _ = seedLobby(size)
+                payload = LobbyModel.findById(lobbyId).json()
+
+            expected = json.loads(representations.stdlibDumps(payload))
+            for name, dumps in sorted(representations.JSON_BACKENDS.items()):
+                encoded = dumps(payload)
+                assert json.loads(encoded) == expected, '{} changed the document'.format(name)
+
+                representations.useBackend(name)
+                assert client.get('/lobby/{}'.format(lobbyId)).get_json() == expected
+                encode = timeit(lambda: dumps(payload), args.repeat)
+                request = timeit(lambda: client.get('/lobby/{}'.format(lobbyId)), args.repeat)
+                print('{:>8} {:<8} {:>10} {:>12.3f} {:>14.3f}'.format(size, name, len(encoded), encode, request))
+
+            representations.useBackend(None)
+            with app.app_context():
+                db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
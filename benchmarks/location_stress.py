@@ -0,0 +1,83 @@
+""" Concurrency stress test for POST /player-location.
+
+    Moves players between the locations of one lobby from many threads at once,
+    then checks that every location's numOfPlayers still equals the number of
+    players standing in it. Exits with status 1 if any counter drifted.
+
+    Usage:
+        python -m benchmarks.location_stress [--players 200] [--locations 20] [--threads 16] [--moves 250]
+"""
+import argparse
+import collections
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from db import db
+from models.player import PlayerModel
+from models.locations import LocationModel
+from benchmarks.support import createBenchmarkApp, seedWorld
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, default=200)
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--moves', type=int, default=250, help='moves per thread')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = createBenchmarkApp(os.path.join(directory, 'bench.db'))
+        with app.app_context():
+            _, locationIds, names = seedWorld(1, args.players, args.locations)[0]
+
+        client = app.test_client()
+        tokens = [client.post('/auth', json={'playerName': name, 'secretKey': 'secret'}).get_json()['authorization'] for name in names]
+
+        outcomes = collections.Counter()
+        lock = threading.Lock()
+
+        def mover():
+            threadClient = app.test_client()
+            for _ in range(args.moves):
+                response = threadClient.post(
+                    '/player-location',
+                    json={'locationId': random.choice(locationIds)},
+                    headers={'Authorization': 'JWT ' + random.choice(tokens)}
+                )
+                with lock:
+                    outcomes[response.get_json()['message']] += 1
+
+        threads = [threading.Thread(target=mover) for _ in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        total = args.threads * args.moves
+        print('{} requests from {} threads in {:.2f}s ({:.0f} req/s)'.format(total, args.threads, elapsed, total / elapsed))
+        for message, count in outcomes.most_common():
+            print('    {:>6}  {}'.format(count, message))
+
+        with app.app_context():
+            occupants = dict(db.session.query(PlayerModel.locationId, db.func.count(PlayerModel.id)).group_by(PlayerModel.locationId))
+            drifted = [(location.id, location.numOfPlayers, occupants.get(location.id, 0))
+                       for location in LocationModel.query.filter(LocationModel.id.in_(locationIds))
+                       if location.numOfPlayers != occupants.get(location.id, 0)]
+            db.engine.dispose()
+
+    if drifted:
+        for locationId, counter, actual in drifted:
+            print('location {}: numOfPlayers={} but {} players are there'.format(locationId, counter, actual))
+        sys.exit(1)
+    print('numOfPlayers is exact for all {} locations'.format(len(locationIds)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+""" Assignments per second of matchmaking (matchmaking.py) against finding an open lobby by scanning
+    the lobbies table, the way clients had to before POST /matchmaking.
+
+    Every pass starts from --lobbies lobbies of one player and places players that aren't part of
+    a lobby:
+
+        scan        per player: every lobby is read and the first one with room is joined as
+                    POST /lobby/<id> does.
+        endpoint    per player: POST /matchmaking through the test client.
+        queue       --queued players drained --batch at a time with matchPlayers, one commit per
+                    batch.
+
+    Reports seconds, assignments per second and SQL statements and commits per assignment, then
+    checks that every player was placed and that no lobby holds more than LOBBY_CAPACITY players.
+
+    Usage:
+        python -m benchmarks.matchmaking [--lobbies 10000] [--queued 100000] [--batch 1000]
+                                         [--scan-players 200] [--requests 500]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.engine import Engine
+
+from db import db
+from matchmaking import matchPlayers
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+from onboarding import chunks, createLobbies, registerPlayers
+from openlobbies import openLobbies
+from benchmarks.support import createBenchmarkApp, StatementCounter
+
+
+def createWorld(path, numOfLobbies, numOfPlayers):
+    """ Application with 'numOfLobbies' lobbies of one player and 'numOfPlayers' players in none.
+
+        Return:
+            tuple (app, names of the players to place)
+    """
+    app = createBenchmarkApp(path)
+    owners = ['owner{}'.format(i) for i in range(numOfLobbies)]
+    names = ['queued{}'.format(i) for i in range(numOfPlayers)]
+    with app.app_context():
+        registerPlayers([{'playerName': name, 'secretKey': 'secret'} for name in owners + names])
+        createLobbies([{'playerName': name} for name in owners], checkSecrets=False)
+    # Every pass reads the open lobbies itself, as a process that just started would
+    openLobbies.clear()
+    return app, names
+
+
+def scanJoin(player):
+    """ Joins the first lobby with room found by reading every lobby, as POST /lobby/<id> would.
+
+    """
+    lobby = next(lobby for lobby in LobbyModel.query.all() if lobby.lobbySize < current_app.config['LOBBY_CAPACITY'])
+    player.currentLobby = lobby.lobbyId
+    lobby.lobbySize = lobby.lobbySize + 1
+    lobby.save_to_db()
+    home = LocationModel(player.playerName, 'home')
+    home.save_to_db()
+    player.locationId = home.id
+    player.homeId = home.id
+    player.save_to_db()
+
+
+def scanPass(app, names):
+    with app.app_context():
+        for name in names:
+            scanJoin(PlayerModel.findByPlayerName(name))
+
+
+def endpointPass(app, names):
+    client = app.test_client()
+    tokens = [client.post('/auth', json={'playerName': name, 'secretKey': 'secret'}).get_json()['authorization'] for name in names]
+
+    def run():
+        for token in tokens:
+            response = client.post('/matchmaking', headers={'Authorization': 'JWT ' + token})
+            if 'lobbyId' not in response.get_json():
+                raise RuntimeError(response.get_json()['message'])
+    return run
+
+
+def queuePass(app, names, batchSize):
+    with app.app_context():
+        for batch in chunks(names, batchSize):
+            players = []
+            for chunk in chunks(batch):
+                players += PlayerModel.query.filter(PlayerModel.playerName.in_(chunk)).all()
+            for result in matchPlayers(players):
+                if 'lobbyId' not in result:
+                    raise RuntimeError(result['message'])
+
+
+def check(app, names):
+    """ Every player of 'names' is part of a lobby, and every lobby's size is the number of its players.
+
+    """
+    with app.app_context():
+        placed = 0
+        for chunk in chunks(names):
+            placed += db.session.query(func.count(PlayerModel.id)).filter(
+                PlayerModel.playerName.in_(chunk), PlayerModel.currentLobby != -1).scalar()
+        members = dict(db.session.query(PlayerModel.currentLobby, func.count(PlayerModel.id))
+                       .filter(PlayerModel.role == 'player').group_by(PlayerModel.currentLobby))
+        wrong = [lobbyId for lobbyId, lobbySize in db.session.query(LobbyModel.lobbyId, LobbyModel.lobbySize)
+                 if lobbySize != members.get(lobbyId, 0) or lobbySize > current_app.config['LOBBY_CAPACITY']]
+    if placed != len(names) or wrong:
+        raise RuntimeError('{} of {} players placed, lobbies with a wrong size: {}'.format(placed, len(names), wrong[:10]))
+
+
+def run(name, args, directory, numOfPlayers, makePass):
+    app, names = createWorld(os.path.join(directory, '{}.db'.format(name)), args.lobbies, numOfPlayers)
+    work = makePass(app, names)
+    with StatementCounter(Engine) as counter:
+        start = time.perf_counter()
+        work()
+        elapsed = time.perf_counter() - start
+    check(app, names)
+    print('{:<10} {:>8} {:>8} {:>10.2f} {:>10.0f} {:>10.2f} {:>8.3f}'.format(
+        name, numOfPlayers, args.lobbies, elapsed, numOfPlayers / elapsed,
+        counter.statements / numOfPlayers, counter.commits / numOfPlayers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lobbies', type=int, default=10000, help='lobbies of one player the passes start from')
+    parser.add_argument('--queued', type=int, default=100000, help='players placed by the queue pass')
+    parser.add_argument('--batch', type=int, default=1000, help='players per matchPlayers call and commit')
+    parser.add_argument('--scan-players', type=int, default=200, help='players placed by the scan pass')
+    parser.add_argument('--requests', type=int, default=500, help='players placed by the endpoint pass')
+    args = parser.parse_args()
+
+    print('{:<10} {:>8} {:>8} {:>10} {:>10} {:>10} {:>8}'.format(
+        'pass', 'players', 'lobbies', 'seconds', 'assign/s', 'sql/assign', 'commits'))
+    with tempfile.TemporaryDirectory() as directory:
+        run('scan', args, directory, args.scan_players, lambda app, names: lambda: scanPass(app, names))
+        run('endpoint', args, directory, args.requests, endpointPass)
+        run('queue', args, directory, args.queued, lambda app, names: lambda: queuePass(app, names, args.batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+""" Cost of an attack (POST /action) and of a confrontation (POST /confront) at a crowded location.
+
+    Seeds one lobby per --crowds size whose players all stand at the owner's home, then times
+    --repeat attacks of the owner on the last player of the crowd and --repeat confrontations.
+    Both fighters are brought back to life between two attacks, outside of the timing. Reports
+    mean milliseconds and SQL statements per request.
+
+    Usage:
+        python -m benchmarks.occupancy [--crowds 10,100,1000] [--repeat 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy.engine import Engine
+
+from db import db
+from models.player import PlayerModel
+from benchmarks.support import createBenchmarkApp, seedLobby, StatementCounter
+
+
+def run(crowd, args, directory):
+    app = createBenchmarkApp(os.path.join(directory, 'crowd{}.db'.format(crowd)))
+    owner = 'crowd{}p'.format(crowd)
+    with app.app_context():
+        lobbyId, _ = seedLobby(crowd, owner)
+    target = '{}{}'.format(owner, crowd - 1)
+
+    client = app.test_client()
+    token = client.post('/auth', json={'playerName': owner, 'secretKey': 'secret'}).get_json()['authorization']
+    headers = {'Authorization': 'JWT ' + token}
+
+    def revive():
+        with app.app_context():
+            PlayerModel.query.filter(PlayerModel.playerName.in_([owner, target])).update(
+                {'status': 'none', 'version': PlayerModel.version + 1}, synchronize_session=False)
+            db.session.commit()
+
+    results = []
+    for path, body in (('/action', {'action': 'attack', 'target': target}), ('/confront', {'player': '1'})):
+        elapsed, statements = 0.0, 0
+        with StatementCounter(Engine) as counter:
+            for _ in range(args.repeat):
+                if path == '/action':
+                    revive()
+                counter.reset()
+                start = time.perf_counter()
+                message = client.post(path, json=body, headers=headers).get_json()
+                elapsed += time.perf_counter() - start
+                statements += counter.statements
+                if path == '/action':
+                    assert message['message'] in ('kill', 'dead'), message
+        results.append((elapsed / args.repeat * 1e3, statements / args.repeat))
+
+    print('{:<8} {:>12.2f} {:>12.1f} {:>14.2f} {:>14.1f}'.format(crowd, results[0][0], results[0][1], results[1][0], results[1][1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--crowds', default='10,100,1000', help='comma separated numbers of players at the location')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print('{:<8} {:>12} {:>12} {:>14} {:>14}'.format('crowd', 'attack ms', 'statements', 'confront ms', 'statements'))
+    with tempfile.TemporaryDirectory() as directory:
+        for crowd in [int(value) for value in args.crowds.split(',')]:
+            run(crowd, args, directory)
+
+
+if __name__ == '__main__':
+    main()
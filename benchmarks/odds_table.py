@@ -0,0 +1,69 @@
+""" Checks that the compiled odds table gives the same odds as the branch logic, and times both.
+
+    Compares PlayerModel.confrontOdds (the nested ifs) with oddsTable.lookup and
+    PlayerModel.confrontOddsBatch on every strength and stamina difference in
+    [-60, 60] (so every bracket edge), every gun/sleep combination, and on random
+    fights. Odds must be exactly equal, not approximately. Exits with status 1 on
+    the first mismatch.
+
+    Usage:
+        python -m benchmarks.odds_table [--random 200000] [--repeat 100000]
+"""
+import argparse
+import itertools
+import random
+import sys
+import time
+
+from models.odds import Fighter
+from models.player import PlayerModel, oddsTable
+
+ITEMS    = ['none', 'gun', 'knife']
+STATUSES = ['none', 'sleep', 'dead']
+
+
+def fights(randomFights):
+    """ (attacker, target) pairs: the whole grid of differences, then random stats.
+
+    """
+    diffs = range(-60, 61)
+    for strengthDiff, staminaDiff, attackerItem, targetItem, status in itertools.product(diffs, diffs, ITEMS, ITEMS, STATUSES):
+        yield Fighter(100 + strengthDiff, 100 + staminaDiff, attackerItem, 'none'), Fighter(100, 100, targetItem, status)
+
+    rng = random.Random(0)
+    for _ in range(randomFights):
+        yield (Fighter(rng.randint(0, 300), rng.randint(0, 300), rng.choice(ITEMS), 'none'),
+               Fighter(rng.randint(0, 300), rng.randint(0, 300), rng.choice(ITEMS), rng.choice(STATUSES)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--random', type=int, default=200000, help='random fights checked after the grid')
+    parser.add_argument('--repeat', type=int, default=100000, help='calls timed per path')
+    args = parser.parse_args()
+
+    pairs = list(fights(args.random))
+    for attacker, target in pairs:
+        expected = PlayerModel.confrontOdds(attacker, target)
+        if oddsTable.lookup(attacker, target) != expected:
+            print('FAILED: lookup {} != confrontOdds {} for {} vs {}'.format(oddsTable.lookup(attacker, target), expected, attacker, target))
+            sys.exit(1)
+
+    columns = list(zip(*[(a.strength, a.stamina, a.heldItem, t.strength, t.stamina, t.heldItem, t.status) for a, t in pairs]))
+    attackerOdds, targetOdds = PlayerModel.confrontOddsBatch(*columns)
+    for (attacker, target), batchAttacker, batchTarget in zip(pairs, attackerOdds.tolist(), targetOdds.tolist()):
+        if [batchAttacker, batchTarget] != PlayerModel.confrontOdds(attacker, target):
+            print('FAILED: confrontOddsBatch differs from confrontOdds for {} vs {}'.format(attacker, target))
+            sys.exit(1)
+    print('{} fights: lookup and confrontOddsBatch equal confrontOdds'.format(len(pairs)))
+
+    sample = pairs[-args.repeat:] if args.random else pairs[:args.repeat]
+    for name, function in (('confrontOdds', PlayerModel.confrontOdds), ('oddsTable.lookup', oddsTable.lookup)):
+        start = time.perf_counter()
+        for attacker, target in sample:
+            function(attacker, target)
+        print('{:<18} {:>8.3f} us / fight'.format(name, (time.perf_counter() - start) / len(sample) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
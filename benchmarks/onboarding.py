@@ -0,0 +1,63 @@
+""" Onboarding cost: registering --players players and creating --lobbies lobbies one request at a
+    time (POST /player-register, POST /create-lobby) against the bulk endpoints
+    (POST /player-register-batch, POST /create-lobby-batch, see onboarding.py).
+
+    Reports the wall time, SQL statements and commits of each way, on a fresh database each.
+
+    Usage:
+        python -m benchmarks.onboarding [--players 2000] [--lobbies 200] [--profile default] [--shards 0]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy.engine import Engine
+
+from benchmarks.support import createBenchmarkApp, StatementCounter
+
+
+def single(client, players, owners):
+    for player in players:
+        client.post('/player-register', json=player)
+    for owner in owners:
+        token = client.post('/auth', json=owner).get_json()['authorization']
+        client.post('/create-lobby', headers={'Authorization': 'JWT ' + token})
+
+
+def batch(client, players, owners):
+    results = client.post('/player-register-batch', json={'players': players}).get_json()['results']
+    assert all('succesfully' in result['message'] for result in results), results[:3]
+    results = client.post('/create-lobby-batch', json={'owners': owners}).get_json()['results']
+    assert all('lobbyId' in result for result in results), results[:3]
+
+
+def run(name, function, args, directory):
+    app = createBenchmarkApp(os.path.join(directory, name + '.db'), STORAGE_PROFILE=args.profile, SHARDS=args.shards,
+                             SHARD_DATABASE_URI='sqlite:///' + os.path.join(directory, name + '-shard{}.db'))
+    client = app.test_client()
+    players = [{'playerName': 'player{}'.format(index), 'secretKey': 'secret'} for index in range(args.players)]
+
+    with StatementCounter(Engine) as counter:
+        start = time.perf_counter()
+        function(client, players, players[:args.lobbies])
+        elapsed = time.perf_counter() - start
+    print('{:<8} {:>10.2f} {:>12} {:>9}'.format(name, elapsed, counter.statements, counter.commits))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--lobbies', type=int, default=200)
+    parser.add_argument('--profile', default='default', help='STORAGE_PROFILE of both runs')
+    parser.add_argument('--shards', type=int, default=0)
+    args = parser.parse_args()
+
+    print('{:<8} {:>10} {:>12} {:>9}'.format('mode', 'seconds', 'statements', 'commits'))
+    with tempfile.TemporaryDirectory() as directory:
+        run('single', single, args, directory)
+        run('batch', batch, args, directory)
+
+
+if __name__ == '__main__':
+    main()
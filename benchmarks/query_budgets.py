@@ -0,0 +1,355 @@
+""" SQL statement budgets of every endpoint.
+
+    Every rule registered on the application (app.py, metrics.py, Flask-JWT's /auth) must have at
+    least one scenario below, with the most statements and commits one of its requests may run.
+    The scenarios are run against seeded worlds of --players players per lobby; the check fails if
+    a request goes over its budget, if the statements of an endpoint grow with the number of
+    players (an N+1 through a lazy='dynamic' relationship or a findByPlayerId per player), or if
+    an endpoint has no budget. The statements of a failing request are printed, the ones it
+    repeated first. Every request must answer what its scenario expects, a request refused with
+    an error message would measure the wrong path.
+
+    Counts are taken with GAME_STATE='database' and the default storage profile, every engine
+    (replicas.py's read-only ones included) is counted. Budgets are upper bounds: lower one when
+    an endpoint gets cheaper.
+
+    Usage:
+        python -m benchmarks.query_budgets [--players 50,500,5000] [--repeat 3]
+"""
+import argparse
+import collections
+import itertools
+import json
+import os
+import sys
+import tempfile
+
+from sqlalchemy.engine import Engine
+
+from db import db
+from models.player import PlayerModel
+from benchmarks.support import createBenchmarkApp, seedLobby, seedWorld, StatementCounter
+
+#: Request spec: (method, url, json body, player whose token is sent or None)
+Request = collections.namedtuple('Request', ['method', 'url', 'body', 'player'])
+
+#: A scenario ('METHOD rule' and what it does) of requests built by build(world, i), its budget per request
+#: and expected(body), true when the request did what the scenario is about
+Budget = collections.namedtuple('Budget', ['scenario', 'build', 'statements', 'commits', 'expected'])
+
+
+def contains(text):
+    """ Check of a response whose body contains 'text'.
+
+    """
+    return lambda body: text in body
+
+
+def message(*texts):
+    """ Check of a response whose 'message', or the one of every item of its 'results', is one of 'texts'.
+
+    """
+    def check(body):
+        try:
+            response = json.loads(body)
+        except ValueError:
+            return False
+        if not isinstance(response, dict):
+            return False
+        items = response['results'] if isinstance(response.get('results'), list) else [response]
+        return bool(items) and all(isinstance(item, dict) and item.get('message') in texts for item in items)
+    return check
+
+
+class World:
+    """ The seeded players, lobbies and locations, and a source of fresh names for the scenarios.
+
+    """
+    def __init__(self, app, lobbies, freePlayers):
+        #: list of (lobbyId, locationIds, playerNames)
+        self.app         = app
+        self.lobbies     = lobbies
+        self.freePlayers = freePlayers
+        self.client      = app.test_client()
+        self.tokens      = {}
+        self.names       = itertools.count()
+        # Fighters are taken in pairs and never reused, a dead or sleeping player would change the path taken
+        self.fighters    = iter(lobbies[0][2][1:])
+
+    def token(self, playerName):
+        if playerName not in self.tokens:
+            response = self.client.post('/auth', json={'playerName': playerName, 'secretKey': 'secret'})
+            self.tokens[playerName] = response.get_json()['authorization']
+        return self.tokens[playerName]
+
+    def member(self):
+        return self.lobbies[0][2][0]
+
+    def newName(self, prefix):
+        return '{}{}'.format(prefix, next(self.names))
+
+
+def indexRequest(world, i):
+    return Request('GET', '/', None, None)
+
+
+def metricsRequest(world, i):
+    return Request('GET', '/metrics', None, None)
+
+
+def authRequest(world, i):
+    return Request('POST', '/auth', {'playerName': world.member(), 'secretKey': 'secret'}, None)
+
+
+def registerRequest(world, i):
+    return Request('POST', '/player-register', {'playerName': world.newName('new'), 'secretKey': 'secret'}, None)
+
+
+def registerBatchRequest(world, i):
+    players = [{'playerName': world.newName('batch'), 'secretKey': 'secret'} for _ in range(10)]
+    return Request('POST', '/player-register-batch', {'players': players}, None)
+
+
+def playerRequest(world, i):
+    return Request('GET', '/player/{}'.format(world.member()), None, None)
+
+
+def createLobbyRequest(world, i):
+    return Request('POST', '/create-lobby', None, world.freePlayers.pop())
+
+
+def createLobbyBatchRequest(world, i):
+    owners = [{'playerName': world.freePlayers.pop(), 'secretKey': 'secret'} for _ in range(5)]
+    return Request('POST', '/create-lobby-batch', {'owners': owners}, None)
+
+
+def lobbyRequest(world, i):
+    return Request('GET', '/lobby/{}'.format(world.lobbies[0][0]), None, None)
+
+
+def joinLobbyRequest(world, i):
+    # The seeded lobbies are full, every join gets a lobby of one player
+    owner = world.newName('host')
+    with world.app.app_context():
+        lobbyId, _ = seedLobby(1, owner)
+    return Request('POST', '/lobby/{}'.format(lobbyId), None, world.freePlayers.pop())
+
+
+def matchmakingRequest(world, i):
+    return Request('POST', '/matchmaking', None, world.freePlayers.pop())
+
+
+def deleteLobbyRequest(world, i):
+    owner = world.newName('doomed')
+    with world.app.app_context():
+        lobbyId, _ = seedLobby(len(world.lobbies[0][2]), owner)
+    return Request('DELETE', '/lobby/{}'.format(lobbyId), None, owner)
+
+
+def eventsRequest(world, i):
+    return Request('GET', '/lobby/{}/events'.format(world.lobbies[0][0]), None, None)
+
+
+def playerLocationRequest(world, i):
+    return Request('GET', '/player-location', None, world.member())
+
+
+def moveRequest(world, i):
+    # Back and forth between the home, where every player stands, and an empty location
+    return Request('POST', '/player-location', {'locationId': world.lobbies[0][1][(i + 1) % 2]}, world.member())
+
+
+def locationRequest(world, i):
+    return Request('GET', '/location/{}'.format(world.lobbies[0][1][0]), None, None)
+
+
+def actionRequest(world, i):
+    return Request('POST', '/action', {'action': ['sleep', 'wakeup', 'workout'][i % 3]}, world.member())
+
+
+def attackRequest(world, i):
+    attacker, target = next(world.fighters), next(world.fighters)
+    return Request('POST', '/action', {'action': 'attack', 'target': target}, attacker)
+
+
+def actionBatchRequest(world, i):
+    locationIds = world.lobbies[0][1]
+    # The member is asleep after the workouts of the previous scenarios and requests
+    actions = [{'action': 'wakeup'}, {'action': 'move', 'locationId': locationIds[2]}, {'action': 'sleep'}, {'action': 'wakeup'},
+               {'action': 'workout'}, {'action': 'move', 'locationId': locationIds[0]}]
+    return Request('POST', '/action-batch', {'actions': actions}, world.member())
+
+
+def confrontRequest(world, i):
+    return Request('POST', '/confront', {'player': world.lobbies[0][2][-1]}, world.member())
+
+
+def confrontBatchRequest(world, i):
+    attacks = [{'attacker': next(world.fighters), 'target': next(world.fighters)} for _ in range(4)]
+    return Request('POST', '/confront-batch', {'attacks': attacks}, world.member())
+
+
+def oddsRequest(world, i):
+    return Request('GET', '/odds?target={}'.format(world.lobbies[0][2][-1]), None, world.member())
+
+
+#: Answers of the requests that went through
+JOINED = 'You have succesfully joined the lobby!'
+MOVED  = 'You have succesfully changed locations.'
+ACTED  = ['You decided to sleep: +10 stamina', 'You are now awake', 'You decided to sleep: +10 strength -10 stamina']
+
+BUDGETS = [
+    Budget('GET /',                             indexRequest,            0,  0, contains("Dawn's API")),
+    Budget('GET /metrics',                      metricsRequest,          0,  0, contains('dawn_requests_total')),
+    Budget('POST /auth',                        authRequest,             1,  0, contains('"authorization"')),
+    Budget('POST /player-register',             registerRequest,         2,  1, message('Player was created succesfully!')),
+    Budget('POST /player-register-batch',       registerBatchRequest,    2,  1, message('Player was created succesfully!')),
+    Budget('GET /player/<string:playerName>',   playerRequest,           2,  0, contains('"playerName"')),
+    Budget('POST /create-lobby',                createLobbyRequest,      9,  1, message('Lobby was created succesfully!')),
+    Budget('POST /create-lobby-batch',          createLobbyBatchRequest, 9,  1, message('Lobby was created succesfully!')),
+    Budget('GET /lobby/<int:lobby_id>',         lobbyRequest,            2,  0, contains('"lobbySize"')),
+    Budget('POST /lobby/<int:lobby_id>',        joinLobbyRequest,        8,  1, message(JOINED)),
+    Budget('DELETE /lobby/<int:lobby_id>',      deleteLobbyRequest,      7,  1, message('Lobby has been deleted!')),
+    # The first request of the process reads the open lobbies, see openlobbies.py. The lobbies the joins
+    # above left with room are filled first
+    Budget('POST /matchmaking',                 matchmakingRequest,      10, 1, message(JOINED)),
+    Budget('GET /lobby/<int:lobby_id>/events',  eventsRequest,           1,  0, contains(': listening to lobby')),
+    Budget('GET /player-location',              playerLocationRequest,   2,  0, contains('"locationName"')),
+    Budget('POST /player-location',             moveRequest,             5,  1, message(MOVED)),
+    Budget('GET /location/<int:location_id>',   locationRequest,         2,  0, contains('"locationName"')),
+    Budget('POST /action sleep/wakeup/workout', actionRequest,           4,  1, message(*ACTED)),
+    Budget('POST /action attack',               attackRequest,           5,  1, message('kill', 'dead')),
+    Budget('POST /action-batch',                actionBatchRequest,      11, 1, message(MOVED, *ACTED)),
+    Budget('POST /confront',                    confrontRequest,         4,  0, contains('"playerName"')),
+    Budget('POST /confront-batch',              confrontBatchRequest,    10, 1, message('kill', 'dead')),
+    Budget('GET /odds',                         oddsRequest,             2,  0, contains('"attackerOdds"')),
+]
+
+
+def endpointOf(budget):
+    return ' '.join(budget.scenario.split()[:2])
+
+
+def endpoints(app):
+    """ 'METHOD rule' of every endpoint registered on the application.
+
+    """
+    found = set()
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        for method in rule.methods - {'HEAD', 'OPTIONS'}:
+            found.add('{} {}'.format(method, rule.rule))
+    return found
+
+
+def seed(app, numOfPlayers, repeat):
+    with app.app_context():
+        lobbies = seedWorld(2, numOfPlayers, 5)
+        free = ['free{}'.format(i) for i in range(10 * repeat)]
+        db.session.bulk_insert_mappings(PlayerModel, [{
+            'playerName': name, 'secretKey': 'secret', 'role': 'player', 'status': 'none', 'heldItem': 'none',
+            'strength': 100, 'stamina': 100, 'currentLobby': -1, 'homeId': -1, 'locationId': -1
+        } for name in free])
+        db.session.commit()
+    return World(app, lobbies, free)
+
+
+def send(world, request):
+    """ Sends 'request', returns (status code, body).
+
+    """
+    headers = {'Authorization': 'JWT ' + world.token(request.player)} if request.player else {}
+    response = getattr(world.client, request.method.lower())(request.url, json=request.body, headers=headers)
+    if(response.mimetype == 'text/event-stream'):
+        # Event streams are left open after their first line, only the statements run before the stream starts count
+        body = next(iter(response.response), b'')
+    else:
+        body = response.get_data()
+    response.close()
+    return response.status_code, body.decode('utf-8')
+
+
+def measure(numOfPlayers, args, directory):
+    """ Runs every scenario args.repeat times on a world of 'numOfPlayers' players per lobby.
+
+        Return:
+            tuple (endpoints of the app, [(statements, commits, executed) of the costliest request of every scenario])
+    """
+    app = createBenchmarkApp(os.path.join(directory, 'budgets{}.db'.format(numOfPlayers)))
+    world = seed(app, numOfPlayers, args.repeat)
+    results = []
+    with StatementCounter(Engine, record=True) as counter:
+        for budget in BUDGETS:
+            worst = (-1, -1, [])
+            for i in range(args.repeat):
+                request = budget.build(world, i)
+                if request.player:
+                    world.token(request.player)
+                counter.reset()
+                status, body = send(world, request)
+                # A request that failed would measure its error path, not the one the budget is for
+                if status >= 400 or not budget.expected(body):
+                    raise RuntimeError('{}: {} answered {} {}'.format(budget.scenario, request.url, status, body[:200]))
+                worst = max(worst, (counter.statements, counter.commits, counter.executed), key=lambda cost: cost[:2])
+            results.append(worst)
+    with app.app_context():
+        db.engine.dispose()
+    return endpoints(app), results
+
+
+def describe(executed):
+    """ Statements of a request grouped by text, the repeated ones first.
+
+    """
+    counts = collections.Counter(' '.join(statement.split()) for statement in executed)
+    return ['      {:>4} x {}{}'.format(count, text[:150], '  <- repeated' if count > 2 else '')
+            for text, count in sorted(counts.items(), key=lambda item: -item[1])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', default='50,500,5000', help='comma separated players per lobby')
+    parser.add_argument('--repeat', type=int, default=3, help='requests per scenario and world, the costliest counts')
+    args = parser.parse_args()
+
+    sizes = [int(value) for value in args.players.split(',')]
+    # Every attack takes two fighters that haven't fought yet
+    if min(sizes) <= 10 * args.repeat:
+        parser.error('--players must be over 10 times --repeat')
+    with tempfile.TemporaryDirectory() as directory:
+        measured = [measure(numOfPlayers, args, directory) for numOfPlayers in sizes]
+    registered = measured[0][0]
+
+    print('{:<34} {:>8} {}'.format('endpoint', 'budget', ' '.join('{:>10}'.format('{} pl.'.format(size)) for size in sizes)))
+    failures = []
+    for index, budget in enumerate(BUDGETS):
+        costs = [results[index] for _, results in measured]
+        problems = []
+        for size, (statements, commits, executed) in zip(sizes, costs):
+            if statements > budget.statements or commits > budget.commits:
+                problems.append(('{} statements, {} commits with {} players, over the budget'.format(statements, commits, size), executed))
+        for size, (statements, commits, executed) in zip(sizes[1:], costs[1:]):
+            if statements > costs[0][0]:
+                problems.append(('{} statements with {} players against {} with {}, grows with the players'.format(
+                    statements, size, costs[0][0], sizes[0]), executed))
+        print('{:<34} {:>8} {}  {}'.format(budget.scenario, '{}/{}'.format(budget.statements, budget.commits),
+                                           ' '.join('{:>10}'.format('{}/{}'.format(*cost[:2])) for cost in costs),
+                                           'FAILED' if problems else 'ok'))
+        if problems:
+            # The statements of the first problem are enough to spot the culprit
+            failures.append((budget.scenario, [message for message, _ in problems], problems[0][1]))
+
+    for endpoint in sorted(registered - {endpointOf(budget) for budget in BUDGETS}):
+        failures.append((endpoint, ['no budget declared, add a scenario to BUDGETS'], []))
+
+    for scenario, messages, executed in failures:
+        print('\n{}: {}'.format(scenario, '; '.join(messages)))
+        for line in describe(executed):
+            print(line)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+""" Read latency under a heavy write load, with and without read/write routing (replicas.py).
+
+    --writers threads move players with POST /player-location as fast as they can while
+    --readers threads poll GET /lobby/<id> and GET /player-location, for a fixed duration, on the
+    'production' storage profile with a writer pool of --pool-size connections. Runs once with
+    READ_ROUTING off (reads check out connections from the writers' pool) and once with it on
+    (reads use mode=ro connections of their own). Reports p50/p95 read latency, reads and writes
+    per second and failed requests.
+
+    Usage:
+        python -m benchmarks.read_routing [--writers 12] [--readers 4] [--seconds 5] [--pool-size 4]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from db import db
+from benchmarks.support import createBenchmarkApp, seedWorld
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def run(routing, args, directory):
+    app = createBenchmarkApp(os.path.join(directory, 'routing{}.db'.format(int(routing))), STORAGE_PROFILE='production',
+                             READ_ROUTING=routing, SQLALCHEMY_ENGINE_OPTIONS={'pool_size': args.pool_size, 'max_overflow': 0})
+    with app.app_context():
+        world = seedWorld(args.lobbies, args.players, 5)
+
+    client = app.test_client()
+    players = []
+    for lobbyId, locationIds, names in world:
+        for name in names:
+            token = client.post('/auth', json={'playerName': name, 'secretKey': 'secret'}).get_json()['authorization']
+            players.append(({'Authorization': 'JWT ' + token}, lobbyId, locationIds))
+
+    latencies = {'read': [], 'write': []}
+    failures = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def worker(kind):
+        threadClient = app.test_client()
+        while time.perf_counter() < deadline:
+            headers, lobbyId, locationIds = random.choice(players)
+            start = time.perf_counter()
+            try:
+                if kind == 'write':
+                    response = threadClient.post('/player-location', json={'locationId': random.choice(locationIds)}, headers=headers)
+                    failed = response.get_json().get('message') == 'Error saving to the DB!'
+                elif random.random() < .5:
+                    failed = threadClient.get('/lobby/{}'.format(lobbyId)).status_code != 200
+                else:
+                    failed = 'locationId' not in threadClient.get('/player-location', headers=headers).get_json()
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[kind].append(elapsed)
+                failures[0] += failed
+
+    threads = [threading.Thread(target=worker, args=('write',)) for _ in range(args.writers)] + \
+              [threading.Thread(target=worker, args=('read',)) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        db.engine.dispose()
+
+    print('{:<9} {:>12.2f} {:>12.2f} {:>9.0f} {:>10.0f} {:>9}'.format(
+        'on' if routing else 'off', percentile(latencies['read'], .5) * 1e3, percentile(latencies['read'], .95) * 1e3,
+        len(latencies['read']) / args.seconds, len(latencies['write']) / args.seconds, failures[0]
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=12)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--pool-size', type=int, default=4, help='connections of the writers\' pool')
+    parser.add_argument('--lobbies', type=int, default=4)
+    parser.add_argument('--players', type=int, default=25, help='players per lobby')
+    args = parser.parse_args()
+
+    print('{:<9} {:>12} {:>12} {:>9} {:>10} {:>9}'.format('routing', 'read p50 ms', 'read p95 ms', 'reads/s', 'writes/s', 'failures'))
+    with tempfile.TemporaryDirectory() as directory:
+        for routing in (False, True):
+            run(routing, args, directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+""" Checks that the game rules answer the same on every path that runs them.
+
+    The rules of /action and /player-location have two copies: the database path of
+    resources/player.py, and gamestate.py's, which serves the in-memory store and POST /action-batch.
+    Every scenario below starts from a fresh lobby, sends one move or action through
+
+        database    POST /action or /player-location with GAME_STATE='database'
+        memory      the same request with GAME_STATE='memory', flushed afterwards
+        batch       POST /action-batch with that one action, GAME_STATE='database'
+
+    and checks that the three paths return the same message and leave the same players and
+    locations rows (versions aside). Fights are decided with the same numpy seed on every path.
+
+    Exits with status 1 if a path disagrees.
+
+    Usage:
+        python -m benchmarks.rule_parity
+"""
+import collections
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from db import db
+from gamestate import gameState
+from models.player import PlayerModel
+from models.locations import LocationModel
+from benchmarks.support import createBenchmarkApp, seedWorld
+
+#: A scenario: changes made to the rows of the attacker and its target before the request, and
+#: the request, {'action': ...} or {'action': 'move', 'locationId': ...}, built from the lobby's locationIds
+Scenario = collections.namedtuple('Scenario', ['name', 'attacker', 'target', 'build'])
+
+UNKNOWN_LOCATION = 10 ** 6
+
+SCENARIOS = [
+    Scenario('move',                     {}, {}, lambda locations: {'action': 'move', 'locationId': locations[1]}),
+    Scenario('move where already',       {}, {}, lambda locations: {'action': 'move', 'locationId': locations[0]}),
+    Scenario('move to unknown location', {}, {}, lambda locations: {'action': 'move', 'locationId': UNKNOWN_LOCATION}),
+    Scenario('move out of stamina',      {'stamina': 10}, {}, lambda locations: {'action': 'move', 'locationId': locations[1]}),
+    Scenario('sleep',                    {}, {}, lambda locations: {'action': 'sleep'}),
+    Scenario('wakeup',                   {'status': 'sleep'}, {}, lambda locations: {'action': 'wakeup'}),
+    Scenario('workout',                  {}, {}, lambda locations: {'action': 'workout'}),
+    Scenario('workout out of stamina',   {'stamina': 0}, {}, lambda locations: {'action': 'workout'}),
+    Scenario('workout asleep',           {'status': 'sleep'}, {}, lambda locations: {'action': 'workout'}),
+    Scenario('unsupported action',       {}, {}, lambda locations: {'action': 'dance'}),
+    Scenario('attack',                   {}, {}, lambda locations: {'action': 'attack'}),
+    Scenario('attack dead target',       {}, {'status': 'dead'}, lambda locations: {'action': 'attack'}),
+    Scenario('attack dead target away',  {}, {'status': 'dead', 'away': True}, lambda locations: {'action': 'attack'}),
+    Scenario('attack target away',       {}, {'away': True}, lambda locations: {'action': 'attack'}),
+    Scenario('attack unknown target',    {}, {'name': 'nobody'}, lambda locations: {'action': 'attack'}),
+]
+
+
+def prepare(scenario, locations, names):
+    """ Applies the changes of 'scenario' to the attacker (names[0]) and the target (names[1]).
+
+        Return:
+            the request of the scenario, with the target's name for attacks.
+    """
+    for playerName, changes in ((names[0], scenario.attacker), (names[1], scenario.target)):
+        changes = dict(changes)
+        changes.pop('name', None)
+        if changes.pop('away', False):
+            changes['locationId'] = locations[2]
+            LocationModel.query.filter_by(id=locations[0]).update({'numOfPlayers': LocationModel.numOfPlayers - 1})
+            LocationModel.query.filter_by(id=locations[2]).update({'numOfPlayers': LocationModel.numOfPlayers + 1})
+        if changes:
+            PlayerModel.query.filter_by(playerName=playerName).update(changes)
+    db.session.commit()
+
+    action = scenario.build(locations)
+    if(action['action'] == 'attack'):
+        action['target'] = scenario.target.get('name', names[1])
+    return action
+
+
+def state():
+    """ The rows the rules change, without their versions.
+
+    """
+    players = sorted(tuple(row) for row in db.session.query(
+        PlayerModel.playerName, PlayerModel.status, PlayerModel.strength, PlayerModel.stamina, PlayerModel.locationId))
+    locations = sorted(tuple(row) for row in db.session.query(LocationModel.id, LocationModel.numOfPlayers))
+    return players, locations
+
+
+def run(directory, scenario, path):
+    """ Runs 'scenario' on 'path' ('database', 'memory' or 'batch') against a fresh lobby.
+
+        Return:
+            tuple (message returned, state() afterwards)
+    """
+    app = createBenchmarkApp(os.path.join(directory, '{}-{}.db'.format(scenario.name.replace(' ', '-'), path)),
+                             GAME_STATE='memory' if path == 'memory' else 'database')
+    with app.app_context():
+        (_, locations, names), = seedWorld(1, 3, 2)
+        action = prepare(scenario, locations, names)
+
+    client = app.test_client()
+    token = client.post('/auth', json={'playerName': names[0], 'secretKey': 'secret'}).get_json()['authorization']
+    headers = {'Authorization': 'JWT ' + token}
+    np.random.seed(0)
+    if(path == 'batch'):
+        response = client.post('/action-batch', json={'actions': [action]}, headers=headers).get_json()
+        response = response['results'][0] if 'results' in response else response
+    elif(action['action'] == 'move'):
+        response = client.post('/player-location', json={'locationId': action['locationId']}, headers=headers).get_json()
+    else:
+        response = client.post('/action', json={'action': action['action'], 'target': action.get('target')}, headers=headers).get_json()
+
+    if(path == 'memory'):
+        gameState.stop(app)
+        gameState.clear()
+    with app.app_context():
+        rows = state()
+        db.engine.dispose()
+    return response.get('message'), rows
+
+
+def main():
+    paths = ['database', 'memory', 'batch']
+    failures = []
+    print('{:<26} {}'.format('scenario', '   '.join('{:<34}'.format(path) for path in paths)))
+    with tempfile.TemporaryDirectory() as directory:
+        for scenario in SCENARIOS:
+            outcomes = [run(directory, scenario, path) for path in paths]
+            print('{:<26} {}'.format(scenario.name, '   '.join('{:<34}'.format(message[:34]) for message, _ in outcomes)))
+            reference = outcomes[0]
+            for path, outcome in zip(paths[1:], outcomes[1:]):
+                if outcome[0] != reference[0]:
+                    failures.append('{}: {} answers {!r}, database answers {!r}'.format(scenario.name, path, outcome[0], reference[0]))
+                elif outcome[1] != reference[1]:
+                    failures.append('{}: {} leaves other rows than database'.format(scenario.name, path))
+
+    for failure in failures:
+        print('FAILED: {}'.format(failure))
+    print('OK' if not failures else '{} checks failed'.format(len(failures)))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
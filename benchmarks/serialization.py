@@ -0,0 +1,66 @@
+""" Query count and latency of the lobby and location serialization paths.
+
+    Compares the ORM path (findById(...).json(), which walks the lazy='dynamic'
+    players relationship) with the single-query jsonById(...) path used by
+    GET /lobby/<id> and GET /location/<id>, for lobbies of growing size.
+
+    Usage:
+        python -m benchmarks.serialization [--sizes 10,100,1000,5000] [--repeat 50]
+"""
+import argparse
+import os
+import tempfile
+
+from db import db
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+from benchmarks.support import createBenchmarkApp, seedLobby, StatementCounter, timeit
+
+
+def measure(app, function, repeat):
+    """ Returns (statements per call, mean latency in ms) of 'function', each call with a fresh session.
+
+    """
+    def request():
+        with app.test_request_context():
+            function()
+            db.session.remove()
+
+    with app.app_context():
+        with StatementCounter(db.engine) as counter:
+            request()
+            statements = counter.statements
+    return statements, timeit(request, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000,5000')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    print('{:<10} {:>8} {:<9} {:>10} {:>12}'.format('endpoint', 'players', 'path', 'queries', 'latency ms'))
+    for size in (int(value) for value in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as directory:
+            app = createBenchmarkApp(os.path.join(directory, 'bench.db'))
+            with app.app_context():
+                lobbyId, locationId = seedLobby(size)
+                assert LobbyModel.findById(lobbyId).json() == LobbyModel.jsonById(lobbyId)
+                assert LocationModel.findById(locationId).json() == LocationModel.jsonById(locationId)
+
+            paths = [
+                ('lobby',    'before', lambda: LobbyModel.findById(lobbyId).json()),
+                ('lobby',    'after',  lambda: LobbyModel.jsonById(lobbyId)),
+                ('location', 'before', lambda: LocationModel.findById(locationId).json()),
+                ('location', 'after',  lambda: LocationModel.jsonById(locationId)),
+            ]
+            for endpoint, path, function in paths:
+                statements, latency = measure(app, function, args.repeat)
+                print('{:<10} {:>8} {:<9} {:>10} {:>12.3f}'.format(endpoint, size, path, statements, latency))
+
+            with app.app_context():
+                db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
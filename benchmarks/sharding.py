@@ -0,0 +1,116 @@
+""" Write throughput of the game with its lobbies spread over 0 (one database file), 2, 4... shards.
+
+    Each of --processes worker processes (as gunicorn workers would be) owns one lobby and
+    moves its owner back and forth between two locations for a fixed duration, through
+    POST /player-location. Lobbies are created through the API, so with shards they are spread
+    round-robin over the shard files. Reports moves per second over all workers, p95 latency and
+    failed moves ("database is locked" and the like).
+
+    Usage:
+        python -m benchmarks.sharding [--shards 0,2,4] [--processes 4] [--seconds 5] [--profile default]
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.support import createBenchmarkApp
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def setUp(config, processes):
+    """ Creates one lobby per worker and gives its owner enough stamina to move for the whole run.
+
+        Return:
+            list of (playerName, [storeId, homeId]), one per worker, who starts at home.
+    """
+    from db import db
+    from models.player import PlayerModel
+    from sharding import shards
+
+    app = createBenchmarkApp(**config)
+    client = app.test_client()
+    owners = []
+    for index in range(processes):
+        name = 'owner{}'.format(index)
+        client.post('/player-register', json={'playerName': name, 'secretKey': 'secret'})
+        token = client.post('/auth', json={'playerName': name, 'secretKey': 'secret'}).get_json()['authorization']
+        client.post('/create-lobby', headers={'Authorization': 'JWT ' + token})
+
+        player = client.get('/player/' + name).get_json()
+        lobby = client.get('/lobby/{}'.format(player['currentLobby'])).get_json()
+        store = [other['locationId'] for other in lobby['players'] if other['role'] == 'npc'][0]
+        owners.append((name, [store, player['homeId']]))
+
+        with app.app_context():
+            with shards.lobby(player['currentLobby']):
+                PlayerModel.query.filter_by(currentLobby=player['currentLobby']).update({'stamina': 10 ** 9})
+            db.session.commit()
+    return owners
+
+
+def worker(config, owner, seconds, barrier, results):
+    name, locationIds = owner
+    app = createBenchmarkApp(SCHEMA_BOOTSTRAP=False, **config)
+    client = app.test_client()
+    token = client.post('/auth', json={'playerName': name, 'secretKey': 'secret'}).get_json()['authorization']
+    headers = {'Authorization': 'JWT ' + token}
+
+    latencies, failures = [], 0
+    barrier.wait()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        message = client.post('/player-location', json={'locationId': locationIds[len(latencies) % 2]}, headers=headers).get_json()['message']
+        latencies.append(time.perf_counter() - start)
+        failures += message != 'You have succesfully changed locations.'
+    results.put((latencies, failures))
+
+
+def run(shardCount, args, directory):
+    config = {
+        'path'              : os.path.join(directory, 'directory{}.db'.format(shardCount)),
+        'SHARDS'            : shardCount,
+        'SHARD_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'shards{}-{{}}.db'.format(shardCount)),
+        'STORAGE_PROFILE'   : args.profile
+    }
+    context = multiprocessing.get_context('spawn')
+    setUpProcess = context.Pool(1)
+    owners = setUpProcess.apply(setUp, (config, args.processes))
+    setUpProcess.close()
+
+    barrier = context.Barrier(args.processes)
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(config, owner, args.seconds, barrier, results)) for owner in owners]
+    for process in workers:
+        process.start()
+    outcomes = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+
+    latencies = [latency for outcome in outcomes for latency in outcome[0]]
+    print('{:<8} {:>10.0f} {:>12.2f} {:>9}'.format(
+        shardCount, len(latencies) / args.seconds, percentile(latencies, .95) * 1e3, sum(outcome[1] for outcome in outcomes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', default='0,2,4', help='comma separated shard counts, 0 is a single database file')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--profile', default='default', help='STORAGE_PROFILE of every run')
+    args = parser.parse_args()
+
+    print('{:<8} {:>10} {:>12} {:>9}'.format('shards', 'moves/s', 'p95 ms', 'failures'))
+    with tempfile.TemporaryDirectory() as directory:
+        for shardCount in [int(value) for value in args.shards.split(',')]:
+            run(shardCount, args, directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+""" Startup cost of the application, measured in fresh interpreters.
+
+    For each run a new Python process imports app.py, builds the application with
+    create_app() (schema bootstrap included) on a database that already exists,
+    and sends a few GET /lobby/<id> requests. Reports the median of the runs for
+    the import, create_app() and the first request, next to the median of the
+    requests that follow it, and whether numpy was loaded at each step.
+
+    Usage:
+        python -m benchmarks.startup [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.support import createBenchmarkApp, seedLobby
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: Runs in the child interpreter, prints its measurements as JSON
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+numpyAfterImport = 'numpy' in sys.modules
+flaskApp = app.create_app({{'SQLALCHEMY_DATABASE_URI': 'sqlite:///{path}', 'GAME_STATE': 'database'}})
+created = time.perf_counter()
+numpyAfterCreate = 'numpy' in sys.modules
+
+client = flaskApp.test_client()
+requests = []
+for _ in range(21):
+    before = time.perf_counter()
+    assert client.get('/lobby/{lobbyId}').status_code == 200
+    requests.append(time.perf_counter() - before)
+print(json.dumps({{
+    'import': imported - start, 'create_app': created - imported, 'first': requests[0],
+    'following': sorted(requests[1:])[len(requests) // 2], 'numpyAfterImport': numpyAfterImport,
+    'numpyAfterCreate': numpyAfterCreate, 'numpyAfterRequests': 'numpy' in sys.modules
+}}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        app = createBenchmarkApp(path)
+        with app.app_context():
+            lobbyId, _ = seedLobby(10)
+
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.check_output([sys.executable, '-c', CHILD.format(path=path, lobbyId=lobbyId)], cwd=ROOT)
+            runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    print('{:<24} {:>10}'.format('step', 'median ms'))
+    for step in ('import', 'create_app', 'first', 'following'):
+        label = {'first': 'first request', 'following': 'following requests'}.get(step, step)
+        print('{:<24} {:>10.2f}'.format(label, statistics.median(run[step] for run in runs) * 1e3))
+    print('numpy loaded after import: {}, after create_app: {}, after the requests: {}'.format(
+        runs[0]['numpyAfterImport'], runs[0]['numpyAfterCreate'], runs[0]['numpyAfterRequests']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+""" Mixed read/write throughput of every storage profile in storage.py.
+
+    Several threads hammer one database with GET /lobby/<id> reads and
+    POST /player-location writes for a fixed duration. Reports requests per
+    second, p95 latency and how many requests failed (e.g. "database is locked").
+
+    Usage:
+        python -m benchmarks.storage_profiles [--profiles default,production] [--threads 8] [--seconds 5] [--writes 0.2]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from db import db
+from storage import STORAGE_PROFILES
+from benchmarks.support import createBenchmarkApp, seedWorld
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def run(profile, args, directory):
+    app = createBenchmarkApp(os.path.join(directory, profile + '.db'), STORAGE_PROFILE=profile)
+    with app.app_context():
+        world = seedWorld(args.lobbies, args.players, 5)
+
+    client = app.test_client()
+    tokens = {}
+    for lobbyId, locationIds, names in world:
+        for name in names:
+            token = client.post('/auth', json={'playerName': name, 'secretKey': 'secret'}).get_json()['authorization']
+            tokens[token] = (lobbyId, locationIds)
+
+    latencies = {'read': [], 'write': []}
+    failures = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def worker():
+        threadClient = app.test_client()
+        tokenList = list(tokens)
+        while time.perf_counter() < deadline:
+            token = random.choice(tokenList)
+            lobbyId, locationIds = tokens[token]
+            kind = 'write' if random.random() < args.writes else 'read'
+            start = time.perf_counter()
+            try:
+                if kind == 'write':
+                    response = threadClient.post('/player-location', json={'locationId': random.choice(locationIds)},
+                                                 headers={'Authorization': 'JWT ' + token})
+                    failed = response.get_json().get('message') == 'Error saving to the DB!'
+                else:
+                    failed = threadClient.get('/lobby/{}'.format(lobbyId)).status_code != 200
+            except Exception:
+                failed = True
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[kind].append(elapsed)
+                failures[0] += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        db.engine.dispose()
+
+    total = len(latencies['read']) + len(latencies['write'])
+    print('{:<12} {:>9.0f} {:>14.2f} {:>15.2f} {:>9}'.format(
+        profile, total / args.seconds,
+        percentile(latencies['read'], .95) * 1e3, percentile(latencies['write'], .95) * 1e3, failures[0]
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', default=','.join(STORAGE_PROFILES))
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writes', type=float, default=.2, help='fraction of requests that are writes')
+    parser.add_argument('--lobbies', type=int, default=4)
+    parser.add_argument('--players', type=int, default=25, help='players per lobby')
+    args = parser.parse_args()
+
+    print('{:<12} {:>9} {:>14} {:>15} {:>9}'.format('profile', 'req/s', 'read p95 ms', 'write p95 ms', 'failures'))
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in args.profiles.split(','):
+            run(profile, args, directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+""" Helpers shared by the benchmarks: a throwaway application, a world seeder and a SQL statement counter.
+"""
+import time
+
+from sqlalchemy import event
+
+from db import db
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+
+
+def createBenchmarkApp(path, **config):
+    """ Builds an application with create_app() on the SQLite file 'path' and creates the tables.
+
+        Args:
+            path: SQLite file to use.
+            config: app.config values to override, e.g. STORAGE_PROFILE='production'.
+
+        Return:
+            the Flask application, ready to be driven with app.test_client()
+    """
+    from app import create_app
+
+    settings = {
+        'SQLALCHEMY_DATABASE_URI'  : 'sqlite:///' + path,
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+        'SQLITE_PRAGMAS'           : {},
+        'STORAGE_PROFILE'          : 'default',
+        'GAME_STATE'               : 'database'
+    }
+    settings.update(config)
+    return create_app(settings)
+
+
+def seedLobby(numOfPlayers, owner='owner'):
+    """ Creates one lobby whose 'numOfPlayers' players all stand at the owner's home.
+
+        Note:
+            Rows are inserted with bulk_insert_mappings, it must be called inside an app context.
+
+        Return:
+            tuple (lobbyId, locationId)
+    """
+    lobby = LobbyModel(owner)
+    lobby.lobbySize = numOfPlayers
+    home = LocationModel(owner, 'home')
+    home.numOfPlayers = numOfPlayers
+    db.session.add_all([lobby, home])
+    db.session.flush()
+
+    db.session.bulk_insert_mappings(PlayerModel, [{
+        'playerName'  : owner if i == 0 else '{}{}'.format(owner, i),
+        'secretKey'   : 'secret',
+        'role'        : 'player',
+        'status'      : 'none',
+        'heldItem'    : 'none',
+        'strength'    : 100,
+        'stamina'     : 100,
+        'currentLobby': lobby.lobbyId,
+        'homeId'      : home.id,
+        'locationId'  : home.id
+    } for i in range(numOfPlayers)])
+    db.session.commit()
+    return lobby.lobbyId, home.id
+
+
+def seedWorld(lobbies, playersPerLobby, locationsPerLobby):
+    """ Creates 'lobbies' lobbies, each with 'playersPerLobby' players and 'locationsPerLobby' empty locations.
+
+        Note:
+            Every player's secretKey is 'secret' and their stamina is high enough to keep moving.
+            Must be called inside an app context.
+
+        Return:
+            list of (lobbyId, locationIds, playerNames), one per lobby
+    """
+    world = []
+    for number in range(lobbies):
+        owner = 'lobby{}p'.format(number)
+        lobbyId, homeId = seedLobby(playersPerLobby, owner)
+        locations = [LocationModel(owner, 'location{}'.format(i)) for i in range(locationsPerLobby)]
+        for location in locations:
+            location.numOfPlayers = 0
+        db.session.add_all(locations)
+        db.session.commit()
+        names = [owner] + ['{}{}'.format(owner, i) for i in range(1, playersPerLobby)]
+        world.append((lobbyId, [homeId] + [location.id for location in locations], names))
+
+    PlayerModel.query.update({'stamina': 10 ** 9})
+    db.session.commit()
+    return world
+
+
+class StatementCounter:
+    """ Counts the SQL statements and commits an engine executes, or every engine when given the Engine class.
+
+        Note:
+            with StatementCounter(db.engine) as counter:
+                ...
+            print(counter.statements, counter.commits)
+
+        With record=True the text of every statement is kept in counter.executed.
+    """
+
+    def __init__(self, engine, record=False):
+        self.engine     = engine
+        self.record     = record
+        self.statements = 0
+        self.commits    = 0
+        self.executed   = []
+
+    def __countStatement(self, connection, cursor, statement, *args):
+        self.statements += 1
+        if self.record:
+            self.executed.append(statement)
+
+    def __countCommit(self, *args):
+        self.commits += 1
+
+    def reset(self):
+        self.statements = 0
+        self.commits    = 0
+        self.executed   = []
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self.__countStatement)
+        event.listen(self.engine, 'commit', self.__countCommit)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self.__countStatement)
+        event.remove(self.engine, 'commit', self.__countCommit)
+
+
+def timeit(function, repeat):
+    """ Calls 'function' 'repeat' times and returns the mean duration in milliseconds.
+
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e3
@@ -0,0 +1,79 @@
+""" Cost of a game tick (ticks.py) on a lobby of --players players, half of them asleep, against
+    the same rules applied one player at a time with a read-modify-commit each, the way
+    /action and /player-location change a player.
+
+    Reports milliseconds, SQL statements and commits per pass.
+
+    Usage:
+        python -m benchmarks.ticks [--players 100,1000,10000] [--per-player-max 2000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy.engine import Engine
+
+from db import db
+from models.player import PlayerModel
+from ticks import runTick
+from benchmarks.support import createBenchmarkApp, seedLobby, StatementCounter
+
+
+def putToSleep(lobbyId):
+    """ Every other player sleeps, with a stamina between 0 and 90.
+
+    """
+    players = db.session.query(PlayerModel.id).filter_by(currentLobby=lobbyId).order_by(PlayerModel.id).all()
+    db.session.bulk_update_mappings(PlayerModel, [
+        {'id': row.id, 'status': 'sleep', 'stamina': index % 10 * 10} for index, row in enumerate(players) if index % 2
+    ])
+    db.session.commit()
+
+
+def perPlayer(app, lobbyId):
+    regen, maxStamina, wakeStamina = app.config['TICK_STAMINA_REGEN'], app.config['TICK_MAX_STAMINA'], app.config['TICK_WAKE_STAMINA']
+    for row in db.session.query(PlayerModel.id).filter_by(currentLobby=lobbyId).all():
+        player = PlayerModel.findByPlayerId(row.id)
+        if(player.status == 'sleep' and player.stamina < maxStamina):
+            player.stamina = min(player.stamina + regen, maxStamina)
+        if(player.status == 'sleep' and player.stamina >= wakeStamina):
+            player.status = 'none'
+        elif(player.status == 'none' and player.stamina <= 0):
+            player.status = 'sleep'
+        player.save_to_db()
+
+
+def run(numOfPlayers, args, directory):
+    app = createBenchmarkApp(os.path.join(directory, 'ticks{}.db'.format(numOfPlayers)))
+    cells = []
+    with app.app_context():
+        lobbyId, _ = seedLobby(numOfPlayers)
+        for name, tick in (('per-player', lambda: perPlayer(app, lobbyId)), ('tick', runTick)):
+            if name == 'per-player' and numOfPlayers > args.per_player_max:
+                cells.append('{:>10} {:>10} {:>8}'.format('-', '-', '-'))
+                continue
+            putToSleep(lobbyId)
+            with StatementCounter(Engine) as counter:
+                start = time.perf_counter()
+                tick()
+                elapsed = time.perf_counter() - start
+            cells.append('{:>10.1f} {:>10} {:>8}'.format(elapsed * 1e3, counter.statements, counter.commits))
+    print('{:<8} {} {}'.format(numOfPlayers, *cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', default='100,1000,10000', help='comma separated lobby sizes')
+    parser.add_argument('--per-player-max', type=int, default=2000, help='largest lobby the per-player pass runs on')
+    args = parser.parse_args()
+
+    print('{:<8} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8}'.format('players', 'player ms', 'statements', 'commits',
+                                                                 'tick ms', 'statements', 'commits'))
+    with tempfile.TemporaryDirectory() as directory:
+        for numOfPlayers in [int(value) for value in args.players.split(',')]:
+            run(numOfPlayers, args, directory)
+
+
+if __name__ == '__main__':
+    main()
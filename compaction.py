@@ -0,0 +1,247 @@
+""" Deleting lobbies with everything they own, and collecting what deleted lobbies left behind.
+
+CreateLobby.post creates, besides the lobby, a home per player, a store, a police station and two
+NPCs. deleteLobby removes all of them with a few set-based statements: one UPDATE takes the players
+out of the lobby, one DELETE per table removes its NPCs, locations and the lobby itself.
+
+Lobbies deleted before it left their locations and NPCs behind. collectOrphans finds them and
+deletes them in batches of COMPACTION_BATCH_SIZE rows, one commit per batch so the write lock is
+never held for long:
+
+    - a location is an orphan when no player lives in it or stands in it (homeId, locationId).
+    - an NPC is an orphan when its lobby doesn't exist anymore.
+
+'flask compact' runs it once and reports the rows reclaimed, --vacuum and --analyze then rebuild
+the database files and refresh the statistics of the query planner. With COMPACTION_INTERVAL set,
+a background thread collects the orphans every COMPACTION_INTERVAL seconds.
+"""
+import os
+import threading
+
+import click
+from flask import current_app
+from sqlalchemy import exists, or_
+
+from db import db, shardBind
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+from security import identityCache
+from occupancy import occupancyIndex
+from openlobbies import openLobbies
+from sharding import shards
+
+
+def deleteLobby(lobbyId):
+    """ Deletes the lobby 'lobbyId' with its locations and NPCs, its players are left in no lobby
+        with the stats they ended with. Nothing is committed.
+
+    """
+    with shards.lobby(lobbyId):
+        members = db.session.query(PlayerModel.id, PlayerModel.role, PlayerModel.homeId).filter_by(currentLobby=lobbyId).all()
+        # Every location of a lobby is the home of one of its players or NPCs. The locations the members stand in
+        # can be another lobby's (moves can go anywhere), any other location left behind is for collectOrphans
+        locationIds = {row.homeId for row in members}
+        npcIds = [row.id for row in members if row.role == 'npc']
+
+        if(shards.enabled):
+            shards.leave(lobbyId)
+            with shards.directory():
+                PlayerModel.query.filter(PlayerModel.id.in_(npcIds)).delete(synchronize_session=False)
+        else:
+            PlayerModel.query.filter_by(currentLobby=lobbyId, role='npc').delete(synchronize_session=False)
+            PlayerModel.query.filter_by(currentLobby=lobbyId).update({
+                'currentLobby': -1,
+                'homeId'      : -1,
+                'locationId'  : -1,
+                'version'     : PlayerModel.version + 1
+            }, synchronize_session=False)
+
+        LocationModel.query.filter(LocationModel.id.in_(locationIds)).delete(synchronize_session=False)
+        LobbyModel.query.filter_by(lobbyId=lobbyId).delete(synchronize_session=False)
+
+    for npcId in npcIds:
+        identityCache.invalidate(npcId)
+    occupancyIndex.invalidate(*locationIds)
+    openLobbies.remove(lobbyId)
+
+
+# Orphans
+
+def orphanLocation():
+    return ~exists().where(or_(PlayerModel.homeId == LocationModel.id, PlayerModel.locationId == LocationModel.id))
+
+
+def orphanNpc():
+    return (PlayerModel.role == 'npc') & ~exists().where(LobbyModel.lobbyId == PlayerModel.currentLobby)
+
+
+def deleteInBatches(column, condition, batchSize):
+    """ Deletes the rows whose 'column' matches 'condition', 'batchSize' rows and one commit at a time.
+
+        Note:
+            'condition' is checked again by the DELETE, a row that stopped being an orphan since it
+            was selected is kept.
+
+        Return:
+            number of rows deleted.
+    """
+    model, deleted = column.class_, 0
+    while True:
+        ids = [row[0] for row in db.session.query(column).filter(condition).limit(batchSize)]
+        if not ids:
+            return deleted
+        deleted += model.query.filter(column.in_(ids), condition).delete(synchronize_session=False)
+        db.session.commit()
+        if model is PlayerModel:
+            for playerId in ids:
+                identityCache.invalidate(playerId)
+
+
+def deleteDirectoryNpcs(batchSize):
+    """ Deletes the NPC accounts of the directory whose lobby doesn't exist in its shard.
+
+        Note:
+            The lobbies of the shards are read before the accounts: an account whose lobby id is
+            above the last lobby of its shard belongs to a lobby being created and is kept.
+    """
+    lobbyIds, lastIds = set(), {}
+    for index in range(shards.count):
+        with shards.shard(index):
+            ids = [row[0] for row in db.session.query(LobbyModel.lobbyId)]
+        lobbyIds.update(ids)
+        lastIds[index] = max(ids, default=-1)
+
+    orphanIds, lastId = [], 0
+    with shards.directory():
+        while True:
+            rows = db.session.query(PlayerModel.id, PlayerModel.currentLobby) \
+                .filter(PlayerModel.role == 'npc', PlayerModel.id > lastId) \
+                .order_by(PlayerModel.id).limit(batchSize).all()
+            if not rows:
+                break
+            lastId = rows[-1].id
+            orphanIds += [row.id for row in rows if row.currentLobby in (None, -1) or (
+                row.currentLobby not in lobbyIds and row.currentLobby <= lastIds[shards.indexOf(row.currentLobby)])]
+
+        deleted = 0
+        for start in range(0, len(orphanIds), batchSize):
+            ids = orphanIds[start:start + batchSize]
+            deleted += PlayerModel.query.filter(PlayerModel.id.in_(ids), PlayerModel.role == 'npc') \
+                .delete(synchronize_session=False)
+            db.session.commit()
+            for playerId in ids:
+                identityCache.invalidate(playerId)
+    return deleted
+
+
+def collectOrphans(batchSize=None):
+    """ Deletes the orphaned locations and NPCs of every database, see above.
+
+        Args:
+            batchSize: rows deleted per commit, defaults to app.config['COMPACTION_BATCH_SIZE'].
+
+        Return:
+            list of (database, table, rows deleted), the database being 'main' or the name of a shard.
+    """
+    batchSize = batchSize or current_app.config['COMPACTION_BATCH_SIZE']
+    reclaimed = []
+    with shards.directory():
+        reclaimed.append(('main', 'locations', deleteInBatches(LocationModel.id, orphanLocation(), batchSize)))
+        if(shards.enabled):
+            reclaimed.append(('main', 'players', deleteDirectoryNpcs(batchSize)))
+        else:
+            reclaimed.append(('main', 'players', deleteInBatches(PlayerModel.id, orphanNpc(), batchSize)))
+
+    for index in range(shards.count):
+        with shards.shard(index):
+            reclaimed.append((shardBind(index), 'locations', deleteInBatches(LocationModel.id, orphanLocation(), batchSize)))
+            reclaimed.append((shardBind(index), 'players', deleteInBatches(PlayerModel.id, orphanNpc(), batchSize)))
+    return reclaimed
+
+
+def compactDatabases(app, vacuum=False, analyze=False):
+    """ Runs VACUUM and/or ANALYZE on every database of 'app'.
+
+        Note:
+            VACUUM rewrites the whole file and needs every other connection to it to be idle.
+
+        Return:
+            list of (database, bytes before, bytes after), the sizes are None if the database isn't a file.
+    """
+    engines = [('main', db.get_engine(app))] + [(shardBind(index), db.get_engine(app, bind=shardBind(index)))
+                                                for index in range(shards.count)]
+    sizes = []
+    for name, engine in engines:
+        path = engine.url.database if engine.url.get_backend_name() == 'sqlite' else None
+        size = os.path.getsize(path) if path and os.path.exists(path) else None
+        with engine.connect() as connection:
+            if vacuum:
+                connection.execute('VACUUM')
+            if analyze:
+                connection.execute('ANALYZE')
+        sizes.append((name, size, os.path.getsize(path) if size is not None else None))
+    return sizes
+
+
+class Compactor:
+    """
+    Background thread collecting the orphans every 'interval' seconds, see collectOrphans.
+
+    """
+
+    def __init__(self):
+        self.__thread  = None
+        self.__stopped = threading.Event()
+
+    def start(self, app, interval):
+        self.__stopped.clear()
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__loop, args=(app, interval), name='compaction', daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __loop(self, app, interval):
+        while not self.__stopped.wait(interval):
+            try:
+                with app.app_context():
+                    for database, table, deleted in collectOrphans():
+                        if deleted:
+                            app.logger.info('Compaction deleted %s orphaned rows of %s.%s', deleted, database, table)
+            except Exception:
+                app.logger.exception('Compaction failed, retrying in %s seconds', interval)
+
+
+#: Started by init_app when app.config['COMPACTION_INTERVAL'] is set
+compactor = Compactor()
+
+
+def init_app(app):
+    """ Registers 'flask compact' and starts the background compaction if app.config['COMPACTION_INTERVAL'] is set.
+
+            flask compact [--batch-size 500] [--vacuum] [--analyze]
+
+        Args:
+            app: Flask application.
+    """
+    app.config.setdefault('COMPACTION_BATCH_SIZE', 500)
+    if app.config.setdefault('COMPACTION_INTERVAL', 0):
+        compactor.start(app, app.config['COMPACTION_INTERVAL'])
+
+    @app.cli.command('compact')
+    @click.option('--batch-size', type=int, default=None, help='rows deleted per commit')
+    @click.option('--vacuum', is_flag=True, help='rebuild the database files afterwards')
+    @click.option('--analyze', is_flag=True, help='refresh the query planner statistics afterwards')
+    def compact_command(batch_size, vacuum, analyze):
+        """ Deletes the locations and NPCs of deleted lobbies. """
+        for database, table, deleted in collectOrphans(batch_size):
+            click.echo('{:>8}  {}.{}'.format(deleted, database, table))
+        if vacuum or analyze:
+            for database, before, after in compactDatabases(current_app, vacuum, analyze):
+                if before is not None:
+                    click.echo('{}: {} KiB -> {} KiB'.format(database, before // 1024, after // 1024))
@@ -1,4 +1,45 @@
-from flask_sqlalchemy import SQLAlchemy
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+import replicas
+
+
+def shardBind(index):
+    """ Name in SQLALCHEMY_BINDS of the database shard 'index', see sharding.py.
+
+    """
+    return 'shard{}'.format(index)
+
+
+class RoutingSession(SignallingSession):
+    """ Session that sends its statements to the database shard selected for the current app
+        context (g.shard, set by sharding.py), and to the read engine of that database when the
+        request is read-only (g.readOnly, set by replicas.py). Otherwise it behaves as
+        Flask-SQLAlchemy's session.
+
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if not has_app_context():
+            return SignallingSession.get_bind(self, mapper, clause)
+
+        shard = g.get('shard')
+        if shard is not None:
+            engine = get_state(self.app).db.get_engine(self.app, bind=shardBind(shard))
+        else:
+            engine = SignallingSession.get_bind(self, mapper, clause)
+
+        if g.get('readOnly'):
+            return replicas.readEngine(self.app, engine, shard)
+        return engine
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 
 # Maps python models to the database
-db = SQLAlchemy()
\ No newline at end of file
+db = RoutingSQLAlchemy()
@@ -0,0 +1,34 @@
+""" Conditional GET support. The ETag of an entity is built from its id and its 'version' column
+(see models/versions.py), so a poll can be answered by reading a single integer.
+
+    tag = etags.entityTag('lobby', lobby_id, version)
+    if etags.isFresh(tag):
+        return etags.notModified(tag)
+    return lobby, 200, etags.headers(tag)
+"""
+from flask import request
+
+
+def entityTag(kind, entityId, version):
+    """ Builds the (unquoted) ETag of an entity at a version.
+
+    """
+    return '{}-{}-{}'.format(kind, entityId, version)
+
+
+def isFresh(tag):
+    """ True if the client sent 'tag' in If-None-Match, meaning its copy is up to date.
+
+    """
+    return request.if_none_match.contains(tag)
+
+
+def headers(tag):
+    return {'ETag': '"{}"'.format(tag)}
+
+
+def notModified(tag):
+    """ Response telling the client its copy is still valid. Werkzeug never sends a body with a 304.
+
+    """
+    return '', 304, headers(tag)
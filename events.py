@@ -0,0 +1,167 @@
+""" In-process publish/subscribe of lobby events (joins, moves, deaths, sleep/wake...).
+
+Resources publish an event once the change it describes is committed, and every client
+listening to GET /lobby/<id>/events receives it as a server-sent event. Each subscriber has
+its own bounded queue: a client that stops reading never slows down the publishers, instead
+its backlog is dropped and replaced by a single 'resync' event telling it to GET the lobby again.
+
+Note:
+    Events only reach the subscribers of the process that published them. Deployments with
+    several workers need sticky routing per lobby for the stream to be complete.
+"""
+import json
+import queue
+from collections import namedtuple
+from itertools import count
+from threading import Lock
+
+#: kind is the SSE event name, data a JSON serializable dict
+Event = namedtuple('Event', ['id', 'lobbyId', 'kind', 'data'])
+
+
+class Subscription:
+    """
+    Bounded queue of events of one lobby for one client.
+
+    Attributes:
+        lobbyId (int): Lobby the client listens to.
+        dropped (int): Number of events the client was too slow to receive.
+    """
+
+    def __init__(self, lobbyId, maxSize):
+        self.lobbyId  = lobbyId
+        self.dropped  = 0
+        self.__queue  = queue.Queue(maxSize)
+        self.__lock   = Lock()
+
+    def push(self, event):
+        """ Queues 'event' without ever blocking. If the queue is full the backlog is replaced by a 'resync' event.
+
+        """
+        with self.__lock:
+            try:
+                self.__queue.put_nowait(event)
+                return
+            except queue.Full:
+                pass
+
+            while True:
+                try:
+                    if self.__queue.get_nowait().kind != 'resync':
+                        self.dropped += 1
+                except queue.Empty:
+                    break
+            self.dropped += 1
+            self.__queue.put_nowait(Event(event.id, self.lobbyId, 'resync', {'dropped': self.dropped}))
+
+    def next(self, timeout):
+        """ Waits up to 'timeout' seconds for the next event, returns None if there was none.
+
+        """
+        try:
+            return self.__queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """
+    Routes the events published for a lobby to the subscriptions of that lobby.
+
+    Attributes:
+        queueSize      (int): Events a subscriber can fall behind before it has to resync.
+        maxSubscribers (int): Subscriptions allowed per lobby.
+    """
+
+    def __init__(self, queueSize=100, maxSubscribers=100):
+        self.queueSize      = queueSize
+        self.maxSubscribers = maxSubscribers
+        self.__ids          = count(1)
+        self.__lock         = Lock()
+        self.__lobbies      = {}
+
+    def configure(self, queueSize, maxSubscribers):
+        self.queueSize      = queueSize
+        self.maxSubscribers = maxSubscribers
+
+    def subscribe(self, lobbyId):
+        """ Creates a subscription to the events of 'lobbyId', None if the lobby has too many subscribers.
+
+        """
+        with self.__lock:
+            subscriptions = self.__lobbies.setdefault(lobbyId, set())
+            if len(subscriptions) >= self.maxSubscribers:
+                return None
+            subscription = Subscription(lobbyId, self.queueSize)
+            subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.__lock:
+            subscriptions = self.__lobbies.get(subscription.lobbyId, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.__lobbies.pop(subscription.lobbyId, None)
+
+    def subscribers(self, lobbyId):
+        with self.__lock:
+            return len(self.__lobbies.get(lobbyId, ()))
+
+    def publish(self, lobbyId, kind, **data):
+        """ Sends an event to every subscriber of 'lobbyId'.
+
+            Note:
+                eventBus.publish(1, 'move', playerName='Edwin', fromLocation=1, toLocation=2)
+
+        """
+        with self.__lock:
+            subscriptions = list(self.__lobbies.get(lobbyId, ()))
+        if not subscriptions:
+            return
+
+        event = Event(next(self.__ids), lobbyId, kind, data)
+        for subscription in subscriptions:
+            subscription.push(event)
+
+    def close(self, lobbyId):
+        """ Sends a final 'closed' event to the subscribers of a lobby that no longer exists and forgets them.
+
+        """
+        with self.__lock:
+            subscriptions = self.__lobbies.pop(lobbyId, set())
+        event = Event(next(self.__ids), lobbyId, 'closed', {})
+        for subscription in subscriptions:
+            subscription.push(event)
+
+
+#: Shared by every request of this process, configured by app.py
+eventBus = EventBus()
+
+
+def formatEvent(event):
+    """ Serializes an event in the text/event-stream format.
+
+    """
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event.id, event.kind, json.dumps(event.data))
+
+
+def stream(subscription, heartbeat):
+    """ Generator of the text/event-stream body for a subscription.
+
+        Note:
+            A comment line is sent every 'heartbeat' seconds without events, so proxies keep the
+            connection open and a client that went away is noticed on the next write. The
+            subscription is released when the client disconnects or the lobby is closed.
+    """
+    try:
+        yield ': listening to lobby {}\n\n'.format(subscription.lobbyId)
+        while True:
+            event = subscription.next(heartbeat)
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield formatEvent(event)
+            if event.kind == 'closed':
+                return
+    finally:
+        eventBus.unsubscribe(subscription)
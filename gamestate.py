@@ -0,0 +1,689 @@
+""" In-memory game state with write-behind persistence (app.config['GAME_STATE'] = 'memory').
+
+By default every move and action is a read-modify-commit round trip to SQLite. In memory mode the
+lobbies being played, their players and the locations they use are held in compact slot records
+which are the source of truth while the game runs:
+
+    - PlayerLocation.post and PlayerAction.post change the records under a lock and return, no SQL.
+    - a background thread writes the records that changed to the players, locations and lobbies
+      tables every GAME_STATE_FLUSH_INTERVAL seconds, all of them in one transaction: players
+      only if their row still has the version read, locations and lobbies relatively.
+    - requests that change a lobby through the database (join, delete, batched confrontations)
+      evict it first: its changes are written and its records dropped, so the next action
+      loads the new rows.
+
+Note:
+    The records are only authoritative if one process serves every action: two processes holding
+    the same lobby would overwrite each other's flushes. Memory mode refuses to start when another
+    process has it on for the same database (GAME_STATE_LOCK, the database file with a
+    -gamestate.lock suffix), and refuses actions in processes forked after it started: run a single
+    worker process (gunicorn -w 1 --threads N). A flush that finds a player row changed by
+    somebody else leaves that lobby out and drops it from memory, the database wins.
+
+    Recovery after a crash is the state of the last flush: records are loaded from the tables on
+    first use, so a restarted process carries on from there, and at most one flush interval of
+    play is lost. GET endpoints read the tables as well, so they lag behind by at most one
+    interval; the lobby event stream is published as actions happen.
+"""
+import atexit
+import os
+import threading
+
+from flask import current_app
+from sqlalchemy import bindparam, false
+
+from db import db
+from events import eventBus
+from models.player import PlayerModel, oddsTable
+from models.locations import LocationModel
+from models.lobby import LobbyModel
+from onboarding import chunks
+from sharding import shards
+
+try:
+    import fcntl
+except ImportError:
+    # Without it only forked processes are refused, see GameState.start
+    fcntl = None
+
+
+class PlayerSlot:
+    """
+    What the game logic reads and writes of a player. confrontOdds/confront are shared with
+    PlayerModel, the odds of a fight don't depend on where the player is stored.
+
+    Every record's 'stored' is its row() as the database has it, from the last load or flush.
+    """
+    __slots__ = ('id', 'playerName', 'role', 'status', 'heldItem', 'strength', 'stamina', 'currentLobby', 'locationId', 'version', 'stored')
+
+    #: Columns loaded from the players table, in __slots__ order
+    columns = [getattr(PlayerModel, name) for name in __slots__[:-1]]
+
+    confrontOdds = PlayerModel.confrontOdds
+    confront     = PlayerModel.confront
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def row(self):
+        """ Values written back by a flush, actions never change the other columns.
+
+        """
+        return {'id': self.id, 'status': self.status, 'strength': self.strength, 'stamina': self.stamina,
+                'locationId': self.locationId, 'version': self.version}
+
+
+class LocationSlot:
+    __slots__ = ('id', 'numOfPlayers', 'version', 'lobbyId', 'stored')
+    columns = [LocationModel.id, LocationModel.numOfPlayers, LocationModel.version]
+
+    def __init__(self, lobbyId, *values):
+        self.id, self.numOfPlayers, self.version = values
+        self.lobbyId = lobbyId
+
+    def row(self):
+        return {'id': self.id, 'numOfPlayers': self.numOfPlayers, 'version': self.version}
+
+
+class LobbySlot:
+    __slots__ = ('lobbyId', 'version', 'players', 'locationIds', 'stored')
+    columns = [LobbyModel.lobbyId, LobbyModel.version]
+
+    def __init__(self, lobbyId, version):
+        self.lobbyId = lobbyId
+        self.version = version
+        #: PlayerSlot of every player and NPC of the lobby
+        self.players = []
+        #: Every location loaded for the lobby, dropped with it
+        self.locationIds = set()
+
+    def row(self):
+        return {'lobbyId': self.lobbyId, 'version': self.version}
+
+
+class GameState:
+    """
+    Store of the lobbies being played.
+
+    Note:
+        Lookups and changes happen under one lock, the game logic only touches memory. Loading a
+        lobby (first action after a start or an eviction) runs its queries under the lock too.
+        Writes to the database are serialized by a second lock, always taken before the first.
+
+    Attributes:
+        enabled (bool): True when PlayerLocation.post and PlayerAction.post go through the store.
+        flushInterval (float): Seconds between two write-behind flushes.
+    """
+
+    def __init__(self):
+        self.enabled       = False
+        self.flushInterval = 1.0
+        self.__lock        = threading.RLock()
+        self.__writeLock   = threading.Lock()
+        self.__stopped     = threading.Event()
+        self.__thread      = None
+        self.__lockFile    = None
+        self.__pid         = os.getpid()
+        self.clear()
+
+    def clear(self):
+        """ Forgets every record without writing anything, what a crash does.
+
+        """
+        with self.__lock:
+            self.players   = {}
+            self.locations = {}
+            self.lobbies   = {}
+            self.dirty     = set()
+
+    # Loading
+
+    def __loadLobby(self, lobbyId):
+        with shards.lobby(lobbyId):
+            row = db.session.query(*LobbySlot.columns).filter_by(lobbyId=lobbyId).first()
+            if row is None:
+                return None
+            lobby = self.lobbies[lobbyId] = LobbySlot(*row)
+            lobby.stored = lobby.row()
+
+            for row in db.session.query(*PlayerSlot.columns).filter_by(currentLobby=lobbyId):
+                player = self.players.setdefault(row.id, PlayerSlot(*row))
+                player.stored = player.row()
+                lobby.players.append(player)
+
+        self.__loadLocations(lobby, {player.locationId for player in lobby.players})
+        return lobby
+
+    def __loadLocations(self, lobby, locationIds):
+        lobby.locationIds |= locationIds
+        locationIds = {locationId for locationId in locationIds if locationId not in self.locations}
+        if locationIds:
+            with shards.lobby(lobby.lobbyId):
+                for row in db.session.query(*LocationSlot.columns).filter(LocationModel.id.in_(locationIds)):
+                    location = self.locations[row.id] = LocationSlot(lobby.lobbyId, *row)
+                    location.stored = location.row()
+
+    def __player(self, playerId):
+        """ PlayerSlot of 'playerId', loading its lobby if needed. None if the player is not part of a lobby.
+
+            Note:
+                Must be called with the lock held.
+        """
+        if(self.enabled and os.getpid() != self.__pid):
+            raise RuntimeError('GAME_STATE=memory was started in process {}, it cannot serve the forked process {}. '
+                               'Run a single worker without --preload, see gamestate.py'.format(self.__pid, os.getpid()))
+        player = self.players.get(playerId)
+        if player is not None:
+            return player
+
+        with shards.directory():
+            lobbyId = db.session.query(PlayerModel.currentLobby).filter_by(id=playerId).scalar()
+        if lobbyId is None or lobbyId == -1 or self.__loadLobby(lobbyId) is None:
+            return None
+        return self.players.get(playerId)
+
+    def __location(self, player, locationId):
+        self.__loadLocations(self.lobbies[player.currentLobby], {locationId})
+        return self.locations.get(locationId)
+
+    def __changed(self, player, *locations):
+        """ Bumps the versions of a player that changed, the locations it affects and its lobby (see models/versions.py).
+
+        """
+        for record in (player, self.lobbies[player.currentLobby]) + locations:
+            if record is None:
+                continue
+            record.version = record.version + 1
+            self.dirty.add(record)
+
+    # Game logic, a copy of the rules and messages of the database path of /action and /player-location in
+    # resources/player.py: a change must be made to both, benchmarks/rule_parity.py checks they agree
+
+    def __move(self, player, locationId, events):
+        """ PlayerLocation.post on the records. Appends the lobby events of the move to 'events' and returns the response.
+
+        """
+        if(player.locationId == locationId):
+            return {'message':'Already at that location.'}
+
+        destination = self.__location(player, locationId)
+        if destination is None:
+            return {'message': 'Location does not exists'}
+
+        origin = self.__location(player, player.locationId)
+        if origin is None:
+            return {'message': 'Your player changed while moving, try again.'}
+
+        fromLocation = player.locationId
+        player.locationId = locationId
+        player.stamina = player.stamina - 10
+        origin.numOfPlayers = origin.numOfPlayers - 1
+        destination.numOfPlayers = destination.numOfPlayers + 1
+        events.append(('move', {'playerName': player.playerName, 'fromLocation': fromLocation, 'toLocation': locationId}))
+        self.__changed(player, origin, destination)
+
+        if(player.stamina == 0):
+            player.status = 'sleep'
+            events.append(('sleep', {'playerName': player.playerName}))
+            return {'message': 'You are out of stamina and have fallen asleep!'}
+
+        return {'message': 'You have succesfully changed locations.'}
+
+    def __act(self, player, action, targetName, events):
+        """ PlayerAction.post on the records. Appends the lobby events of the action to 'events' and returns the response.
+
+        """
+        playerName = player.playerName
+        location = self.locations.get(player.locationId)
+
+        if(player.status == 'sleep' and action != 'wakeup'):
+            return {'message': 'You must be awake to take action!'}
+
+        elif(action == 'attack'):
+            target = next((p for p in self.lobbies[player.currentLobby].players if p.playerName == targetName), None)
+            if(target is not None and target.status == 'dead'):
+                return { 'message' : 'target already dead'}
+            if(target is None or target.locationId != player.locationId):
+                return {'message': 'target was not in the location'}
+
+            if(player.confront(target) == player.playerName):
+                target.status = 'dead'
+                self.__changed(target, location)
+                events.append(('death', {'playerName': targetName, 'killedBy': playerName}))
+                return { 'message': 'kill' }
+
+            player.status = 'dead'
+            self.__changed(player, location)
+            events.append(('death', {'playerName': playerName, 'killedBy': targetName}))
+            return { 'message': 'dead' }
+
+        elif(action == 'sleep'):
+            player.stamina = player.stamina + 10
+            player.status = 'sleep'
+            self.__changed(player, location)
+            events.append(('sleep', {'playerName': playerName}))
+            return {'message': 'You decided to sleep: +10 stamina'}
+
+        elif(action == 'wakeup'):
+            player.status = 'none'
+            self.__changed(player, location)
+            events.append(('wake', {'playerName': playerName}))
+            return {'message': 'You are now awake'}
+
+        elif(action == 'workout'):
+            player.status = 'sleep'
+            self.__changed(player, location)
+            if(player.stamina == 0):
+                events.append(('sleep', {'playerName': playerName}))
+                return {'message': 'You are out of stamina and have fallen asleep!'}
+
+            player.strength = player.strength + 10
+            player.stamina = player.stamina - 10
+            events += [('workout', {'playerName': playerName}), ('sleep', {'playerName': playerName})]
+            return {'message': 'You decided to sleep: +10 strength -10 stamina'}
+
+        return {'message': 'Action is not supported!'}
+
+    def odds(self, playerId, targetName):
+        """ GET /odds on the records.
+
+            Return:
+                response of the request, None if the player is not part of a lobby.
+        """
+        with self.__lock:
+            player = self.__player(playerId)
+            if player is None:
+                return None
+            target = next((p for p in self.lobbies[player.currentLobby].players if p.playerName == targetName), None)
+            if target is None:
+                return {'message': 'target is not part of your lobby'}
+            return oddsTable.preview(player, target)
+
+    def _runBatch(self, playerId, actions):
+        """ Runs 'actions' in order for 'playerId' without anyone else acting in between.
+
+            Args:
+                actions: list of {'action': 'move', 'locationId': id}, {'action': 'attack', 'target': playerName}
+                         or {'action': 'sleep' / 'wakeup' / 'workout'}.
+
+            Return:
+                (lobbyId, list with the response of every action, list of (kind, data) lobby events),
+                None if the player is not part of a lobby.
+        """
+        events, results = [], []
+        with self.__lock:
+            player = self.__player(playerId)
+            if player is None:
+                return None
+
+            for action in actions:
+                if(action.get('action') == 'move'):
+                    if not isinstance(action.get('locationId'), int):
+                        results.append({'message': 'Location must be provided!'})
+                    else:
+                        results.append(self.__move(player, action['locationId'], events))
+                else:
+                    results.append(self.__act(player, action.get('action'), action.get('target'), events))
+            return player.currentLobby, results, events
+
+    def runBatch(self, playerId, actions):
+        """ Runs 'actions' (see _runBatch) in order and publishes their lobby events.
+
+            Return:
+                list with the response of every action, None if the player is not part of a lobby.
+        """
+        outcome = self._runBatch(playerId, actions)
+        if outcome is None:
+            return None
+        lobbyId, results, events = outcome
+        publish(lobbyId, events)
+        return results
+
+    def move(self, playerId, locationId):
+        """ PlayerLocation.post in memory.
+
+            Return:
+                response of the request, None if the player is not part of a lobby.
+        """
+        results = self.runBatch(playerId, [{'action': 'move', 'locationId': locationId}])
+        return results[0] if results is not None else None
+
+    def act(self, playerId, action, targetName=None):
+        """ PlayerAction.post in memory.
+
+            Return:
+                response of the request, None if the player is not part of a lobby.
+        """
+        results = self.runBatch(playerId, [{'action': action, 'target': targetName}])
+        return results[0] if results is not None else None
+
+    def tick(self, regen, maxStamina, wakeStamina):
+        """ Applies the rules of a game tick (see ticks.py) to the players of the lobbies in memory.
+
+            Return:
+                tuple (ids of the lobbies in memory, {rule: players changed}, [(lobbyId, events)])
+        """
+        changes = {'regen': 0, 'wake': 0, 'exhaustion': 0}
+        published = []
+        with self.__lock:
+            for lobby in self.lobbies.values():
+                events = []
+                for player in lobby.players:
+                    changed = False
+                    if(player.status == 'sleep' and player.stamina < maxStamina):
+                        player.stamina = min(player.stamina + regen, maxStamina)
+                        changes['regen'] += 1
+                        changed = True
+                    if(player.status == 'sleep' and player.stamina >= wakeStamina):
+                        player.status = 'none'
+                        changes['wake'] += 1
+                        events.append(('wake', {'playerName': player.playerName}))
+                        changed = True
+                    elif(player.status == 'none' and player.stamina <= 0):
+                        player.status = 'sleep'
+                        changes['exhaustion'] += 1
+                        events.append(('sleep', {'playerName': player.playerName}))
+                        changed = True
+                    if(changed):
+                        self.__changed(player, self.locations.get(player.locationId))
+                if events:
+                    published.append((lobby.lobbyId, events))
+            return set(self.lobbies), changes, published
+
+    # Persistence
+
+    @staticmethod
+    def __rows(records):
+        """ (record, row) of 'records' by database shard (None without shards) and lobby, they must be built with the lock held.
+
+        """
+        rows = {}
+        for record in records:
+            lobbyId = record.currentLobby if isinstance(record, PlayerSlot) else record.lobbyId
+            rows.setdefault(shards.indexOf(lobbyId), {}).setdefault(lobbyId, []).append((record, record.row()))
+        return rows
+
+    @staticmethod
+    def __write(rows):
+        """ Writes the rows built by __rows in one transaction per database.
+
+            Note:
+                A player is only written if its row still has the version of record.stored, the
+                locations and the lobby get what changed since record.stored added to their row. A
+                lobby with a player changed by somebody else is left out as a whole.
+
+            Return:
+                set of the ids of the lobbies left out.
+        """
+        stale = set()
+        try:
+            for shard, lobbies in rows.items():
+                with shards.shard(shard):
+                    # An UPDATE that matches nothing takes the write lock, the versions read below can't change
+                    db.session.execute(PlayerModel.__table__.update().where(false()).values(id=PlayerModel.id))
+                    readVersions = {record.id: (lobbyId, record.stored['version']) for lobbyId, items in lobbies.items()
+                                    for record, _ in items if isinstance(record, PlayerSlot)}
+                    versions = {}
+                    for chunk in chunks(readVersions):
+                        versions.update(db.session.query(PlayerModel.id, PlayerModel.version).filter(PlayerModel.id.in_(chunk)))
+                    stale.update(lobbyId for playerId, (lobbyId, version) in readVersions.items() if versions.get(playerId) != version)
+
+                    players, locations, lobbyRows = [], [], []
+                    for lobbyId, items in lobbies.items():
+                        if lobbyId in stale:
+                            continue
+                        for record, row in items:
+                            if isinstance(record, PlayerSlot):
+                                players.append({'changedId': row['id'], 'readVersion': record.stored['version'], 'newStatus': row['status'],
+                                                'newStrength': row['strength'], 'newStamina': row['stamina'],
+                                                'newLocationId': row['locationId'], 'newVersion': row['version']})
+                            elif isinstance(record, LocationSlot):
+                                locations.append({'changedId': row['id'], 'versions': row['version'] - record.stored['version'],
+                                                  'joined': row['numOfPlayers'] - record.stored['numOfPlayers']})
+                            else:
+                                lobbyRows.append({'changedId': row['lobbyId'], 'versions': row['version'] - record.stored['version']})
+
+                    if players:
+                        db.session.execute(PlayerModel.__table__.update().where(
+                            (PlayerModel.id == bindparam('changedId')) & (PlayerModel.version == bindparam('readVersion'))).values(
+                            status=bindparam('newStatus'), strength=bindparam('newStrength'), stamina=bindparam('newStamina'),
+                            locationId=bindparam('newLocationId'), version=bindparam('newVersion')), players)
+                    if locations:
+                        db.session.execute(LocationModel.__table__.update().where(LocationModel.id == bindparam('changedId')).values(
+                            numOfPlayers=LocationModel.numOfPlayers + bindparam('joined'),
+                            version=LocationModel.version + bindparam('versions')), locations)
+                    if lobbyRows:
+                        db.session.execute(LobbyModel.__table__.update().where(LobbyModel.lobbyId == bindparam('changedId')).values(
+                            version=LobbyModel.version + bindparam('versions')), lobbyRows)
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        return stale
+
+    def __written(self, rows, stale):
+        """ Records what a successful __write of 'rows' left in the database, and drops the lobbies of 'stale' from memory.
+
+            Return:
+                number of rows written.
+
+            Note:
+                Must be called with the lock held.
+        """
+        written = 0
+        for lobbies in rows.values():
+            for lobbyId, items in lobbies.items():
+                if lobbyId in stale:
+                    continue
+                for record, row in items:
+                    record.stored = row
+                written += len(items)
+        for lobbyId in stale:
+            current_app.logger.warning('Lobby %s changed in the database behind the game state, its records were dropped', lobbyId)
+            self.__drop(lobbyId)
+        return written
+
+    def __drop(self, lobbyId):
+        """ Forgets a lobby, its players and its locations without writing them.
+
+            Note:
+                Must be called with the lock held.
+        """
+        lobby = self.lobbies.pop(lobbyId, None)
+        if lobby is None:
+            return
+        self.dirty.discard(lobby)
+        for player in lobby.players:
+            self.players.pop(player.id, None)
+            self.dirty.discard(player)
+        for locationId in lobby.locationIds:
+            location = self.locations.pop(locationId, None)
+            self.dirty.discard(location)
+
+    def flush(self):
+        """ Writes every record that changed since the last flush.
+
+            Note:
+                The rows are taken under the lock, so the transaction holds a consistent picture
+                of the game, and written without it, so actions go on during the commit. Records
+                of a failed flush stay dirty and are written by the next one.
+
+            Return:
+                number of rows written.
+        """
+        with self.__writeLock:
+            with self.__lock:
+                records, self.dirty = self.dirty, set()
+                rows = self.__rows(records)
+            if not records:
+                return 0
+            try:
+                stale = self.__write(rows)
+            except:
+                with self.__lock:
+                    self.dirty |= records
+                raise
+            with self.__lock:
+                return self.__written(rows, stale)
+
+    def evict(self, lobbyId):
+        """ Writes the changes of a lobby and drops its records, before the lobby is changed through the database.
+
+            Note:
+                If the write fails the lobby stays in memory, nothing is lost.
+        """
+        with self.__writeLock, self.__lock:
+            lobby = self.lobbies.get(lobbyId)
+            if lobby is None:
+                return
+            locations = [self.locations[locationId] for locationId in lobby.locationIds if locationId in self.locations]
+            rows = self.__rows({lobby}.union(lobby.players, locations) & self.dirty)
+            self.__written(rows, self.__write(rows))
+            self.__drop(lobbyId)
+
+    # Write-behind thread
+
+    def start(self, app, interval):
+        """ Enables the store for 'app' and starts flushing it every 'interval' seconds.
+
+            Note:
+                A last flush runs when the interpreter exits. Raises RuntimeError if another
+                process holds app.config['GAME_STATE_LOCK'], see above.
+        """
+        self.__claim(lockPath(app))
+        self.__pid         = os.getpid()
+        self.enabled       = True
+        self.flushInterval = interval
+        self.__stopped.clear()
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__flushLoop, args=(app,), name='game-state-flush', daemon=True)
+            self.__thread.start()
+            atexit.register(self.stop, app)
+
+    def stop(self, app):
+        """ Stops the flushing thread, writes what is left and disables the store.
+
+        """
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        if self.enabled:
+            with app.app_context():
+                self.flush()
+        self.enabled = False
+        if self.__lockFile is not None:
+            self.__lockFile.close()
+            self.__lockFile = None
+
+    def __claim(self, path):
+        """ Takes the lock file 'path' for this process, nobody else can start the store on the same database.
+
+        """
+        if fcntl is None or not path or self.__lockFile is not None:
+            return
+        lockFile = open(path, 'a')
+        try:
+            fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lockFile.close()
+            raise RuntimeError('GAME_STATE=memory is on in another process for the same database ({}), '
+                               'run a single worker process, see gamestate.py'.format(path))
+        self.__lockFile = lockFile
+
+    def __flushLoop(self, app):
+        while not self.__stopped.wait(self.flushInterval):
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception:
+                app.logger.exception('Game state flush failed, retrying in %s seconds', self.flushInterval)
+
+
+class GameTransaction(GameState):
+    """
+    Runs a batch of actions of one player on records loaded for the request, then writes what
+    changed in a single transaction. Used by POST /action-batch when the in-memory store is off.
+
+    Note:
+        Players are only written if their version is still the one that was read, locations and
+        the lobby are written relatively, so the batch never overwrites what other requests did
+        in the meantime. If a player changed, nothing is written and the batch can be retried.
+
+        response = GameTransaction().run(playerId, actions)
+    """
+
+    def run(self, playerId, actions):
+        """ Runs 'actions' (see GameState._runBatch) and commits them.
+
+            Return:
+                response of the request, None if the player is not part of a lobby.
+        """
+        outcome = self._runBatch(playerId, actions)
+        if outcome is None:
+            return None
+        lobbyId, results, events = outcome
+
+        try:
+            with shards.lobby(lobbyId):
+                for record in self.dirty:
+                    if not self.__write(record):
+                        db.session.rollback()
+                        return {'message': 'Your player changed while running the actions, try again.'}
+                db.session.commit()
+        except:
+            db.session.rollback()
+            return {'message': 'Error saving to the DB!'}
+
+        publish(lobbyId, events)
+        return {'results': results}
+
+    def __write(self, record):
+        """ UPDATE of one changed record, returns False if its row no longer holds what was read.
+
+        """
+        original = record.stored
+        if isinstance(record, PlayerSlot):
+            changes = dict(record.row(), version=PlayerModel.version + 1)
+            del changes['id']
+            return PlayerModel.query.filter_by(id=record.id, version=original['version']).update(
+                changes, synchronize_session=False) == 1
+        if isinstance(record, LocationSlot):
+            delta = record.numOfPlayers - original['numOfPlayers']
+            return LocationModel.query.filter_by(id=record.id).update(
+                {'numOfPlayers': LocationModel.numOfPlayers + delta, 'version': LocationModel.version + 1}, synchronize_session=False) == 1
+        return LobbyModel.query.filter_by(lobbyId=record.lobbyId).update(
+            {'version': LobbyModel.version + 1}, synchronize_session=False) == 1
+
+
+def lockPath(app):
+    """ app.config['GAME_STATE_LOCK'], by default the file of SQLALCHEMY_DATABASE_URI with a -gamestate.lock
+        suffix. None for in-memory databases.
+
+    """
+    if app.config.get('GAME_STATE_LOCK'):
+        return app.config['GAME_STATE_LOCK']
+    url = db.get_engine(app).url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return url.database + '-gamestate.lock'
+
+
+def publish(lobbyId, events):
+    for kind, data in events:
+        eventBus.publish(lobbyId, kind, **data)
+
+
+#: Shared by every request of this process, configured by app.py
+gameState = GameState()
+
+
+def init_app(app):
+    """ Starts the in-memory store if app.config['GAME_STATE'] is 'memory'.
+
+        Args:
+            app: Flask application.
+    """
+    if app.config.setdefault('GAME_STATE', 'database') == 'memory':
+        gameState.start(app, app.config.setdefault('GAME_STATE_FLUSH_INTERVAL', 1.0))
@@ -0,0 +1,220 @@
+""" Matchmaking: placing players in lobbies that aren't full, without them knowing a lobby id.
+
+POST /lobby/<id> needs the id of a lobby with room, which clients found by reading lobbies.
+matchPlayers places any number of players, each in O(log n) with openLobbies (see openlobbies.py),
+the fullest open lobbies first:
+
+    - the seats are taken from the index, then claimed in the database: the sizes of the lobbies
+      are read under the write lock of their database and the lobbies that still have room get
+      their seats with one executemany. A lobby another process filled in the meantime claims nothing.
+    - the players are checked to still be out of any lobby under the write lock of their
+      database, no other request can make them join one before the commit.
+    - the players no open lobby could take, when there are none left or their claim failed,
+      open lobbies of their own (as CreateLobby.post would) and fill them.
+    - joining players get a home each (as Lobby.post would) and everything is committed once:
+      nothing is left half done if a step fails.
+
+It backs POST /matchmaking.
+
+Note:
+    In memory mode (see gamestate.py) the lobbies picked are written back and dropped from memory
+    before the transaction starts, as Lobby.post does.
+"""
+import collections
+
+from sqlalchemy import bindparam, false, inspect
+
+from db import db
+from events import eventBus
+from gamestate import gameState
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+from occupancy import occupancyIndex
+from onboarding import chunks, createInShard
+from openlobbies import openLobbies
+from sharding import shards
+
+
+def writeLock(model):
+    """ Takes the write lock of the database the session is routed to, nothing can be written to it
+        by anybody else until the transaction ends.
+
+    """
+    column = inspect(model).primary_key[0]
+    # An UPDATE that matches nothing takes the lock without changing a row
+    db.session.execute(model.__table__.update().where(false()).values({column.name: column}))
+
+
+def freePlayers(playerIds):
+    """ Ids of the players of 'playerIds' that aren't part of a lobby.
+
+        Note:
+            The write lock of the database of the accounts (the directory with shards) is taken
+            first, the players can't join a lobby through another request until the transaction ends.
+    """
+    free = set()
+    with shards.directory():
+        writeLock(PlayerModel)
+        for chunk in chunks(playerIds):
+            free.update(row.id for row in db.session.query(PlayerModel.id).filter(
+                PlayerModel.id.in_(chunk), PlayerModel.currentLobby == -1))
+    return free
+
+
+def claimSeats(seats):
+    """ Adds their seats to the size of the lobbies of 'seats' (lobbyId -> players joining it) that
+        have room for them. Nothing is committed.
+
+        Note:
+            The sizes are read under the write lock of the lobbies' database, they can't change
+            before the UPDATE. The seats of every lobby of a database are claimed with one executemany.
+
+        Return:
+            set of the lobbyIds whose seats were claimed.
+    """
+    byShard = {}
+    for lobbyId, count in seats.items():
+        byShard.setdefault(shards.indexOf(lobbyId), {})[lobbyId] = count
+
+    claimed = set()
+    for shard, group in byShard.items():
+        with shards.shard(shard):
+            # Without shards freePlayers already took the lock of the one database
+            if shard is not None:
+                writeLock(LobbyModel)
+            sizes = {}
+            for chunk in chunks(group):
+                sizes.update(db.session.query(LobbyModel.lobbyId, LobbyModel.lobbySize).filter(LobbyModel.lobbyId.in_(chunk)))
+            rows = [{'claimedId': lobbyId, 'seats': count} for lobbyId, count in group.items()
+                    if lobbyId in sizes and sizes[lobbyId] + count <= openLobbies.capacity]
+            if rows:
+                db.session.execute(LobbyModel.__table__.update().where(LobbyModel.lobbyId == bindparam('claimedId')).values(
+                    lobbySize=LobbyModel.lobbySize + bindparam('seats'), version=LobbyModel.version + 1), rows)
+        claimed.update(row['claimedId'] for row in rows)
+    return claimed
+
+
+def seatPlayers(joined):
+    """ Makes the players of 'joined', a list of (lobbyId, (result, player)), part of their lobby with
+        a home each. Nothing is committed.
+
+        Return:
+            list of (lobbyId, playerName, homeId)
+    """
+    byShard = collections.OrderedDict()
+    for lobbyId, item in joined:
+        byShard.setdefault(shards.indexOf(lobbyId), []).append((lobbyId, item))
+
+    seated, rows = [], []
+    for shard, group in byShard.items():
+        with shards.shard(shard):
+            homeIds = shards.allocateIds(LocationModel, len(group))
+            db.session.bulk_insert_mappings(LocationModel, [
+                {'id': homeId, 'locationOwner': player.playerName, 'locationName': 'home', 'numOfPlayers': 1}
+                for (_, (_, player)), homeId in zip(group, homeIds)
+            ])
+        for (lobbyId, (result, player)), homeId in zip(group, homeIds):
+            rows.append(dict(shards.rowOf(player), currentLobby=lobbyId, homeId=homeId, locationId=homeId, version=player.version + 1))
+            result.update(message='You have succesfully joined the lobby!', lobbyId=lobbyId)
+            seated.append((lobbyId, player.playerName, homeId))
+
+    if(shards.enabled):
+        shards.enter(rows)
+    else:
+        db.session.bulk_update_mappings(PlayerModel, [
+            {key: row[key] for key in ('id', 'currentLobby', 'homeId', 'locationId', 'version')} for row in rows
+        ])
+    return seated
+
+
+def refreshLobbies(lobbyIds):
+    """ Reads the size of 'lobbyIds' again, for the lobbies the index was wrong about.
+
+    """
+    byShard = {}
+    for lobbyId in lobbyIds:
+        byShard.setdefault(shards.indexOf(lobbyId), []).append(lobbyId)
+    for shard, ids in byShard.items():
+        sizes = {}
+        with shards.shard(shard):
+            for chunk in chunks(ids):
+                sizes.update(db.session.query(LobbyModel.lobbyId, LobbyModel.lobbySize).filter(LobbyModel.lobbyId.in_(chunk)))
+        for lobbyId in ids:
+            if lobbyId in sizes:
+                openLobbies.update(lobbyId, sizes[lobbyId])
+            else:
+                openLobbies.remove(lobbyId)
+
+
+def matchPlayers(players):
+    """ Places every player of 'players' in an open lobby, see above.
+
+        Args:
+            players: list of PlayerModel, loaded from the directory with shards.
+
+        Return:
+            list of {'playerName', 'message'} (and the 'lobbyId' of the lobby the player is now part
+            of), one per item of 'players'.
+    """
+    capacity = openLobbies.capacity
+    results = [{'playerName': player.playerName} for player in players]
+
+    plan = [(result, player, openLobbies.take()) for result, player in zip(results, players)]
+    planned = collections.Counter(lobbyId for _, _, lobbyId in plan if lobbyId is not None)
+    # gameState.evict commits, the lobbies must leave memory before the transaction starts
+    if(gameState.enabled):
+        for lobbyId in planned:
+            gameState.evict(lobbyId)
+
+    try:
+        free = freePlayers([player.id for player in players])
+        seats, leftover = collections.OrderedDict(), []
+        for result, player, lobbyId in plan:
+            if player.id not in free:
+                result['message'] = 'You are part of a different lobby!'
+            elif lobbyId is None:
+                leftover.append((result, player))
+            else:
+                seats.setdefault(lobbyId, []).append((result, player))
+
+        joined = []
+        claimed = claimSeats({lobbyId: len(group) for lobbyId, group in seats.items()})
+        for lobbyId, group in seats.items():
+            if lobbyId in claimed:
+                joined += [(lobbyId, item) for item in group]
+            else:
+                leftover += group
+
+        # Every 'capacity' players left over, the first one opens a lobby and the others join it
+        byShard, created = collections.OrderedDict(), []
+        for owner in leftover[::capacity]:
+            byShard.setdefault(shards.next(), []).append(owner)
+        for shard, group in byShard.items():
+            createInShard(shard, group)
+        for start in range(0, len(leftover), capacity):
+            lobbyId = leftover[start][0]['lobbyId']
+            group = leftover[start + 1:start + capacity]
+            joined += [(lobbyId, item) for item in group]
+            created.append((lobbyId, 1 + len(group)))
+        claimSeats({lobbyId: lobbySize - 1 for lobbyId, lobbySize in created if lobbySize > 1})
+
+        seated = seatPlayers(joined)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        openLobbies.clear()
+        raise
+
+    # Seats the index gave that weren't claimed: claims that failed and players that were in a lobby already
+    joining = collections.Counter(lobbyId for lobbyId, _ in joined)
+    wrong = [lobbyId for lobbyId, count in planned.items() if joining[lobbyId] != count]
+    if wrong:
+        refreshLobbies(wrong)
+    for lobbyId, lobbySize in created:
+        openLobbies.update(lobbyId, lobbySize)
+
+    occupancyIndex.invalidate(*[homeId for _, _, homeId in seated])
+    for lobbyId, playerName, homeId in seated:
+        eventBus.publish(lobbyId, 'join', playerName=playerName, locationId=homeId)
+    return results
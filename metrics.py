@@ -0,0 +1,225 @@
+""" Request instrumentation exposed in the Prometheus text format on GET /metrics.
+
+For every endpoint (the URL rule, e.g. /lobby/<int:lobby_id>) and method we record:
+
+    - a latency histogram and the number of requests per status code.
+    - the SQL statements run, the time spent in them and the commits made.
+    - how many statements each request needed (a histogram, a jump shows an N+1 query).
+
+plus a histogram of the time the JWT identity function takes, split by identity cache hits and misses,
+and the duration of the game ticks (see ticks.py) with the players each of their rules changed.
+
+Note:
+    The hot path only touches per-request counters kept in flask.g; the shared registry is locked
+    once per request, when the request is torn down. Counters are per process, every gunicorn
+    worker reports its own.
+"""
+import time
+from bisect import bisect_left
+from threading import Lock
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#: Upper bounds (seconds) of the latency buckets
+LATENCY_BUCKETS    = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+#: Upper bounds of the statements per request buckets
+STATEMENT_BUCKETS  = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus sense: a count per upper bound plus the sum of the
+    observed values. Not thread safe by itself, the Metrics registry locks around it.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets) + 1)
+        self.sum     = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(name, formatLabels(labels, le=bound), cumulative))
+        lines.append('{}_sum{} {}'.format(name, formatLabels(labels), self.sum))
+        lines.append('{}_count{} {}'.format(name, formatLabels(labels), cumulative))
+        return lines
+
+
+def formatLabels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs) + '}'
+
+
+class Metrics:
+    """
+    Registry of the measurements of this process.
+
+    """
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.clear()
+
+    def clear(self):
+        self.requests   = {}     # (endpoint, method, status) -> count
+        self.latency    = {}     # (endpoint, method) -> Histogram
+        self.statements = {}     # (endpoint, method) -> Histogram of statements per request
+        self.sqlSeconds = {}     # (endpoint, method) -> seconds
+        self.commits    = {}     # (endpoint, method) -> count
+        self.identity   = {}     # 'hit' / 'miss' -> Histogram
+        self.ticks      = {}     # database -> Histogram of tick durations
+        self.tickRules  = {}     # (database, rule) -> players changed
+
+    def observeRequest(self, endpoint, method, status, seconds, statements, sqlSeconds, commits):
+        key = (endpoint, method)
+        with self.__lock:
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.statements.setdefault(key, Histogram(STATEMENT_BUCKETS)).observe(statements)
+            self.sqlSeconds[key] = self.sqlSeconds.get(key, 0.0) + sqlSeconds
+            self.commits[key] = self.commits.get(key, 0) + commits
+
+    def observeIdentity(self, result, seconds):
+        with self.__lock:
+            self.identity.setdefault(result, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def observeTick(self, database, seconds, changes):
+        with self.__lock:
+            self.ticks.setdefault(database, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            for rule, count in changes.items():
+                self.tickRules[(database, rule)] = self.tickRules.get((database, rule), 0) + count
+
+    def render(self):
+        """ Text exposition format (version 0.0.4) of every metric.
+
+        """
+        labels = lambda key: (('endpoint', key[0]), ('method', key[1]))
+        lines = []
+        with self.__lock:
+            lines += ['# HELP dawn_requests_total Requests handled.', '# TYPE dawn_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append('dawn_requests_total{} {}'.format(formatLabels(labels((endpoint, method)), status=status), count))
+
+            lines += ['# HELP dawn_request_duration_seconds Time spent handling a request.', '# TYPE dawn_request_duration_seconds histogram']
+            for key, histogram in sorted(self.latency.items()):
+                lines += histogram.render('dawn_request_duration_seconds', labels(key))
+
+            lines += ['# HELP dawn_sql_statements_per_request SQL statements run by a request.', '# TYPE dawn_sql_statements_per_request histogram']
+            for key, histogram in sorted(self.statements.items()):
+                lines += histogram.render('dawn_sql_statements_per_request', labels(key))
+
+            lines += ['# HELP dawn_sql_seconds_total Time spent running SQL statements.', '# TYPE dawn_sql_seconds_total counter']
+            for key, seconds in sorted(self.sqlSeconds.items()):
+                lines.append('dawn_sql_seconds_total{} {}'.format(formatLabels(labels(key)), seconds))
+
+            lines += ['# HELP dawn_sql_commits_total Transactions committed.', '# TYPE dawn_sql_commits_total counter']
+            for key, count in sorted(self.commits.items()):
+                lines.append('dawn_sql_commits_total{} {}'.format(formatLabels(labels(key)), count))
+
+            lines += ['# HELP dawn_identity_lookup_seconds Time spent by the JWT identity function.', '# TYPE dawn_identity_lookup_seconds histogram']
+            for result, histogram in sorted(self.identity.items()):
+                lines += histogram.render('dawn_identity_lookup_seconds', (('cache', result),))
+
+            lines += ['# HELP dawn_tick_duration_seconds Time spent applying a game tick.', '# TYPE dawn_tick_duration_seconds histogram']
+            for database, histogram in sorted(self.ticks.items()):
+                lines += histogram.render('dawn_tick_duration_seconds', (('database', database),))
+
+            lines += ['# HELP dawn_tick_players_total Players changed by the game ticks.', '# TYPE dawn_tick_players_total counter']
+            for (database, rule), count in sorted(self.tickRules.items()):
+                lines.append('dawn_tick_players_total{} {}'.format(formatLabels((('database', database), ('rule', rule))), count))
+        return '\n'.join(lines) + '\n'
+
+
+#: Shared by every request of this process
+metrics = Metrics()
+
+
+def init_app(app):
+    """ Starts measuring the requests of 'app' and adds the GET /metrics endpoint.
+
+        Note:
+            Does nothing when app.config['METRICS_ENABLED'] is False, the SQL listeners
+            then return straight away since no request carries counters.
+
+        Args:
+            app: Flask application.
+    """
+    if not app.config.setdefault('METRICS_ENABLED', True):
+        return
+
+    app.before_request(start_request)
+    app.after_request(remember_status)
+    app.teardown_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', lambda: Response(metrics.render(), mimetype='text/plain; version=0.0.4'))
+
+
+def start_request():
+    # [statements, seconds in SQL, commits]
+    g.metricsSql = [0, 0.0, 0]
+    g.metricsStart = time.perf_counter()
+
+
+def remember_status(response):
+    g.metricsStatus = response.status_code
+    return response
+
+
+def record_request(exception):
+    start = g.get('metricsStart')
+    if start is None:
+        return
+    statements, sqlSeconds, commits = g.metricsSql
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.observeRequest(endpoint, request.method, g.get('metricsStatus', 500), time.perf_counter() - start,
+                           statements, sqlSeconds, commits)
+
+
+def timeIdentity(identity):
+    """ Wraps the JWT identity function so that its duration is recorded.
+
+        Note:
+            security.identity sets g.identityMiss when it had to load the player, which is how
+            hits and misses are told apart.
+    """
+    def timed(payload):
+        start = time.perf_counter()
+        result = identity(payload)
+        metrics.observeIdentity('miss' if g.get('identityMiss') else 'hit', time.perf_counter() - start)
+        return result
+    return timed
+
+
+def _counters():
+    return g.get('metricsSql') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(connection, cursor, statement, parameters, context, executemany):
+    if _counters() is not None:
+        connection.info.setdefault('metricsStarts', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def count_statement(connection, cursor, statement, parameters, context, executemany):
+    counters = _counters()
+    starts = connection.info.get('metricsStarts')
+    if counters is None or not starts:
+        return
+    counters[0] += 1
+    counters[1] += time.perf_counter() - starts.pop()
+
+
+@event.listens_for(Engine, 'commit')
+def count_commit(connection):
+    counters = _counters()
+    if counters is not None:
+        counters[2] += 1
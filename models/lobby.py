@@ -1,5 +1,6 @@
 # Will allow us to link entities/Models to the database rows/columns via SQLAlchemy
 from db import db
+from models.player import PlayerModel
 
 class LobbyModel(db.Model):
     """ 
@@ -14,8 +15,10 @@ class LobbyModel(db.Model):
     __tablename__ = 'lobbies'
 
     lobbyId    =       db.Column(db.Integer, primary_key=True)
-    lobbyOwner =       db.Column(db.String(10))
+    lobbyOwner =       db.Column(db.String(10), index=True)
     lobbySize  =       db.Column(db.Integer)
+    # Bumped whenever the lobby or one of its players changes, see models/versions.py
+    version    =       db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
      # Tells sqlAlchemy that there is a relationship with ItemModel
     # It is a list of ItemModel's since there is a many to one relationship
@@ -56,6 +59,39 @@ class LobbyModel(db.Model):
             'lobbySize' : self.lobbySize,
             'players': [player.json() for player in self.players.all()]
             }
+
+    @classmethod
+    def jsonById(cls, lobbyId):
+        """ Will return the same JSON as json() for the lobby with 'lobbyId' using a single query.
+
+            Note:
+                The lobby and its players are fetched with one LEFT OUTER JOIN that only selects
+                the columns we return, so no LobbyModel or PlayerModel objects are built.
+
+                lobby = LobbyModel.jsonById(1)
+
+            Args:
+                lobbyId (int): Comes from the URL parameter when a request is made to an endpoint
+
+            Return:
+                Lobby as a JSON object, None if the lobby does not exist
+
+        """
+        rows = db.session.query(cls.lobbyId, cls.lobbyOwner, cls.lobbySize, *PlayerModel.jsonColumns()) \
+            .outerjoin(PlayerModel, PlayerModel.currentLobby == cls.lobbyId) \
+            .filter(cls.lobbyId == lobbyId) \
+            .order_by(PlayerModel.id) \
+            .all()
+
+        if len(rows) == 0:
+            return None
+
+        return {
+            'lobbyId'   : rows[0].lobbyId,
+            'lobbyOwner': rows[0].lobbyOwner,
+            'lobbySize' : rows[0].lobbySize,
+            'players': [PlayerModel.jsonFromRow(row) for row in rows if row.player_id is not None]
+            }
     
     @classmethod
     def findById(cls, lobbyId):
@@ -73,6 +109,40 @@ class LobbyModel(db.Model):
         """
         return cls.query.filter_by(lobbyId=lobbyId).first()
 
+    @classmethod
+    def findVersion(cls, lobbyId):
+        """Will find the version of a Lobby without loading it or its players
+
+            Args:
+                lobbyId (int): Comes from the URL parameter when a request is made to an endpoint
+
+            Return:
+                version of the lobby, None if the lobby does not exist
+
+        """
+        return db.session.query(cls.version).filter_by(lobbyId=lobbyId).scalar()
+
+    @classmethod
+    def claimSeat(cls, lobbyId, capacity):
+        """Will add one player to the size of a Lobby, if it has room for them. Nothing is committed.
+
+            Note:
+                The size is checked and increased by one UPDATE, two joins can't both take the last seat
+
+            Args:
+                lobbyId (int): Id of the lobby being joined
+                capacity (int): Players a lobby can hold
+
+            Return:
+                size of the lobby after the join, None if it was full or does not exist
+
+        """
+        claimed = cls.query.filter(cls.lobbyId == lobbyId, cls.lobbySize < capacity).update(
+            {'lobbySize': cls.lobbySize + 1, 'version': cls.version + 1}, synchronize_session=False)
+        if not claimed:
+            return None
+        return db.session.query(cls.lobbySize).filter_by(lobbyId=lobbyId).scalar()
+
     @classmethod
     def findByOwner(cls, lobbyOwner):
         """Will find a Lobby from the lobbies table of the DB using playerName
@@ -1,4 +1,5 @@
 from db import db
+from models.player import PlayerModel
 
 class LocationModel(db.Model):
     """
@@ -18,6 +19,8 @@ class LocationModel(db.Model):
     locationName  =     db.Column(db.String(10))
     locationOwner =     db.Column(db.String(10))
     numOfPlayers  =     db.Column(db.Integer)
+    # Bumped whenever the location or one of the players in it changes, see models/versions.py
+    version       =     db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     home          =     db.relationship("PlayerModel",   foreign_keys='PlayerModel.homeId')
     players       =     db.relationship("PlayerModel",   foreign_keys='PlayerModel.locationId', lazy='dynamic')
@@ -50,6 +53,37 @@ class LocationModel(db.Model):
             'players'           : [player.json() for player in self.players.all()]
         }
 
+    @classmethod
+    def jsonById(cls, location_id):
+        """ Will return the same JSON as json() for the location with 'location_id' using a single query.
+
+            Note:
+                The location and the players in it are fetched with one LEFT OUTER JOIN that only
+                selects the columns we return, so no LocationModel or PlayerModel objects are built.
+
+            Arguments:
+                location_id: Id of a location
+
+            Return:
+                Location as a JSON object, None if the location does not exist
+        """
+        rows = db.session.query(cls.id, cls.locationName, cls.locationOwner, cls.numOfPlayers, *PlayerModel.jsonColumns()) \
+            .outerjoin(PlayerModel, PlayerModel.locationId == cls.id) \
+            .filter(cls.id == location_id) \
+            .order_by(PlayerModel.id) \
+            .all()
+
+        if len(rows) == 0:
+            return None
+
+        return {
+            'locationId'        : rows[0].id,
+            'locationName'      : rows[0].locationName,
+            'locationOwner'     : rows[0].locationOwner,
+            'numOfPlayers'      : rows[0].numOfPlayers,
+            'players'           : [PlayerModel.jsonFromRow(row) for row in rows if row.player_id is not None]
+        }
+
     
 
     def save_to_db(self):
@@ -78,6 +112,15 @@ class LocationModel(db.Model):
         """
         return cls.query.filter_by(locationName == locationName,locationOwner == locationOwner)
 
+    @classmethod
+    def findVersion(cls, location_id):
+        """ Allows us to find the version of a location without loading it or its players.
+
+            Arguments:
+                locationId: Id of a location
+        """
+        return db.session.query(cls.version).filter_by(id=location_id).scalar()
+
     @classmethod
     def findById(cls,location_id):
         """ Allows us to find a location via locationId. This id will be provided via a URL parameter.
@@ -0,0 +1,114 @@
+from collections import namedtuple
+from itertools import product
+
+#: Stats a fight depends on, enough to call PlayerModel.confrontOdds with
+Fighter = namedtuple('Fighter', ['strength', 'stamina', 'heldItem', 'status'])
+
+#: One strength/stamina difference per bucket, in bucket order. confrontOdds treats every
+#: negative difference as the '<= 10' bracket, hence a single bucket for them.
+STRENGTH_DIFFS = (-1, 0, 10, 20, 30, 31)
+STAMINA_DIFFS  = (-1, 0, 10, 20, 21)
+
+
+def strengthBucket(diff):
+    if(diff < 0):
+        return 0
+    if(diff == 0):
+        return 1
+    if(diff <= 10):
+        return 2
+    if(diff <= 20):
+        return 3
+    if(diff <= 30):
+        return 4
+    return 5
+
+
+def staminaBucket(diff):
+    if(diff < 0):
+        return 0
+    if(diff == 0):
+        return 1
+    if(diff <= 10):
+        return 2
+    if(diff <= 20):
+        return 3
+    return 4
+
+
+class OddsTable:
+    """
+    The odds of a fight only depend on whether the target sleeps, who holds a gun and the
+    brackets of the strength and stamina differences. OddsTable evaluates the branch logic
+    once per combination and answers every fight with an array lookup.
+
+    Note:
+        oddsTable = OddsTable(PlayerModel.confrontOdds)
+        attackerOdds, targetOdds = oddsTable.lookup(attacker, target)
+
+    Attributes:
+        odds:  nested lists indexed by [targetAsleep][attackerGun][targetGun][strengthBucket][staminaBucket],
+               each holding [attacker, target] odds.
+        table: the same values as a NumPy array, only built for lookupBatch so that numpy is not
+               imported by the application until a batch of fights needs it.
+    """
+
+    def __init__(self, confrontOdds):
+        """ Compiles the table by calling 'confrontOdds(attacker, target)' on one fight per combination.
+
+        """
+        base = 100
+        self.odds = [[[[[None] * len(STAMINA_DIFFS) for _ in STRENGTH_DIFFS] for _ in range(2)] for _ in range(2)] for _ in range(2)]
+        for asleep, attackerGun, targetGun in product((0, 1), repeat=3):
+            for strengthIndex, strengthDiff in enumerate(STRENGTH_DIFFS):
+                for staminaIndex, staminaDiff in enumerate(STAMINA_DIFFS):
+                    attacker = Fighter(base + strengthDiff, base + staminaDiff, 'gun' if attackerGun else 'none', 'none')
+                    target   = Fighter(base, base, 'gun' if targetGun else 'none', 'sleep' if asleep else 'none')
+                    self.odds[asleep][attackerGun][targetGun][strengthIndex][staminaIndex] = list(confrontOdds(attacker, target))
+        self.__table = None
+
+    @property
+    def table(self):
+        if self.__table is None:
+            import numpy as np
+            self.__table = np.array(self.odds)
+        return self.__table
+
+    def lookup(self, attacker, target):
+        """ Same result as confrontOdds(attacker, target).
+
+            Return:
+                list with the probability of [attacker, target] winning the fight.
+        """
+        odds = self.odds[target.status == 'sleep'][attacker.heldItem == 'gun'][target.heldItem == 'gun']
+        return list(odds[strengthBucket(attacker.strength - target.strength)][staminaBucket(attacker.stamina - target.stamina)])
+
+    def lookupBatch(self, attackerStrength, attackerStamina, attackerItem, targetStrength, targetStamina, targetItem, targetStatus):
+        """ lookup for many fights at once, see PlayerModel.confrontOddsBatch.
+
+            Return:
+                tuple of two float arrays with the probability of the attacker and the target winning each fight.
+        """
+        import numpy as np
+        strengthDiff = np.asarray(attackerStrength) - np.asarray(targetStrength)
+        staminaDiff  = np.asarray(attackerStamina) - np.asarray(targetStamina)
+        odds = self.table[
+            (np.asarray(targetStatus) == 'sleep').astype(int),
+            (np.asarray(attackerItem) == 'gun').astype(int),
+            (np.asarray(targetItem) == 'gun').astype(int),
+            np.select([strengthDiff < 0, strengthDiff == 0, strengthDiff <= 10, strengthDiff <= 20, strengthDiff <= 30], [0, 1, 2, 3, 4], 5),
+            np.select([staminaDiff < 0, staminaDiff == 0, staminaDiff <= 10, staminaDiff <= 20], [0, 1, 2, 3], 4)
+        ]
+        return odds[..., 0], odds[..., 1]
+
+    def preview(self, attacker, target):
+        """ JSON describing the odds of 'attacker' against 'target', for GET /odds.
+
+        """
+        attackerOdds, targetOdds = self.lookup(attacker, target)
+        return {
+            'attacker'    : attacker.playerName,
+            'target'      : target.playerName,
+            'attackerOdds': attackerOdds,
+            'targetOdds'  : targetOdds
+        }
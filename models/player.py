@@ -1,6 +1,6 @@
 #db is the linker that will search for Models and map them to the database
 from db import db
-import numpy as np
+from models.odds import OddsTable
 
 #We create a class Player 
 #   db.Model: will tell the sqlAlchemy that this file represents a sql table with respective columns and rows
@@ -15,7 +15,7 @@ class PlayerModel(db.Model):
     #Here we specify the tablename, columns and rows.
     #local class variables will be mapped to the sql database
     __tablename__ = 'players'
-    playerName =    db.Column(db.String(10))
+    playerName =    db.Column(db.String(10), index=True)
     secretKey =     db.Column(db.String(10))
     id =            db.Column(db.Integer, primary_key = True)
     role =          db.Column(db.String(10))
@@ -23,22 +23,31 @@ class PlayerModel(db.Model):
     heldItem =      db.Column(db.String(10))
     strength =      db.Column(db.Integer)
     stamina =       db.Column(db.Integer)
+    # Bumped whenever the player changes, see models/versions.py
+    version =       db.Column(db.Integer, nullable=False, default=1, server_default='1')
     # Items foreign key: This is the relationship between item and store
     # Foreign keys will prevent linked items from being deleted.
     # Every item will be linked to a store,
-    currentLobby =        db.Column(db.Integer, db.ForeignKey('lobbies.lobbyId'))
+    currentLobby =        db.Column(db.Integer, db.ForeignKey('lobbies.lobbyId'), index=True)
     lobby =               db.relationship('LobbyModel', foreign_keys = [currentLobby])
 
-    homeId =              db.Column(db.Integer, db.ForeignKey('locations.id'))
+    homeId =              db.Column(db.Integer, db.ForeignKey('locations.id'), index=True)
     home =                db.relationship('LocationModel', foreign_keys = [homeId])
 
     
     # Equivalent of a join in sequel
     
 
-    locationId =   db.Column(db.Integer, db.ForeignKey('locations.id'))    
+    locationId =   db.Column(db.Integer, db.ForeignKey('locations.id'), index=True)    
     location =     db.relationship('LocationModel', foreign_keys = [locationId])
 
+    # Every lobby spawns its own 'Chief Wiggum' and clerk NPCs, so names are only unique
+    # amongst real accounts. The partial index enforces that while ix_players_playerName
+    # serves findByPlayerName for both players and NPCs.
+    __table_args__ = (
+        db.Index('uq_players_playerName', playerName, unique=True, sqlite_where=role == 'player'),
+    )
+
 
     # Initializes the item
     def __init__(self, playername, secretKey, role, status, heldItem, strength, stamina):
@@ -94,6 +103,57 @@ class PlayerModel(db.Model):
             'locationId'    : self.locationId
         }
 
+    @classmethod
+    def jsonColumns(cls):
+        """ Columns needed to build the JSON of a player without loading a PlayerModel object.
+
+            Note:
+                Labels are prefixed with 'player_' so they can be selected next to the
+                columns of a lobby or a location in the same query.
+
+                db.session.query(LocationModel.id, *PlayerModel.jsonColumns())
+
+            Return:
+                list of labeled columns, to be used with jsonFromRow
+
+        """
+        return [
+            cls.playerName.label('player_playerName'),
+            cls.id.label('player_id'),
+            cls.role.label('player_role'),
+            cls.status.label('player_status'),
+            cls.heldItem.label('player_heldItem'),
+            cls.strength.label('player_strength'),
+            cls.stamina.label('player_stamina'),
+            cls.currentLobby.label('player_currentLobby'),
+            cls.homeId.label('player_homeId'),
+            cls.locationId.label('player_locationId')
+        ]
+
+    @staticmethod
+    def jsonFromRow(row):
+        """ Will return the same JSON as json() from a row selected with jsonColumns().
+
+            Args:
+                row: Result row that contains the columns of jsonColumns()
+
+            Return:
+                Will return most of the fields from PlayerModel as a JSON object
+
+        """
+        return {
+            'playerName'    : row.player_playerName,
+            'id'            : row.player_id,
+            'role'          : row.player_role,
+            'status'        : row.player_status,
+            'heldItem'      : row.player_heldItem,
+            'strength'      : row.player_strength,
+            'stamina'       : row.player_stamina,
+            'currentLobby'  : row.player_currentLobby,
+            'homeId'        : row.player_homeId,
+            'locationId'    : row.player_locationId
+        }
+
     # CREATING OR DELETING TO DATABASE
 
     def save_to_db(self):
@@ -122,7 +182,22 @@ class PlayerModel(db.Model):
 
         """
         db.session.delete(self)
-        db.session.commit
+        db.session.commit()
+
+    @classmethod
+    def save_all_to_db(cls, players):
+        """ Will save several objects of type PlayerModel to the database with a single commit.
+
+        Note:
+            PlayerModel.save_all_to_db([player1, player2])
+
+        Args:
+            players: list of PlayerModel objects that were changed.
+        Return:
+
+        """
+        db.session.add_all(players)
+        db.session.commit()
                
     # FORMS OF ACCESSING THE DATABASE
     
@@ -143,6 +218,38 @@ class PlayerModel(db.Model):
         """
         return cls.query.filter_by(playerName=playerName).first()
 
+    @classmethod
+    def findInLobby(cls, playerName, lobbyId):
+        """ Will find the player or NPC named 'playerName' that is part of the lobby 'lobbyId'.
+
+        Note:
+            NPC names repeat in every lobby, findByPlayerName would return the one of any lobby.
+
+            target = PlayerModel.findInLobby('Chief Wiggum', player.currentLobby)
+
+        Return:
+            PlayerModel object or None if the lobby has no player with that name.
+
+        """
+        return cls.query.filter_by(playerName=playerName, currentLobby=lobbyId).first()
+
+    @classmethod
+    def findVersionByPlayerName(cls, playerName):
+        """ Will find the id and version of the player findByPlayerName would return, without loading it.
+
+        Note:
+            player = PlayerModel.findVersionByPlayerName('Edwin')
+            player.id, player.version
+
+        Args:
+            playerName: Obtained from URL parameters. Holds a players name
+
+        Return:
+            row with 'id' and 'version', None if there is no player named 'playerName'
+
+        """
+        return db.session.query(cls.id, cls.version).filter_by(playerName=playerName).first()
+
     @classmethod
     def findByPlayerId(cls, playerId):
         """ Will allow us to find a user with the name 'playerId' and return it.
@@ -173,20 +280,28 @@ class PlayerModel(db.Model):
         """
         return cls.query.all()
 
-    def confront(self, target):
-        print(self.playerName)
+    def confrontOdds(self, target):
+        """ Will compute the odds this player has of winning a fight against 'target'.
+
+        Note:
+            odds = player1.confrontOdds(player2)
+
+        Args:
+            target: PlayerModel (or any object with the same stats) that is being attacked.
+
+        Return:
+            list with the probability of [self, target] winning the fight.
+
+        """
         selfPlayer = .5
         targetPlayer = .5
-        players = [self.playerName, target.playerName]
         
         if(target.status == 'sleep'):
             selfPlayer = .9
             targetPlayer = .1
-            probabilities = [selfPlayer, targetPlayer]
-            winner = np.random.choice(players, p=probabilities)
-            return winner
+            return [selfPlayer, targetPlayer]
             
-        if(self.heldItem == 'gun' and targetPlayer.heldItem == 'gun'):
+        if(self.heldItem == 'gun' and target.heldItem == 'gun'):
             selfPlayer = .50
             targetPlayer = .50
 
@@ -201,7 +316,6 @@ class PlayerModel(db.Model):
             
 
         strengthDiff = self.strength - target.strength
-        print(strengthDiff)
         # self.strength is stronger
         if(strengthDiff < 0):
             if(strengthDiff <= 10 ):
@@ -234,7 +348,6 @@ class PlayerModel(db.Model):
                 targetPlayer = targetPlayer - .4
 
         staminaDiff = self.stamina - target.stamina
-        print(staminaDiff)
         # self.strength is stronger
         if(staminaDiff  < 0):
             if(staminaDiff  <= 10 ):
@@ -272,13 +385,72 @@ class PlayerModel(db.Model):
             if(targetPlayer > 1):
                 targetPlayer = .95
 
-        probabilities = [selfPlayer, targetPlayer]
+        return [selfPlayer, targetPlayer]
+
+    def confront(self, target):
+        """ Will resolve a fight between this player and 'target'.
 
+        Note:
+            winner = player1.confront(player2)
+
+        Args:
+            target: PlayerModel that is being attacked.
+
+        Return:
+            playerName of the winner of the fight.
+
+        """
+        players = [self.playerName, target.playerName]
+        # Same odds as self.confrontOdds(target), compiled once by models/odds.py
+        probabilities = oddsTable.lookup(self, target)
+
+        # numpy is only imported by the first fight, it is the slowest import of the application
+        import numpy as np
         winner = np.random.choice(players, p=probabilities)
-        # Testing: print('{} won! attacker: {}%   target: {}%'.format(winner, round(selfPlayer,4), round(targetPlayer,4)))
+        # Testing: print('{} won! attacker: {}%   target: {}%'.format(winner, round(probabilities[0],4), round(probabilities[1],4)))
         return winner
-        # Testing: return '{} won! attacker: {}%   target: {}%'.format(winner, round(selfPlayer,4), round(targetPlayer,4))
 
+    @staticmethod
+    def confrontOddsBatch(attackerStrength, attackerStamina, attackerItem, targetStrength, targetStamina, targetItem, targetStatus):
+        """ Vectorized version of confrontOdds. Computes the odds of many fights with one lookup in the odds table.
+
+        Note:
+            attackerOdds, targetOdds = PlayerModel.confrontOddsBatch([100], [100], ['gun'], [90], [100], ['none'], ['none'])
 
+        Args:
+            attackerStrength, attackerStamina, targetStrength, targetStamina: sequences of ints, one per fight.
+            attackerItem, targetItem: sequences with the heldItem of every fighter.
+            targetStatus: sequence with the status of every target.
+
+        Return:
+            tuple of two float arrays with the probability of the attacker and the target winning each fight.
+
+        """
+        return oddsTable.lookupBatch(
+            attackerStrength, attackerStamina, attackerItem, targetStrength, targetStamina, targetItem, targetStatus
+        )
+
+    @classmethod
+    def confrontBatch(cls, attackerStrength, attackerStamina, attackerItem, targetStrength, targetStamina, targetItem, targetStatus):
+        """ Will resolve many fights at once using the odds from confrontOddsBatch.
+
+        Note:
+            Draws one uniform number per fight, which picks the winner with the same
+            distribution np.random.choice uses in confront.
+
+        Args:
+            See confrontOddsBatch.
+
+        Return:
+            boolean array, True where the attacker won the fight.
+
+        """
+        import numpy as np
+        selfPlayer, targetPlayer = cls.confrontOddsBatch(
+            attackerStrength, attackerStamina, attackerItem, targetStrength, targetStamina, targetItem, targetStatus
+        )
+        return np.random.random_sample(selfPlayer.shape) < selfPlayer / (selfPlayer + targetPlayer)
 
 
+#: confrontOdds compiled into a lookup table, see models/odds.py
+oddsTable = OddsTable(PlayerModel.confrontOdds)
@@ -0,0 +1,44 @@
+from db import db
+
+class TickModel(db.Model):
+    """
+    The last game tick applied to a database, see ticks.py. There is a single row (id 1) per
+    database: every process runs the tick scheduler, the one that updates the row first applies
+    the tick and the others skip it.
+
+    Attributes:
+        number   (int):   Ticks applied so far.
+        tickedAt (float): time.time() of the last tick.
+    """
+    __tablename__ = 'ticks'
+
+    id       = db.Column(db.Integer, primary_key=True)
+    number   = db.Column(db.Integer, nullable=False, default=0)
+    tickedAt = db.Column(db.Float, nullable=False, default=0)
+
+    def __init__(self, number, tickedAt):
+        self.id       = 1
+        self.number   = number
+        self.tickedAt = tickedAt
+
+    @classmethod
+    def claim(cls, now, spacing):
+        """ Records a tick at 'now' unless the last one is less than 'spacing' seconds old.
+
+            Note:
+                The UPDATE takes the database's write lock, so two processes can't both claim
+                the same tick. Nothing is committed.
+
+            Return:
+                True if the tick is ours to apply.
+        """
+        claimed = cls.query.filter(cls.id == 1, cls.tickedAt <= now - spacing).update(
+            {'number': cls.number + 1, 'tickedAt': now}, synchronize_session=False
+        )
+        if claimed:
+            return True
+        if db.session.query(cls.id).filter_by(id=1).first() is not None:
+            return False
+        db.session.add(cls(1, now))
+        db.session.flush()
+        return True
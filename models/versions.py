@@ -0,0 +1,82 @@
+""" Keeps the 'version' column of lobbies, locations and players up to date, so that the version
+of a single row tells whether its JSON changed (it is used as the ETag of the GET endpoints).
+
+    - a player's version changes whenever the player changes.
+    - a location's version changes whenever it changes or a player in it changes, arrives or leaves.
+    - a lobby's version changes whenever it changes or one of its players changes, joins or leaves.
+
+Every change flushed through the session (save_to_db, delete_from_db, commits) is handled by the
+listeners below. Bulk statements (query.update, bulk_insert_mappings) skip the session, code that
+uses them must bump the versions itself with bumpVersions or 'version': Model.version + 1.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import attributes
+
+from db import db
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+
+
+def bumpVersions(lobbyIds=(), locationIds=(), playerIds=(), connection=None):
+    """ Adds one to the version of the given lobbies, locations and players with one UPDATE per table.
+
+        Args:
+            lobbyIds, locationIds, playerIds: ids of the rows whose version changes. -1 and None are ignored.
+            connection: connection to run the updates on, defaults to the one of db.session.
+    """
+    execute = connection.execute if connection is not None else db.session.execute
+    for model, column, ids in ((LobbyModel, LobbyModel.lobbyId, lobbyIds),
+                               (LocationModel, LocationModel.id, locationIds),
+                               (PlayerModel, PlayerModel.id, playerIds)):
+        ids = {value for value in ids if value is not None and value != -1}
+        if ids:
+            execute(model.__table__.update().where(column.in_(ids)).values(version=model.version + 1))
+
+
+def _values(instance, attribute):
+    """ Old and new values of an attribute that is part of the current flush.
+
+    """
+    history = attributes.get_history(instance, attribute)
+    return set(history.added) | set(history.deleted) | set(history.unchanged)
+
+
+@event.listens_for(db.session, 'before_flush')
+def version_changed_rows(session, flushContext, instances):
+    """ Bumps the version of the rows being updated and remembers which parents need a bump too.
+
+    """
+    lobbyIds, locationIds, bumped = set(), set(), set()
+
+    for instance in session.dirty:
+        if not isinstance(instance, (PlayerModel, LobbyModel, LocationModel)) or not session.is_modified(instance):
+            continue
+        # Evaluated by the UPDATE the flush is about to run, so it costs no extra statement
+        instance.version = type(instance).version + 1
+        bumped.add(instance)
+        if isinstance(instance, PlayerModel):
+            lobbyIds    |= _values(instance, 'currentLobby')
+            locationIds |= _values(instance, 'locationId')
+
+    for instance in session.new | session.deleted:
+        if isinstance(instance, PlayerModel):
+            lobbyIds    |= _values(instance, 'currentLobby')
+            locationIds |= _values(instance, 'locationId')
+
+    # Parents that were bumped above or are being deleted don't need another UPDATE
+    lobbyIds    -= {instance.lobbyId for instance in bumped.union(session.deleted) if isinstance(instance, LobbyModel)}
+    locationIds -= {instance.id for instance in bumped.union(session.deleted) if isinstance(instance, LocationModel)}
+
+    pending = session.info.setdefault('versionBumps', (set(), set()))
+    pending[0].update(lobbyIds)
+    pending[1].update(locationIds)
+
+
+@event.listens_for(db.session, 'after_flush')
+def version_parents(session, flushContext):
+    """ Runs the bumps collected by version_changed_rows once the rows they depend on were written.
+
+    """
+    lobbyIds, locationIds = session.info.pop('versionBumps', (set(), set()))
+    bumpVersions(lobbyIds, locationIds, connection=session.connection())
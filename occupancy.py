@@ -0,0 +1,98 @@
+""" Who is at a location, without loading the location's players.
+
+Confrontations only need to know which of the players at the attacker's location are real ones.
+occupancyIndex keeps, for the locations played recently,
+
+    locationId -> (version, {playerName: (playerId, role)})
+
+Entries are read with one query on the players' locationId index. occupants() also reads the
+location's version, bumped whenever a player arrives, leaves or changes (see models/versions.py),
+and reads the location again if it changed since.
+
+Moves, joins and lobby deletes of this process drop the entries they make stale right away, those
+of other processes are caught by the version check.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+from db import db
+from models.player import PlayerModel
+from models.locations import LocationModel
+
+
+class OccupancyIndex:
+    """
+    Per-process index of the players at each location, bounded in size (least recently used
+    locations are dropped first).
+
+    Attributes:
+        maxSize (int): Maximum number of locations kept in memory.
+    """
+
+    def __init__(self, maxSize=4096):
+        self.maxSize  = maxSize
+        self.__lock   = Lock()
+        self.__values = OrderedDict()
+
+    def configure(self, maxSize):
+        """ Changes the bound of the index and drops what it holds.
+
+        """
+        with self.__lock:
+            self.maxSize = maxSize
+            self.__values.clear()
+
+    def occupants(self, locationId):
+        """ Players at 'locationId', checked against the location's version.
+
+            Return:
+                dict of playerName -> (playerId, role), empty if the location doesn't exist.
+        """
+        version = LocationModel.findVersion(locationId)
+        if version is None:
+            self.invalidate(locationId)
+            return {}
+
+        entry = self.__get(locationId)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        return self.__read(locationId, version)
+
+    def __get(self, locationId):
+        with self.__lock:
+            entry = self.__values.get(locationId)
+            if entry is not None:
+                self.__values.move_to_end(locationId)
+            return entry
+
+    def __read(self, locationId, version=None):
+        """ Reads the players at 'locationId' with one query on the locationId index and keeps them.
+
+            Note:
+                Entries read without their 'version' are read again by the next call to occupants().
+        """
+        occupants = {}
+        for row in db.session.query(PlayerModel.id, PlayerModel.playerName, PlayerModel.role) \
+                .filter_by(locationId=locationId).order_by(PlayerModel.id):
+            occupants.setdefault(row.playerName, (row.id, row.role))
+
+        if self.maxSize > 0:
+            with self.__lock:
+                self.__values[locationId] = (version, occupants)
+                self.__values.move_to_end(locationId)
+                while len(self.__values) > self.maxSize:
+                    self.__values.popitem(last=False)
+        return occupants
+
+    def invalidate(self, *locationIds):
+        with self.__lock:
+            for locationId in locationIds:
+                self.__values.pop(locationId, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__values.clear()
+
+
+#: Shared by every request of this process, configured by app.py
+occupancyIndex = OccupancyIndex()
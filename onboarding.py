@@ -0,0 +1,208 @@
+""" Bulk onboarding: registering players and creating lobbies by the thousand.
+
+PlayerRegister.post costs a name lookup and a commit per player, CreateLobby.post a dozen
+statements per lobby. registerPlayers and createLobbies do the same work for a whole list:
+
+    - conflicts are found with one query per BATCH_QUERY_SIZE names (playerName IN (...)).
+    - rows are inserted with executemany (bulk_insert_mappings), the ids of the lobbies and
+      locations are allocated up front with shards.allocateIds instead of read back row by row.
+    - everything is committed once, if the commit fails nothing is created.
+
+Both return one result per item, in the order of the items. They back POST /player-register-batch,
+POST /create-lobby-batch and the 'flask register-players' and 'flask create-lobbies' commands.
+"""
+import collections
+import json
+
+import click
+from werkzeug.security import safe_str_cmp
+
+from db import db
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+from openlobbies import openLobbies
+from sharding import shards
+
+#: Names per IN (...) query, below the 999 variables older SQLite versions allow
+BATCH_QUERY_SIZE = 500
+
+
+def chunks(values, size=BATCH_QUERY_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def playerRow(playerName, secretKey, role, heldItem='none', currentLobby=-1, locationId=-1):
+    """ Row of a new player or NPC with the stats every player starts with.
+
+    """
+    return {
+        'playerName'  : playerName,
+        'secretKey'   : secretKey,
+        'role'        : role,
+        'status'      : 'none',
+        'heldItem'    : heldItem,
+        'strength'    : 100,
+        'stamina'     : 100,
+        'currentLobby': currentLobby,
+        'homeId'      : locationId,
+        'locationId'  : locationId
+    }
+
+
+def registerPlayers(players):
+    """ Registers every player of 'players' whose name is free, as PlayerRegister.post would.
+
+        Args:
+            players: list of {'playerName': str, 'secretKey': str}.
+
+        Return:
+            list of {'playerName', 'message'}, one per item of 'players'.
+    """
+    names = {player.get('playerName') for player in players if isinstance(player.get('playerName'), str)}
+    taken = set()
+    for chunk in chunks(names):
+        taken.update(row.playerName for row in db.session.query(PlayerModel.playerName).filter(PlayerModel.playerName.in_(chunk)))
+
+    results, rows = [], []
+    for player in players:
+        name, secretKey = player.get('playerName'), player.get('secretKey')
+        if not isinstance(name, str) or not isinstance(secretKey, str) or not name or not secretKey:
+            message = 'playerName and secretKey must be provided!'
+        elif name in taken:
+            message = 'User already exists!'
+        else:
+            taken.add(name)
+            rows.append(playerRow(name, secretKey, 'player'))
+            message = 'Player was created succesfully!'
+        results.append({'playerName': name, 'message': message})
+
+    try:
+        if rows:
+            db.session.bulk_insert_mappings(PlayerModel, rows)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    return results
+
+
+def createLobbies(owners, checkSecrets=True):
+    """ Creates a lobby for every owner of 'owners' that isn't part of one, as CreateLobby.post would.
+
+        Args:
+            owners: list of {'playerName': str, 'secretKey': str}.
+            checkSecrets: False to skip the secretKey check, for the admin command.
+
+        Return:
+            list of {'playerName', 'message'} (and 'lobbyId' for the lobbies created), one per item of 'owners'.
+    """
+    names = {owner.get('playerName') for owner in owners if isinstance(owner.get('playerName'), str)}
+    found = {}
+    for chunk in chunks(names):
+        for player in PlayerModel.query.filter(PlayerModel.playerName.in_(chunk), PlayerModel.role == 'player'):
+            found[player.playerName] = player
+
+    results, byShard, taken = [], collections.OrderedDict(), set()
+    for owner in owners:
+        result = {'playerName': owner.get('playerName')}
+        player = found.get(result['playerName'])
+        if checkSecrets and (player is None or not safe_str_cmp(str(owner.get('secretKey')), player.secretKey)):
+            result['message'] = 'Invalid credentials'
+        elif player is None:
+            result['message'] = 'Player was not found!'
+        elif player.currentLobby != -1 or player.id in taken:
+            result['message'] = 'Lobby already exists!'
+        else:
+            taken.add(player.id)
+            byShard.setdefault(shards.next(), []).append((result, player))
+        results.append(result)
+
+    try:
+        for shard, group in byShard.items():
+            createInShard(shard, group)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    for result in results:
+        if 'lobbyId' in result:
+            openLobbies.update(result['lobbyId'], 1)
+    return results
+
+
+def createInShard(shard, group):
+    """ Inserts the lobbies, locations and NPCs of 'group', a list of (result, owner PlayerModel), in 'shard'.
+
+    """
+    lobbies, locations, npcs, owners = [], [], [], []
+    with shards.shard(shard):
+        lobbyIds = shards.allocateIds(LobbyModel, len(group))
+        locationIds = iter(shards.allocateIds(LocationModel, 3 * len(group)))
+
+        for (result, player), lobbyId in zip(group, lobbyIds):
+            clerkName = ''.join(reversed(player.playerName))
+            homeId, storeId, stationId = next(locationIds), next(locationIds), next(locationIds)
+
+            lobbies.append({'lobbyId': lobbyId, 'lobbyOwner': player.playerName, 'lobbySize': 1})
+            for locationId, locationOwner, locationName in ((homeId, player.playerName, 'home'), (storeId, clerkName, 'store'),
+                                                            (stationId, clerkName, 'station')):
+                locations.append({'id': locationId, 'locationOwner': locationOwner, 'locationName': locationName, 'numOfPlayers': 1})
+            # The store clerk and the cop every lobby has, see CreateLobby.post
+            npcs.append(playerRow(clerkName, ''.join(reversed(player.secretKey)), 'npc', 'none', lobbyId, storeId))
+            npcs.append(playerRow('Chief Wiggum', 'ralph', 'npc', 'gun', lobbyId, stationId))
+            owners.append(dict(shards.rowOf(player), currentLobby=lobbyId, homeId=homeId, locationId=homeId, version=player.version + 1))
+
+            result.update(message='Lobby was created succesfully!', lobbyId=lobbyId)
+
+        db.session.bulk_insert_mappings(LobbyModel, lobbies)
+        db.session.bulk_insert_mappings(LocationModel, locations)
+
+    if(shards.enabled):
+        # The NPCs get their accounts in the directory, then they and the owners enter the lobbies' shard
+        shards.register(npcs)
+        shards.enter(npcs + owners)
+    else:
+        db.session.bulk_insert_mappings(PlayerModel, npcs)
+        db.session.bulk_update_mappings(PlayerModel, [
+            {key: owner[key] for key in ('id', 'currentLobby', 'homeId', 'locationId', 'version')} for owner in owners
+        ])
+
+
+def report(results):
+    """ Prints how many items got each message and the items that were not created.
+
+    """
+    counts = collections.Counter(result['message'] for result in results)
+    for message, count in counts.most_common():
+        click.echo('{:>8}  {}'.format(count, message))
+    for result in results:
+        if 'succesfully' not in result['message']:
+            click.echo('{}: {}'.format(result['playerName'], result['message']), err=True)
+
+
+def init_app(app):
+    """ Registers the admin commands:
+
+            flask register-players players.json     [{"playerName": "...", "secretKey": "..."}, ...]
+            flask create-lobbies owners.json        ["playerName", ...]
+
+        Args:
+            app: Flask application.
+    """
+    app.config.setdefault('BULK_MAX_ITEMS', 10000)
+
+    @app.cli.command('register-players')
+    @click.argument('path', type=click.File('r'))
+    def register_players_command(path):
+        """ Registers the players listed in a JSON file. """
+        report(registerPlayers(json.load(path)))
+
+    @app.cli.command('create-lobbies')
+    @click.argument('path', type=click.File('r'))
+    def create_lobbies_command(path):
+        """ Creates a lobby for every player named in a JSON file. """
+        report(createLobbies([{'playerName': name} for name in json.load(path)], checkSecrets=False))
@@ -0,0 +1,131 @@
+""" The lobbies that aren't full, fullest first, for matchmaking (see matchmaking.py).
+
+Finding a lobby a player can join would otherwise mean reading every lobby. openLobbies keeps,
+for the lobbies with fewer than LOBBY_CAPACITY players,
+
+    lobbyId -> lobbySize
+
+and a heap of (-lobbySize, lobbyId) entries over them: the fullest open lobby, the oldest among
+equals, is found and given a seat in O(log n). Filling the fullest lobbies first gets games
+started sooner than spreading players over every lobby.
+
+The index is read from the lobbies of every database the first time it is used and kept in sync
+by the lobbies this process creates, joins and deletes. It is only a hint: matchmaking.py takes a
+seat for real with a conditional UPDATE, which catches the lobbies other processes filled. The
+lobbies other processes create are found when the index runs out of lobbies: it is read again
+then, at most every MATCHMAKING_RELOAD_INTERVAL seconds.
+"""
+import heapq
+import time
+from threading import Lock
+
+from db import db
+from models.lobby import LobbyModel
+from sharding import shards
+
+
+class OpenLobbies:
+    """
+    Per-process priority queue of the lobbies that aren't full.
+
+    Attributes:
+        capacity       (int):   Players a lobby holds, LOBBY_CAPACITY.
+        reloadInterval (float): Seconds between two reads of the lobbies when the index is empty.
+    """
+
+    def __init__(self, capacity=3, reloadInterval=10):
+        self.capacity       = capacity
+        self.reloadInterval = reloadInterval
+        self.__lock     = Lock()
+        self.__sizes    = {}
+        self.__heap     = []
+        self.__loadedAt = None
+
+    def configure(self, capacity, reloadInterval):
+        """ Changes the capacity of the lobbies and drops what the index holds.
+
+        """
+        with self.__lock:
+            self.capacity       = capacity
+            self.reloadInterval = reloadInterval
+        self.clear()
+
+    def __len__(self):
+        return len(self.__sizes)
+
+    def take(self):
+        """ A seat in the fullest open lobby.
+
+            Note:
+                The seat is counted right away, the lobby's size in the index goes up by one. A
+                seat the database then refuses must be corrected with update() or remove().
+
+            Return:
+                lobbyId, None if no lobby has room.
+        """
+        self.__load()
+        with self.__lock:
+            while self.__heap:
+                negativeSize, lobbyId = heapq.heappop(self.__heap)
+                # Entries whose lobby changed size or went away since they were pushed are skipped
+                if self.__sizes.get(lobbyId) == -negativeSize:
+                    self.__set(lobbyId, -negativeSize + 1)
+                    return lobbyId
+            return None
+
+    def update(self, lobbyId, lobbySize):
+        """ Records the size of a lobby that was created or joined.
+
+        """
+        with self.__lock:
+            self.__set(lobbyId, lobbySize)
+
+    def remove(self, *lobbyIds):
+        with self.__lock:
+            for lobbyId in lobbyIds:
+                self.__sizes.pop(lobbyId, None)
+
+    def clear(self):
+        """ Forgets every lobby, they are read again the next time a seat is taken.
+
+        """
+        with self.__lock:
+            self.__sizes.clear()
+            self.__heap     = []
+            self.__loadedAt = None
+
+    def __set(self, lobbyId, lobbySize):
+        if lobbySize >= self.capacity:
+            self.__sizes.pop(lobbyId, None)
+            return
+        self.__sizes[lobbyId] = lobbySize
+        heapq.heappush(self.__heap, (-lobbySize, lobbyId))
+        # Every change leaves a stale entry behind, they are dropped once they outnumber the lobbies
+        if len(self.__heap) > 2 * len(self.__sizes) + 64:
+            self.__heap = [(-size, lobbyId) for lobbyId, size in self.__sizes.items()]
+            heapq.heapify(self.__heap)
+
+    def __load(self):
+        """ Reads the open lobbies of every database if the index never was, or is empty and was
+            read more than reloadInterval seconds ago.
+
+        """
+        now = time.monotonic()
+        with self.__lock:
+            if self.__loadedAt is not None and (self.__sizes or now - self.__loadedAt < self.reloadInterval):
+                return
+            self.__loadedAt = now
+
+        sizes = {}
+        for shard in (range(shards.count) if shards.enabled else [None]):
+            with shards.shard(shard):
+                sizes.update(db.session.query(LobbyModel.lobbyId, LobbyModel.lobbySize).filter(LobbyModel.lobbySize < self.capacity))
+        with self.__lock:
+            for lobbyId, lobbySize in sizes.items():
+                # What this process did while the lobbies were read is more recent
+                if lobbyId not in self.__sizes:
+                    self.__set(lobbyId, lobbySize)
+
+
+#: Shared by every request of this process, configured by app.py
+openLobbies = OpenLobbies()
@@ -0,0 +1,316 @@
+""" On-demand profiling of single requests (app.config['PROFILING_ENABLED']).
+
+GET /metrics tells which endpoint is slow, not where the time of a slow call goes. When profiling
+is enabled a request is run under cProfile if
+
+    - it carries the PROFILING_HEADER header with PROFILING_TOKEN as value (X-Profile: <token>).
+      Without a token the header is ignored, anybody could make the server profile requests.
+    - it is picked at random, PROFILING_SAMPLE_RATE of the requests (0.01 is 1 in 100).
+
+Each capture is written to PROFILING_DIRECTORY/<method>_<endpoint>/<time>-<pid>-<n>, the oldest
+ones are deleted once there are more than PROFILING_MAX_CAPTURES:
+
+    .prof       the pstats dump (python -m pstats, snakeviz, flameprof, gprof2dot...).
+    .sql.json   every SQL statement of the request with its duration and database.
+
+A profiled response carries an X-Profile-Id header naming its capture. 'flask profiles' lists,
+aggregates (with --folded, collapsed stacks for flamegraph.pl or speedscope) and diffs captures.
+
+Note:
+    cProfile makes a request several times slower, keep the sample rate low in production. Only
+    the thread of the request is profiled.
+"""
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import random
+import re
+import time
+
+import click
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_captures = itertools.count(1)
+
+
+def wanted():
+    """ Whether the current request should be profiled, see above.
+
+    """
+    config = current_app.config
+    token = config['PROFILING_TOKEN']
+    if token and request.headers.get(config['PROFILING_HEADER']) == token:
+        return True
+    rate = config['PROFILING_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+
+def start_profile():
+    if not wanted():
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is running on this thread
+        return
+    g.profileSql = []
+    g.profiler = profiler
+    g.profileStart = time.perf_counter()
+
+
+def stop_profile(response):
+    capture = finish()
+    if capture is not None:
+        response.headers['X-Profile-Id'] = capture
+    return response
+
+
+def abort_profile(exception):
+    finish()
+
+
+def finish():
+    """ Stops the profiler of the current request and writes its capture.
+
+        Return:
+            the capture's id ('<method>_<endpoint>/<name>'), None if the request wasn't profiled.
+    """
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+    profiler.disable()
+    seconds = time.perf_counter() - g.profileStart
+
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    folder = re.sub(r'[^A-Za-z0-9]+', '_', '{}_{}'.format(request.method, endpoint)).strip('_')
+    name = '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(_captures))
+    directory = os.path.join(current_app.config['PROFILING_DIRECTORY'], folder)
+    os.makedirs(directory, exist_ok=True)
+
+    base = os.path.join(directory, name)
+    profiler.dump_stats(base + '.prof')
+    statements = g.pop('profileSql')
+    with open(base + '.sql.json', 'w') as file:
+        json.dump({
+            'method'    : request.method,
+            'endpoint'  : endpoint,
+            'path'      : request.path,
+            'seconds'   : seconds,
+            'sqlSeconds': sum(statement['seconds'] for statement in statements),
+            'statements': statements
+        }, file, indent=1)
+    prune(current_app.config['PROFILING_DIRECTORY'], current_app.config['PROFILING_MAX_CAPTURES'])
+    return '{}/{}'.format(folder, name)
+
+
+def prune(directory, keep):
+    """ Deletes the oldest captures of 'directory' until at most 'keep' are left.
+
+    """
+    files = captureFiles([directory])
+    if len(files) <= keep:
+        return
+    files.sort(key=lambda path: os.stat(path).st_mtime)
+    for path in files[:len(files) - keep]:
+        for name in (path, path[:-len('.prof')] + '.sql.json'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                # Pruned by another worker at the same time
+                pass
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_profiled_statement(connection, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'profiler' in g:
+        connection.info.setdefault('profileStarts', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_profiled_statement(connection, cursor, statement, parameters, context, executemany):
+    starts = connection.info.get('profileStarts')
+    if not starts or not has_request_context() or 'profiler' not in g:
+        return
+    g.profileSql.append({
+        'statement'  : statement,
+        'seconds'    : time.perf_counter() - starts.pop(),
+        'database'   : os.path.basename(connection.engine.url.database or '') or str(connection.engine.url),
+        'executemany': executemany
+    })
+
+
+# Reading captures
+
+def captureFiles(paths):
+    """ .prof files of 'paths': captures, endpoint folders, or the whole PROFILING_DIRECTORY.
+
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += sorted(os.path.join(root, name) for name in names if name.endswith('.prof'))
+        elif path.endswith('.prof'):
+            files.append(path)
+        else:
+            files.append(path + '.prof')
+    return files
+
+
+def load(files):
+    """ pstats.Stats of 'files' added together, and the SQL statements of their captures.
+
+    """
+    stats = pstats.Stats(files[0])
+    for path in files[1:]:
+        stats.add(path)
+    statements = []
+    for path in files:
+        sqlPath = path[:-len('.prof')] + '.sql.json'
+        if os.path.exists(sqlPath):
+            with open(sqlPath) as file:
+                statements += json.load(file)['statements']
+    return stats, statements
+
+
+def functionName(function):
+    path, line, name = function
+    return name if path == '~' else '{}:{}({})'.format(os.path.basename(path), line, name)
+
+
+def folded(stats, maxDepth=64):
+    """ Collapsed stacks ('caller;callee;... microseconds' lines) of 'stats', for flamegraph tools.
+
+        Note:
+            cProfile only records caller -> callee edges, the stacks are rebuilt from the roots
+            down, a function's time being split between its callers in proportion to the time
+            each call took. Recursive calls are cut, the graph is an approximation.
+    """
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((function, edge))
+    roots = [function for function, row in stats.stats.items() if not row[4]]
+    # Stacks taking less than 0.1% of the time are left out
+    threshold = sum(stats.stats[root][3] for root in roots) / 1000
+
+    lines = {}
+
+    def walk(function, stack, share):
+        """ 'share' is the cumulative time of 'function' spent under 'stack'. """
+        _, _, tt, ct, _ = stats.stats[function]
+        ratio = share / ct if ct else 0
+        stack = stack + [functionName(function)]
+        lines[';'.join(stack)] = lines.get(';'.join(stack), 0) + tt * ratio
+        if len(stack) >= maxDepth:
+            return
+        for callee, (_, _, _, edgeTime) in callees.get(function, []):
+            if edgeTime * ratio >= threshold and functionName(callee) not in stack:
+                walk(callee, stack, edgeTime * ratio)
+
+    for root in roots:
+        walk(root, [], stats.stats[root][3])
+    return ['{} {}'.format(stack, int(seconds * 1e6)) for stack, seconds in sorted(lines.items()) if seconds > 0]
+
+
+def sqlSummary(statements, limit):
+    """ Lines with the SQL statements that took the most time, summed by statement text.
+
+    """
+    byStatement = {}
+    for statement in statements:
+        entry = byStatement.setdefault(' '.join(statement['statement'].split()), [0, 0.0])
+        entry[0] += 1
+        entry[1] += statement['seconds']
+    rows = sorted(byStatement.items(), key=lambda item: -item[1][1])[:limit]
+    return ['{:>6} {:>10.2f}  {}'.format(count, seconds * 1e3, text[:120]) for text, (count, seconds) in rows]
+
+
+def init_app(app):
+    """ Profiles the requests picked by wanted() and registers 'flask profiles'.
+
+            flask profiles list
+            flask profiles aggregate [PATH...] [--sort cumulative] [--limit 25] [--folded out.txt]
+            flask profiles diff BEFORE AFTER [--limit 25]
+
+        PATH is a capture, an endpoint folder or PROFILING_DIRECTORY (the default).
+
+        Args:
+            app: Flask application.
+    """
+    app.config.setdefault('PROFILING_ENABLED', False)
+    app.config.setdefault('PROFILING_HEADER', 'X-Profile')
+    app.config.setdefault('PROFILING_TOKEN', None)
+    app.config.setdefault('PROFILING_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILING_DIRECTORY', 'profiles')
+    app.config.setdefault('PROFILING_MAX_CAPTURES', 500)
+
+    if app.config['PROFILING_ENABLED']:
+        app.before_request(start_profile)
+        app.after_request(stop_profile)
+        app.teardown_request(abort_profile)
+
+    @app.cli.group('profiles')
+    def profiles_command():
+        """ Reads the captures of the request profiler. """
+
+    @profiles_command.command('list')
+    def list_command():
+        """ Number of captures per endpoint. """
+        directory = current_app.config['PROFILING_DIRECTORY']
+        if not os.path.isdir(directory):
+            return
+        for folder in sorted(os.listdir(directory)):
+            click.echo('{:>6}  {}'.format(len(captureFiles([os.path.join(directory, folder)])), folder))
+
+    @profiles_command.command('aggregate')
+    @click.argument('paths', nargs=-1)
+    @click.option('--sort', default='cumulative', help='pstats sort key: cumulative, tottime, ncalls...')
+    @click.option('--limit', type=int, default=25)
+    @click.option('--folded', 'foldedPath', type=click.Path(dir_okay=False), help='write collapsed stacks to this file')
+    def aggregate_command(paths, sort, limit, foldedPath):
+        """ Adds captures together and prints the top functions and SQL statements. """
+        files = captureFiles(paths or [current_app.config['PROFILING_DIRECTORY']])
+        if not files:
+            raise click.ClickException('No capture found.')
+        stats, statements = load(files)
+        click.echo('{} captures, {:.2f} ms of SQL in {} statements'.format(
+            len(files), sum(statement['seconds'] for statement in statements) * 1e3, len(statements)))
+        stats.stream = click.get_text_stream('stdout')
+        stats.sort_stats(sort).print_stats(limit)
+        click.echo('{:>6} {:>10}  {}'.format('count', 'sql ms', 'statement'))
+        for line in sqlSummary(statements, limit):
+            click.echo(line)
+        if foldedPath:
+            with open(foldedPath, 'w') as file:
+                file.write('\n'.join(folded(stats)) + '\n')
+
+    @profiles_command.command('diff')
+    @click.argument('before')
+    @click.argument('after')
+    @click.option('--limit', type=int, default=25)
+    def diff_command(before, after, limit):
+        """ Functions whose time per capture changed the most between two sets of captures. """
+        sides = []
+        for path in (before, after):
+            files = captureFiles([path])
+            if not files:
+                raise click.ClickException('No capture found in {}.'.format(path))
+            stats, statements = load(files)
+            perCapture = {function: row[3] / len(files) for function, row in stats.stats.items()}
+            sides.append((perCapture, sum(statement['seconds'] for statement in statements) / len(files), len(statements) / len(files)))
+
+        (old, oldSql, oldStatements), (new, newSql, newStatements) = sides
+        click.echo('SQL per capture: {:.2f} ms in {:.1f} statements -> {:.2f} ms in {:.1f} statements'.format(
+            oldSql * 1e3, oldStatements, newSql * 1e3, newStatements))
+        click.echo('{:>12} {:>12} {:>12}  {}'.format('before ms', 'after ms', 'delta ms', 'function (cumulative time per capture)'))
+        functions = set(old) | set(new)
+        deltas = sorted(functions, key=lambda function: -abs(new.get(function, 0) - old.get(function, 0)))
+        for function in deltas[:limit]:
+            oldTime, newTime = old.get(function, 0), new.get(function, 0)
+            click.echo('{:>12.3f} {:>12.3f} {:>+12.3f}  {}'.format(oldTime * 1e3, newTime * 1e3, (newTime - oldTime) * 1e3, functionName(function)))
@@ -0,0 +1,86 @@
+""" Read/write routing of the session (app.config['READ_ROUTING']).
+
+Endpoints decorated with @readOnly send every statement of their request to a read engine with a
+pool of its own, so reads never wait for a connection held by a writer and can be scaled apart:
+
+    - by default the read engine of a database opens the same SQLite file with mode=ro. With the
+      'production' storage profile (WAL) its readers never wait for the writer's lock either.
+    - READ_DATABASE_URI, and READ_SHARD_DATABASE_URI formatted with the shard index, point the
+      reads at replicas instead (absolute URLs, they are used as given).
+
+Note:
+    A read-only request can't write: SQLite refuses with "attempt to write a readonly database".
+    Databases that can't be opened twice (in-memory SQLite) are read through their writer engine.
+"""
+import functools
+import sqlite3
+from threading import Lock
+from urllib.request import pathname2url
+
+from flask import current_app, g
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+_lock = Lock()
+
+
+def readOnly(function):
+    """ Decorator of the resource methods whose request only reads, see above.
+
+        Note:
+            Put it above @jwt_required(), the identity lookup is a read as well.
+    """
+    @functools.wraps(function)
+    def routed(*args, **kwargs):
+        if current_app.config.get('READ_ROUTING'):
+            g.readOnly = True
+        return function(*args, **kwargs)
+    return routed
+
+
+def readEngine(app, writer, shard=None):
+    """ Read engine of the database 'writer' writes to, created on first use.
+
+        Args:
+            app: Flask application.
+            writer: Engine the session would use to write.
+            shard: index of the shard 'writer' belongs to, None for the main database.
+    """
+    engines = app.extensions['replicas']
+    engine = engines.get(writer)
+    if engine is None:
+        with _lock:
+            engine = engines.get(writer)
+            if engine is None:
+                engine = engines[writer] = createReadEngine(app, writer, shard)
+    return engine
+
+
+def createReadEngine(app, writer, shard):
+    size = app.config['READ_POOL_SIZE']
+    options = {'poolclass': QueuePool, 'pool_size': size, 'max_overflow': size, 'pool_timeout': 30}
+
+    uri = app.config['READ_DATABASE_URI'] if shard is None else app.config['READ_SHARD_DATABASE_URI']
+    if uri is not None:
+        if uri.startswith('sqlite'):
+            options['connect_args'] = {'check_same_thread': False}
+        return create_engine(uri if shard is None else uri.format(shard), **options)
+
+    path = writer.url.database
+    if writer.url.get_backend_name() != 'sqlite' or path in (None, '', ':memory:'):
+        return writer
+    location = 'file:{}?mode=ro'.format(pathname2url(path))
+    return create_engine('sqlite://', creator=lambda: sqlite3.connect(location, uri=True, check_same_thread=False), **options)
+
+
+def init_app(app):
+    """ Sets the defaults of the read routing settings, see above.
+
+        Args:
+            app: Flask application.
+    """
+    app.config.setdefault('READ_ROUTING', True)
+    app.config.setdefault('READ_DATABASE_URI', None)
+    app.config.setdefault('READ_SHARD_DATABASE_URI', None)
+    app.config.setdefault('READ_POOL_SIZE', 8)
+    app.extensions['replicas'] = {}
@@ -0,0 +1,82 @@
+""" JSON encoding of the responses of the API.
+
+flask_restful serializes what resources return with the stdlib json module. Large lobby and location
+payloads spend a good share of their CPU time there, so the Api is given a representation backed by
+orjson when it is installed, falling back to the stdlib otherwise.
+
+    representations.init_app(app, api)
+
+app.config['JSON_BACKEND'] picks the encoder: 'orjson', 'json' or None for the fastest available.
+"""
+import json
+
+from flask import make_response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def stdlibDumps(data):
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def orjsonDumps(data):
+    """ orjson rejects what the stdlib module accepts in a few cases (integers beyond 64 bits),
+        those payloads go through the stdlib.
+
+    """
+    try:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    except TypeError:
+        return stdlibDumps(data)
+
+
+#: Encoders by name, each takes a JSON serializable value and returns bytes
+JSON_BACKENDS = {'json': stdlibDumps}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = orjsonDumps
+
+#: Encoder used by output_json and jsonResponse, set by init_app
+dumps = JSON_BACKENDS['orjson' if orjson is not None else 'json']
+
+
+def useBackend(name):
+    """ Makes 'name' the encoder of every response. None picks the fastest one available.
+
+    """
+    global dumps
+    if name is None:
+        name = 'orjson' if orjson is not None else 'json'
+    if name not in JSON_BACKENDS:
+        raise ValueError('JSON backend {} is not available, installed backends: {}'.format(name, ', '.join(JSON_BACKENDS)))
+    dumps = JSON_BACKENDS[name]
+
+
+def output_json(data, code, headers=None):
+    """ flask_restful representation of 'application/json' responses.
+
+    """
+    response = make_response(dumps(data), code)
+    response.headers.extend(headers or {})
+    response.mimetype = 'application/json'
+    return response
+
+
+def jsonResponse(data, code=200):
+    """ Same as flask.jsonify but with our encoder, for views that are not flask_restful resources.
+
+    """
+    return output_json(data, code)
+
+
+def init_app(app, api):
+    """ Installs the encoder named by app.config['JSON_BACKEND'] on 'api'.
+
+        Args:
+            app: Flask application.
+            api: flask_restful Api of the application.
+    """
+    useBackend(app.config.setdefault('JSON_BACKEND', None))
+    api.representations['application/json'] = output_json
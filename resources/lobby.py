@@ -1,8 +1,21 @@
 from flask_restful import Resource, reqparse
+from flask import Response, current_app
 from flask_jwt import jwt_required, current_identity
+from db import db
 from models.lobby import LobbyModel
 from models.player import PlayerModel
 from models.locations import LocationModel
+from security import currentPlayer
+from sharding import shards
+from replicas import readOnly
+import etags
+from events import eventBus, stream
+from occupancy import occupancyIndex
+from gamestate import gameState
+from onboarding import createLobbies
+from compaction import deleteLobby
+from matchmaking import matchPlayers
+from openlobbies import openLobbies
 
 class CreateLobby(Resource):
     """Class use to handle game lobby creation endpoints. This is the external representation of the 
@@ -25,65 +38,110 @@ class CreateLobby(Resource):
                 return an error message if the lobby could not be made
 
         """
-        playerName = current_identity.playerName
-        player     = PlayerModel.findByPlayerName(playerName)
+        player     = currentPlayer()
 
         # Checks if the user creating the lobby isn't part of one already
         if(player.currentLobby == -1):
 
+            # The lobby, its locations, the player and the NPCs are created as one unit of work:
+            # a single commit, and nothing is left behind if any step fails.
             try:
+                clerkName=''.join(reversed(player.playerName))
+                clerkSecretKey=''.join(reversed(player.secretKey))
+
                 newLobby            = LobbyModel(player.playerName)
-                newLobby.save_to_db()
-            except:
-                return {'message': 'Could not create lobby. Error with creating lobby.'}
-            
-            try:
                 home                = LocationModel(player.playerName, 'home')
-                home.save_to_db()
-            except:
-                return {'message': 'Could not create lobby. Error with creating player home.'}
-            
-            try:
-                player.currentLobby = newLobby.lobbyId
-                player.homeId       = home.id
-                player.locationId   = home.id 
-                player.save_to_db()
+                store               = LocationModel(clerkName, 'store')
+                policeStation       = LocationModel(clerkName, 'station')
+
+                # One flush gives the lobby and the locations their ids. With shards they are
+                # created in the shard the new lobby is given, see sharding.py
+                shards.use(shards.next())
+                db.session.add_all([newLobby, home, store, policeStation])
+                db.session.flush()
+                lobbyId     = newLobby.lobbyId
+                locationIds = [home.id, store.id, policeStation.id]
+
+                #: list of (name, secretKey, heldItem, home) of the NPCs every lobby has: the store clerk and the cop
+                npcs = [
+                    (clerkName,      clerkSecretKey, 'none', store),
+                    ('Chief Wiggum', 'ralph',        'gun',  policeStation)
+                ]
+                npcRows = [{
+                    'playerName'  : name,
+                    'secretKey'   : secretKey,
+                    'role'        : 'npc',
+                    'status'      : 'none',
+                    'heldItem'    : heldItem,
+                    'strength'    : 100,
+                    'stamina'     : 100,
+                    'currentLobby': newLobby.lobbyId,
+                    'homeId'      : location.id,
+                    'locationId'  : location.id
+                } for name, secretKey, heldItem, location in npcs]
+
+                if(shards.enabled):
+                    # The NPCs get their accounts in the directory, then they and the player enter the lobby's shard
+                    shards.register(npcRows)
+                    shards.enter(npcRows + [
+                        dict(shards.rowOf(player), currentLobby=newLobby.lobbyId, homeId=home.id, locationId=home.id)
+                    ])
+                else:
+                    player.currentLobby = newLobby.lobbyId
+                    player.homeId       = home.id
+                    player.locationId   = home.id
+                    db.session.bulk_insert_mappings(PlayerModel, npcRows)
+
+                db.session.commit()
             except:
-                return {'message': 'Could not create lobby. Error with setting player details'}
+                db.session.rollback()
+                return {'message': 'Could not create lobby. Error with saving it to the DB.'}
 
-            try:
-                clerkName=''.join(reversed(player.playerName))
-                clerkSecretKey=''.join(reversed(player.secretKey))
+            occupancyIndex.invalidate(*locationIds)
+            openLobbies.update(lobbyId, 1)
+            return {'message': 'Lobby was created succesfully!'}
 
-                storeClerk =PlayerModel(clerkName, clerkSecretKey, 'npc', 'none', 'none', 100, 100)
-                store = LocationModel(clerkName, 'store')
-                store.save_to_db()
+        return {'message': 'Lobby already exists!'}
 
-                storeClerk.homeId = store.id
-                storeClerk.locationId = store.id
-                storeClerk.currentLobby = player.currentLobby
-                storeClerk.save_to_db()
-            except:
-                return {'message': 'Could not create lobby. Error with creating clerk'}
 
-            try:
-                policeName='Chief Wiggum'
-                policeSecretKey='ralph'
+class CreateLobbyBatch(Resource):
+    """Class used to create the lobbies of many players in one request, see onboarding.py.
 
-                gameCop =PlayerModel(policeName, policeSecretKey, 'npc', 'none', 'gun', 100, 100)
-                policeStation = LocationModel(clerkName, 'station')
-                policeStation.save_to_db()
+    Attributes:
+        parse: Variable that will let us parse the list of owners from the request body.
 
-                gameCop.homeId = policeStation.id
-                gameCop.locationId = policeStation.id
-                gameCop.currentLobby = player.currentLobby
-                gameCop.save_to_db()
-            except:
-                return {'message': 'Could not create lobby. Error with creating cop'}
+    """
+    parse = reqparse.RequestParser()
+    parse.add_argument(
+        'owners',
+        type=dict,
+        action='append',
+        required=True,
+        help='A list of lobby owners must be provided!'
+    )
 
-            return {'message': 'Lobby was created succesfully!'}
+    def post(self):
+        """ Class method: POST
+            Endpoint: /create-lobby-batch
 
-        return {'message': 'Lobby already exists!'}
+            Every owner is {'playerName': name, 'secretKey': key}, checked as /auth would. A lobby, its
+            locations and NPCs are created for every owner that isn't part of a lobby yet, all of them
+            with a single commit.
+
+            Return:
+                'results' with one {'playerName', 'message'} per owner, in the order they were sent,
+                with the 'lobbyId' of the lobbies that were created.
+
+        """
+        data = CreateLobbyBatch.parse.parse_args()
+        if(len(data['owners']) > current_app.config['BULK_MAX_ITEMS']):
+            return {'message': 'At most {} lobbies can be created at once!'.format(current_app.config['BULK_MAX_ITEMS'])}, 413
+
+        try:
+            results = createLobbies(data['owners'])
+        except:
+            return {'message': 'Could not create lobby. Error with saving it to the DB.'}
+        return {'results': results}
 
 
 class Lobby(Resource):
@@ -93,7 +151,7 @@ class Lobby(Resource):
     Attributes:
 
     """
-    #
+    @readOnly
     def get(self,lobby_id):
         """Class Method used for GET request for game lobby data.
 
@@ -101,14 +159,25 @@ class Lobby(Resource):
             lobby_id: Id of the lobby we want to trieve data from.
 
         Return:
-            Lobby object json, if lobby exists
+            Lobby object json with its ETag, if lobby exists
+            304 Not Modified, if the ETag sent in If-None-Match is still current
             error message, if lobby does not exists
 
         """
-        #: Object of type LobbyModel: Using SQLAlchemy this object will give us access and allow us to manipulate the lobby object in the DB
-        lobby = LobbyModel.findById(lobby_id)
+        shards.route(lobby_id)
+        # Polls are answered from the version of the lobby row, without touching its players
+        version = LobbyModel.findVersion(lobby_id)
+        if version is None:
+            return {'message': 'Lobby does not exist!'}
+
+        tag = etags.entityTag('lobby', lobby_id, version)
+        if etags.isFresh(tag):
+            return etags.notModified(tag)
+
+        #: dict: JSON of the lobby and its players, built from a single query
+        lobby = LobbyModel.jsonById(lobby_id)
         if lobby is not None:
-            return lobby.json()
+            return lobby, 200, etags.headers(tag)
 
         return {'message': 'Lobby does not exist!'}
 
@@ -125,40 +194,77 @@ class Lobby(Resource):
             error message, if is full, player is part of it or doesn't exists
 
         """
-        # Checking if lobby exists
+        # The lobby is about to change through the DB, the in-memory store must let go of it first
+        gameState.evict(lobby_id)
+        #: Object of type PlayerModel: Used with SQLAlchemy to access and manipulate the obj. in the DB
+        player = currentPlayer()
+        # Checking if lobby exists, with shards the player was loaded from the directory or its own lobby's shard
+        shards.route(lobby_id)
         #: Object of type LobbyModel: Used with SQLAlchemy for access and manipulation of obj. in DB
         lobby = LobbyModel.findById(lobby_id)
         if lobby is None:
             return { 'message': 'Lobby does not exists!'}
 
-        if(lobby.lobbySize == 3):
+        if(lobby.lobbySize >= current_app.config['LOBBY_CAPACITY']):
             return {'message': 'Lobby is full'}
         # Adding player to the lobby
-        #: str : retrieves the playerName from the current jwt token 
-        playerName = current_identity.playerName
-        #: Object of type PlayerModel: Used with SQLAlchemy to access and manipulate the obj. in the DB
-        player = PlayerModel.findByPlayerName(playerName)
         if(player.currentLobby == lobby_id):
             return {'message': 'You are already part of the lobby!'}
         elif(player.currentLobby != -1):
             return {'message': 'You are part of a different lobby!'}
-    
-        # sets playes lobbyId to the one he joined
-        player.currentLobby = lobby.lobbyId
-        # Increases lobby size to account new player
-        lobby.lobbySize = lobby.lobbySize + 1
-        lobby.save_to_db()
-        # Create a home for new player
-        home = LocationModel(player.playerName, 'home')
-        home.save_to_db()
-
-        player.locationId = home.id
-        player.homeId = home.id
-
-
-        player.save_to_db()
-        
-        
+
+        if(shards.enabled):
+            # The player's row is copied into the lobby's shard along with its new home
+            try:
+                lobbySize = LobbyModel.claimSeat(lobby_id, current_app.config['LOBBY_CAPACITY'])
+                if lobbySize is None:
+                    db.session.rollback()
+                    return {'message': 'Lobby is full'}
+                home = LocationModel(player.playerName, 'home')
+                db.session.add(home)
+                db.session.flush()
+                shards.enter([dict(shards.rowOf(player), currentLobby=lobby.lobbyId, homeId=home.id, locationId=home.id)])
+                # Read before the commit expires them, used to update the indexes and publish the event
+                homeId, playerName = home.id, player.playerName
+                db.session.commit()
+            except:
+                db.session.rollback()
+                return {'message': 'Could not join the lobby. Error with saving it to the DB.'}
+
+            occupancyIndex.invalidate(homeId)
+            openLobbies.update(lobby_id, lobbySize)
+
+            eventBus.publish(lobby_id, 'join', playerName=playerName, locationId=homeId)
+            return {'message': 'You have succesfully joined the lobby!'}
+
+        # The lobby, the new home and the player are saved with one commit: a home saved on its own
+        # would be an orphan until the player is, and compaction.py could delete it in between
+        try:
+            # Increases lobby size to account new player, unless another join took the last seat first
+            lobbySize = LobbyModel.claimSeat(lobby_id, current_app.config['LOBBY_CAPACITY'])
+            if lobbySize is None:
+                db.session.rollback()
+                return {'message': 'Lobby is full'}
+            # Create a home for new player
+            home = LocationModel(player.playerName, 'home')
+            db.session.add(home)
+            db.session.flush()
+
+            # sets playes lobbyId to the one he joined, the player's row is then written with one UPDATE
+            player.currentLobby = lobby.lobbyId
+            player.locationId = home.id
+            player.homeId = home.id
+            # Read before the commit expires them, used to update the indexes and publish the event
+            homeId, playerName = home.id, player.playerName
+            db.session.commit()
+        except:
+            db.session.rollback()
+            return {'message': 'Could not join the lobby. Error with saving it to the DB.'}
+
+        occupancyIndex.invalidate(homeId)
+        openLobbies.update(lobby_id, lobbySize)
+
+        eventBus.publish(lobby_id, 'join', playerName=playerName, locationId=homeId)
         return {'message': 'You have succesfully joined the lobby!'}
     
 
@@ -175,25 +281,89 @@ class Lobby(Resource):
 
         """
         playerName = current_identity.playerName
+        gameState.evict(lobby_id)
+        shards.route(lobby_id)
         lobby = LobbyModel.findById(lobby_id)
-        players = lobby.players.all()
+        if lobby is None:
+            return {'message': 'Lobby does not exist!'}
 
         # Will check if you are the owner of the lobby you are trying to delete.
         if(lobby.lobbyOwner == playerName):
-            for player in players:
-                player.currentLobby = -1
-                player.homeId = -1
-                player.locationId = -1
-                player.save_to_db()
-
-            lobby.delete_from_db()
+            # Its players are taken out of it, its locations and NPCs go with it
+            deleteLobby(lobby_id)
+            db.session.commit()
+            eventBus.close(lobby_id)
             return {'message': 'Lobby has been deleted!'}
         return {'message': 'You cannot delete the lobby!'}
 
 
-    
+class Matchmaking(Resource):
+    """Class used to place the authenticated player in a lobby that isn't full without knowing its id,
+        see matchmaking.py.
 
+    Attributes:
 
+    """
+    @jwt_required()
+    def post(self):
+        """Class Method used for POST request to be placed in a game lobby.
+           Endpoint: /matchmaking
 
+           The player joins the fullest lobby that still has room, or opens a lobby of its own when
+           none has, as POST /lobby/<lobby_id> and POST /create-lobby would.
 
-    
+        Return:
+            'message' and the 'lobbyId' of the lobby the player is now part of
+            error message, if the player is already part of a lobby
+
+        """
+        player = currentPlayer()
+        if(player.currentLobby != -1):
+            return {'message': 'You are already part of a lobby!'}
+
+        try:
+            result = matchPlayers([player])[0]
+        except:
+            return {'message': 'Could not join a lobby. Error with saving it to the DB.'}
+        del result['playerName']
+        return result
+
+
+class LobbyEventStream(Resource):
+    """Class used to stream the changes of a game lobby as server-sent events, so clients don't have
+        to poll the Lobby resource.
+
+    Attributes:
+
+    """
+    @readOnly
+    def get(self, lobby_id):
+        """Class Method used for GET request for the events of a game lobby.
+           Endpoint: /lobby/<lobby_id>/events
+
+           Every change is sent as a text/event-stream event: join, move, sleep, wake, workout, death
+           and resync (the client fell behind and should GET the lobby again). The stream ends with
+           a closed event when the lobby is deleted.
+
+        Args:
+            lobby_id: Id of the lobby we want to receive events from.
+
+        Return:
+            text/event-stream response, if lobby exists
+            error message, if lobby does not exists or has too many listeners
+
+        """
+        shards.route(lobby_id)
+        if LobbyModel.findVersion(lobby_id) is None:
+            return {'message': 'Lobby does not exist!'}, 404
+
+        # Subscribing before returning means no event committed after this request is missed
+        subscription = eventBus.subscribe(lobby_id)
+        if subscription is None:
+            return {'message': 'Too many clients are listening to this lobby!'}, 503
+
+        return Response(
+            stream(subscription, current_app.config['EVENTS_HEARTBEAT']),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
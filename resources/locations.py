@@ -1,6 +1,9 @@
 from flask_restful import Resource, reqparse
 from flask_jwt import jwt_required, current_identity
 from models.locations import LocationModel
+from sharding import shards
+from replicas import readOnly
+import etags
 
 class Location(Resource):
     """ Class that will handle endpoint requests, this is the extenal representation of the location entity.
@@ -19,6 +22,7 @@ class Location(Resource):
     
     
     @classmethod
+    @readOnly
     def get(cls, location_id):
         """Class method: GET
            Endpoint: /location
@@ -31,12 +35,22 @@ class Location(Resource):
             location_name: Name supplied via URL parameters.
 
         Returns:
-            'message' if the location exists return relative data for that location, otherwise 
+            'message' if the location exists return relative data for that location and its ETag,
+                        304 if the client's ETag is still current, otherwise 
                         error message stating that the location was not found.
 
         """
-        location = LocationModel.findById(location_id)
+        shards.route(location_id)
+        version = LocationModel.findVersion(location_id)
+        if version is None:
+            return {'message': 'Location does not exists'}
+
+        tag = etags.entityTag('location', location_id, version)
+        if etags.isFresh(tag):
+            return etags.notModified(tag)
+
+        location = LocationModel.jsonById(location_id)
         if location is not None:
-            return location.json()
+            return location, 200, etags.headers(tag)
         return {'message': 'Location does not exists'}
    
\ No newline at end of file
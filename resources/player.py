@@ -1,8 +1,19 @@
 from flask_restful import Resource, reqparse
-from models.player  import PlayerModel
+from flask import current_app
+from models.player  import PlayerModel, oddsTable
 from models.locations import LocationModel
+from models.lobby import LobbyModel
 from flask_jwt import jwt_required, current_identity
-from flask import jsonify
+from security import currentPlayer
+from sharding import shards
+from replicas import readOnly
+from db import db
+from models.versions import bumpVersions
+import etags
+from events import eventBus
+from occupancy import occupancyIndex
+from gamestate import gameState, GameTransaction
+from onboarding import registerPlayers
 from werkzeug.security import safe_str_cmp
 
 class PlayerRegister(Resource):
@@ -63,6 +74,44 @@ class PlayerRegister(Resource):
         return {'message': 'Player was created succesfully!'}, 201
 
 
+class PlayerRegisterBatch(Resource):
+    """
+    This is a Resource for registering many players in one request, see onboarding.py.
+
+    Attributes:
+        parse: Variable that will let us parse the list of players from the request body.
+    """
+    parse = reqparse.RequestParser()
+    parse.add_argument(
+        'players',
+        type=dict,
+        action='append',
+        required=True,
+        help='A list of players must be provided!'
+    )
+
+    def post(self):
+        """ Class methods: POST
+            Endpoint: /player-register-batch
+
+            Every player is {'playerName': name, 'secretKey': key}. Names that are taken (or repeated
+            in the list) are reported and skipped, the other players are created with a single commit.
+
+        Returns:
+            'results' with one {'playerName', 'message'} per player, in the order they were sent.
+
+        """
+        data = PlayerRegisterBatch.parse.parse_args()
+        if(len(data['players']) > current_app.config['BULK_MAX_ITEMS']):
+            return {'message': 'At most {} players can be registered at once!'.format(current_app.config['BULK_MAX_ITEMS'])}, 413
+
+        try:
+            results = registerPlayers(data['players'])
+        except:
+            return {'message': 'Error saving to the DB!'}
+        return {'results': results}
+
+
 class Player(Resource):
     """
     This resource will handle any update, deletions and retrival of player data.
@@ -82,6 +131,7 @@ class Player(Resource):
     )
 
     @classmethod
+    @readOnly
     def get(cls, playerName):
         """ Class method: GET
             Endpoint: /player
@@ -94,19 +144,31 @@ class Player(Resource):
             playerName: Name supplied via URL parameters
 
         Returns:
-            'message' if the player exists return relative data for that player, otherwise 
+            'message' if the player exists return relative data for that player and its ETag,
+                        304 if the client's ETag is still current, otherwise 
                         error message stating that the user was not found.
 
         """
         
         try:
-            #: Object of type PlayerModel: Will store an object of the player we want data from.
-            player = PlayerModel.findByPlayerName(playerName)
+            # With shards the player's game state is in the shard of its lobby
+            shards.route(shards.lobbyOf(playerName=playerName))
+            #: Row with the id and version of the player we want data from.
+            version = PlayerModel.findVersionByPlayerName(playerName)
         except:
             return {'message': 'There was an error finding the player in the DB!'}
 
+        if version is None:
+            return {'message': 'Player was not found!'}
+
+        tag = etags.entityTag('player', version.id, version.version)
+        if etags.isFresh(tag):
+            return etags.notModified(tag)
+
+        #: Object of type PlayerModel: Will store an object of the player we want data from.
+        player = PlayerModel.findByPlayerId(version.id)
         if player is not None:
-            return player.json()
+            return player.json(), 200, etags.headers(tag)
 
         return {'message': 'Player was not found!'}
 
@@ -127,6 +189,7 @@ class PlayerLocation(Resource):
 
     )
 
+    @readOnly
     @jwt_required()
     def get(self):
         """ Class method: GET
@@ -134,11 +197,10 @@ class PlayerLocation(Resource):
 
             Will return a players current location details only if that player is authorized and part of a lobby.
         """
-        player   = PlayerModel.findByPlayerId(current_identity.id)
+        player   = currentPlayer()
         if(player.locationId == -1):
             return {'message': 'You are not currently part of a lobby!'}
-        location = LocationModel.findById(player.locationId)
-        return location.json()
+        return LocationModel.jsonById(player.locationId)
 
     @jwt_required()
     def post(self):
@@ -149,38 +211,62 @@ class PlayerLocation(Resource):
             Error check must look for the following. If player is part of the lobby, 
         """
         data = PlayerLocation.parse.parse_args()
-        player = PlayerModel.findByPlayerId(current_identity.id)
+        # In memory mode the store answers for players that are part of a lobby, see gamestate.py. Its
+        # rules are a copy of the ones below, benchmarks/rule_parity.py checks they agree
+        if(gameState.enabled):
+            response = gameState.move(current_identity.id, data['locationId'])
+            if response is not None:
+                return response
+
+        player = currentPlayer()
         
         if(player.locationId == data['locationId']):
             return {'message':'Already at that location.'}
 
-        try:
-
-            currentLocation = LocationModel.findById(player.locationId)
-            currentLocation.numOfPlayers = currentLocation.numOfPlayers - 1
-
-            
-
-            player.locationId = data['locationId']
-            player.stamina    = player.stamina - 10
-
-            newLocation = LocationModel.findById(data['locationId'])
-            newLocation.numOfPlayers = newLocation.numOfPlayers + 1
-
-            player.save_to_db()
-            
-            # Save new locations
-            currentLocation.save_to_db()
-            newLocation.save_to_db()
+        if(player.locationId == -1):
+            return {'message': 'You are not currently part of a lobby!'}
 
-            if(player.stamina == 0):
-                player.status = "sleep"
-                player.save_to_db()
-                return {'message': 'You are out of stamina and have fallen asleep!'}
-            
+        # The whole move is one transaction made of relative updates, so concurrent movers
+        # can never make numOfPlayers drift. The player row is only updated if it still holds
+        # what we read, which tells us whether the move made the player fall asleep.
+        fallsAsleep = player.stamina - 10 == 0
+        # Read before the commit expires the player, used to publish the lobby events
+        lobbyId, playerName, fromLocation = player.currentLobby, player.playerName, player.locationId
+        try:
+            changes = {'locationId': data['locationId'], 'stamina': PlayerModel.stamina - 10, 'version': PlayerModel.version + 1}
+            if(fallsAsleep):
+                changes['status'] = 'sleep'
+            moved = PlayerModel.query.filter_by(id=player.id, locationId=player.locationId, stamina=player.stamina).update(
+                changes, synchronize_session=False
+            )
+
+            left = LocationModel.query.filter_by(id=player.locationId).update(
+                {'numOfPlayers': LocationModel.numOfPlayers - 1, 'version': LocationModel.version + 1}, synchronize_session=False
+            )
+            arrived = LocationModel.query.filter_by(id=data['locationId']).update(
+                {'numOfPlayers': LocationModel.numOfPlayers + 1, 'version': LocationModel.version + 1}, synchronize_session=False
+            )
+            bumpVersions(lobbyIds=[player.currentLobby])
+
+            if(arrived == 0):
+                db.session.rollback()
+                return {'message': 'Location does not exists'}
+
+            if(moved == 0 or left == 0):
+                db.session.rollback()
+                return {'message': 'Your player changed while moving, try again.'}
+
+            db.session.commit()
         except:
+            db.session.rollback()
             return {'message': 'Error saving to the DB!'}
 
+        occupancyIndex.invalidate(fromLocation, data['locationId'])
+        eventBus.publish(lobbyId, 'move', playerName=playerName, fromLocation=fromLocation, toLocation=data['locationId'])
+        if(fallsAsleep):
+            eventBus.publish(lobbyId, 'sleep', playerName=playerName)
+            return {'message': 'You are out of stamina and have fallen asleep!'}
+
         return {'message': 'You have succesfully changed locations.'}
 
 
@@ -202,21 +288,172 @@ class PlayerConfrontation(Resource):
     @jwt_required()
     def post(self):
         data = PlayerConfrontation.parse.parse_args()
-        currentPlayer = PlayerModel.findByPlayerId(current_identity.id)
-        enemy = PlayerModel.findByPlayerId(data['player'])
-        location = LocationModel.findById(currentPlayer.locationId) 
+        attacker = currentPlayer()
 
+        # The other real players at the attacker's location, their rows are only read if there are any
         playerList = []
-        playerCount = 0
-        for player in location.players:
-            if(player.role == 'player' and player.playerName != currentPlayer.playerName):
-                playerCount = playerCount + 1
-                playerList.append(player.json())
-
-        if(playerCount == 0):
+        occupants = occupancyIndex.occupants(attacker.locationId)
+        if(any(role == 'player' and playerName != attacker.playerName for playerName, (_, role) in occupants.items())):
+            rows = db.session.query(*PlayerModel.jsonColumns()) \
+                .filter(PlayerModel.locationId == attacker.locationId, PlayerModel.role == 'player',
+                        PlayerModel.playerName != attacker.playerName) \
+                .order_by(PlayerModel.id)
+            playerList = [PlayerModel.jsonFromRow(row) for row in rows]
+
+        if(len(playerList) == 0):
             return {'message': 'Target Selected'}
         else:
-            return jsonify(playerList)
+            return playerList
+
+
+class PlayerOdds(Resource):
+    """ This resource lets a player preview its odds against a target without fighting.
+
+        Attributes:
+            parse: Variable that will let us parse the target from the query string.
+    """
+    parse = reqparse.RequestParser()
+    parse.add_argument(
+        'target',
+        type=str,
+        required=True,
+        location='args',
+        help='No target was selected!'
+    )
+
+    @readOnly
+    @jwt_required()
+    def get(self):
+        """ Class method: GET
+            Endpoint: /odds?target=playerName
+
+            Returns the probability the authenticated player and the target have of winning a fight,
+            computed as confront would right now. Nothing is changed.
+        """
+        data = PlayerOdds.parse.parse_args()
+        if(gameState.enabled):
+            response = gameState.odds(current_identity.id, data['target'])
+            if response is not None:
+                return response
+
+        player = currentPlayer()
+        if(player.currentLobby == -1):
+            return {'message': 'You are not currently part of a lobby!'}
+
+        target = PlayerModel.findInLobby(data['target'], player.currentLobby)
+        if target is None:
+            return {'message': 'target is not part of your lobby'}
+        return oddsTable.preview(player, target)
+
+
+class PlayerConfrontationBatch(Resource):
+    """ This resource will resolve a list of attacks between the players of a lobby in one request.
+
+        Attributes:
+            parse: Variable that will let us parse the data from the payload from the request body.
+
+    """
+    parse = reqparse.RequestParser()
+    parse.add_argument(
+        'attacks',
+        type=dict,
+        action='append',
+        required=True,
+        help='A list of attacks must be provided!'
+    )
+
+    @jwt_required()
+    def post(self):
+        """ Class method: POST
+            Endpoint: /confront-batch
+
+            Every attack is {'attacker': playerName, 'target': playerName} and both players must be part of
+            the lobby owned by the authenticated player. The odds of every fight are computed from the stats
+            the fighters had when the request arrived and resolved in one pass by PlayerModel.confrontBatch.
+            Results are applied in order, so a fight whose attacker or target died earlier in the list is
+            skipped. Every death is saved with a single commit.
+
+        Returns:
+            'results' with one message per attack, in the order they were sent.
+
+        """
+        data = PlayerConfrontationBatch.parse.parse_args()
+        player = currentPlayer()
+        lobby = LobbyModel.findById(player.currentLobby)
+
+        if(lobby is None or lobby.lobbyOwner != player.playerName):
+            return {'message': 'Only the owner of a lobby can resolve its fights!'}
+
+        # The fights are resolved on the rows, the in-memory store must write its changes first
+        if(gameState.enabled):
+            gameState.evict(lobby.lobbyId)
+            db.session.expire(player)
+
+        names = set()
+        for attack in data['attacks']:
+            names.add(attack.get('attacker'))
+            names.add(attack.get('target'))
+        #: dict of playerName -> PlayerModel for every fighter of the lobby, loaded with one query
+        fighters = {p.playerName: p for p in lobby.players.filter(PlayerModel.playerName.in_(names))}
+
+        results = []
+        fights = []
+        for attack in data['attacks']:
+            attacker = fighters.get(attack.get('attacker'))
+            target   = fighters.get(attack.get('target'))
+            result   = {'attacker': attack.get('attacker'), 'target': attack.get('target')}
+            results.append(result)
+
+            if(attacker is None or target is None):
+                result['message'] = 'player is not part of the lobby'
+            elif(attacker is target):
+                result['message'] = 'players cannot attack themselves'
+            elif(attacker.status == 'dead'):
+                result['message'] = 'attacker already dead'
+            elif(attacker.status == 'sleep'):
+                result['message'] = 'You must be awake to take action!'
+            elif(target.status == 'dead'):
+                result['message'] = 'target already dead'
+            elif(attacker.locationId != target.locationId):
+                result['message'] = 'target was not in the location'
+            else:
+                fights.append((result, attacker, target))
+
+        if(len(fights) == 0):
+            return {'results': results}
+
+        attackerWins = PlayerModel.confrontBatch(
+            [attacker.strength for _, attacker, _ in fights],
+            [attacker.stamina  for _, attacker, _ in fights],
+            [attacker.heldItem for _, attacker, _ in fights],
+            [target.strength   for _, _, target in fights],
+            [target.stamina    for _, _, target in fights],
+            [target.heldItem   for _, _, target in fights],
+            [target.status     for _, _, target in fights]
+        )
+
+        dead = []
+        deaths = []
+        for (result, attacker, target), won in zip(fights, attackerWins):
+            if(attacker.status == 'dead' or target.status == 'dead'):
+                result['message'] = 'skipped, a player died earlier in the batch'
+                continue
+
+            loser = target if won else attacker
+            loser.status = 'dead'
+            dead.append(loser)
+            deaths.append((loser.playerName, attacker.playerName if loser is target else target.playerName))
+            result['message'] = 'kill' if won else 'dead'
+
+        try:
+            PlayerModel.save_all_to_db(dead)
+        except:
+            db.session.rollback()
+            return {'message': 'Error saving to the DB!'}
+
+        for playerName, killedBy in deaths:
+            eventBus.publish(lobby.lobbyId, 'death', playerName=playerName, killedBy=killedBy)
+        return {'results': results}
 
 
 class PlayerAction(Resource):
@@ -247,54 +484,60 @@ class PlayerAction(Resource):
 
         """
         data = PlayerAction.parse.parse_args()
+        # Same rules as gamestate.py's, see PlayerLocation.post
+        if(gameState.enabled):
+            response = gameState.act(current_identity.id, data['action'], data['target'])
+            if response is not None:
+                return response
 
-        if(current_identity.status == 'sleep' and data['action'] != 'wakeup'):
+        player = currentPlayer()
+        # Read before save_to_db() expires the player, used to publish the lobby events
+        lobbyId, playerName = player.currentLobby, player.playerName
+
+        if(player.status == 'sleep' and data['action'] != 'wakeup'):
             return {'message': 'You must be awake to take action!'}
 
         elif(data['action'] == 'attack'):
-            player = PlayerModel.findByPlayerName(current_identity.playerName)
-            target = PlayerModel.findByPlayerName(data['target'])
-            location = LocationModel.findById(player.locationId)
-
-            if(target.status == 'dead'):
+            # A dead target is refused wherever it is, as the game state does (see gamestate.py)
+            target = PlayerModel.findInLobby(data['target'], player.currentLobby)
+            if(target is not None and target.status == 'dead'):
                 return { 'message' : 'target already dead'}
 
-            # p is a player from the list of players in the current location
-            for p in location.players:
-                if(data['target'] == p.playerName):
-                    # once target is found, call confront method from player who attacked
-                    print(player.playerName)
-                    winner = player.confront(p)
-                    if(winner == player.playerName):
-                        target.status = 'dead'
-                        target.save_to_db()  
-                        return { 'message': 'kill' }
-                    else:
-                        player.status = 'dead'
-                        player.save_to_db()
-                        return { 'message': 'dead' }
-                    
-            return {'message': 'target was not in the location'}    
+            # Only the players at our location can be attacked, the target's row already says where it is
+            if(target is None or target.locationId != player.locationId):
+                return {'message': 'target was not in the location'}
+
+            # once target is found, call confront method from player who attacked
+            winner = player.confront(target)
+            if(winner == player.playerName):
+                target.status = 'dead'
+                target.save_to_db()
+                eventBus.publish(lobbyId, 'death', playerName=data['target'], killedBy=playerName)
+                return { 'message': 'kill' }
+            else:
+                player.status = 'dead'
+                player.save_to_db()
+                eventBus.publish(lobbyId, 'death', playerName=playerName, killedBy=data['target'])
+                return { 'message': 'dead' }
 
         elif(data['action'] == 'sleep'):
-            player = PlayerModel.findByPlayerId(current_identity.id)
             player.stamina = player.stamina + 10
             player.status = 'sleep'
             player.save_to_db()
+            eventBus.publish(lobbyId, 'sleep', playerName=playerName)
             return {'message': 'You decided to sleep: +10 stamina'}
 
         elif(data['action'] == 'wakeup'):
-            player = PlayerModel.findByPlayerId(current_identity.id)
             player.status = 'none'
             player.save_to_db()
+            eventBus.publish(lobbyId, 'wake', playerName=playerName)
             return {'message': 'You are now awake'}
 
         elif(data['action'] == 'workout'):
-            player = PlayerModel.findByPlayerId(current_identity.id)
-
             if(player.stamina == 0):
                 player.status = "sleep"
                 player.save_to_db()
+                eventBus.publish(lobbyId, 'sleep', playerName=playerName)
                 return {'message': 'You are out of stamina and have fallen asleep!'}
 
             
@@ -303,6 +546,8 @@ class PlayerAction(Resource):
             player.status = "sleep"
             
             player.save_to_db()
+            eventBus.publish(lobbyId, 'workout', playerName=playerName)
+            eventBus.publish(lobbyId, 'sleep', playerName=playerName)
             return {'message': 'You decided to sleep: +10 strength -10 stamina'}
         
         else:
@@ -314,4 +559,44 @@ class PlayerAction(Resource):
         
 
 
+class PlayerActionBatch(Resource):
+    """ This resource will run a whole turn of the authenticated player, many actions and moves, in one request.
+
+        Attributes:
+            parse: Variable that will let us parse the data from the payload from the request body.
+    """
+    parse = reqparse.RequestParser()
+    parse.add_argument(
+        'actions',
+        type=dict,
+        action='append',
+        required=True,
+        help='A list of actions must be provided!'
+    )
+
+    @jwt_required()
+    def post(self):
+        """ Class method: POST
+            Endpoint: /action-batch
+
+            Every action is {'action': 'sleep' / 'wakeup' / 'workout'}, {'action': 'attack', 'target': playerName}
+            or {'action': 'move', 'locationId': id}. They run in order with the same rules and messages as
+            /action and /player-location, each one seeing what the previous ones did, and everything they
+            change is saved with a single commit. A player that changed during the batch (another request
+            of the same player) makes it fail as a whole.
+
+        Returns:
+            'results' with one message per action, in the order they were sent.
+
+        """
+        data = PlayerActionBatch.parse.parse_args()
 
+        if(gameState.enabled):
+            results = gameState.runBatch(current_identity.id, data['actions'])
+            response = {'results': results} if results is not None else None
+        else:
+            response = GameTransaction().run(current_identity.id, data['actions'])
+
+        if response is None:
+            return {'message': 'You are not currently part of a lobby!'}
+        return response
@@ -0,0 +1,68 @@
+import sys
+import warnings
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateColumn
+
+from db import db
+
+# Import the models so that their tables and indexes are registered on db.metadata
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+from models.tick import TickModel
+
+
+def upgradeSchema(engine):
+    """ Brings an existing database up to date with the columns and indexes declared on our models.
+
+        Note:
+            db.create_all() only creates missing tables, so a data.db created before a column or
+            an index was added to a model would never receive it. This function compares what is
+            declared on db.metadata with what SQLite reports and adds the missing pieces. New
+            columns must have a server_default, SQLite can't add a NOT NULL column without one.
+
+        Args:
+            engine: SQLAlchemy engine bound to the database that needs upgrading.
+
+        Return:
+            list with the names of the columns ('table.column') and indexes that were created.
+
+    """
+    inspector = inspect(engine)
+    tableNames = inspector.get_table_names()
+    created = []
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in tableNames:
+            continue
+
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            engine.execute('ALTER TABLE {} ADD COLUMN {}'.format(
+                engine.dialect.identifier_preparer.format_table(table),
+                CreateColumn(column).compile(dialect=engine.dialect)
+            ))
+            created.append('{}.{}'.format(table.name, column.name))
+
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(bind=engine)
+                created.append(index.name)
+            except IntegrityError:
+                # A unique index can't be built while duplicated rows exist, those have to be cleaned by hand.
+                warnings.warn('Could not create {}: table {} has duplicated rows.'.format(index.name, table.name))
+
+    return created
+
+
+if __name__ == '__main__':
+    # Usage: python schema.py [path/to/data.db]
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data.db'
+    for name in upgradeSchema(create_engine('sqlite:///' + path)):
+        print('Created {}'.format(name))
@@ -1,8 +1,93 @@
 # Secure way to compare strings
 from werkzeug.security import safe_str_cmp
+from collections import OrderedDict, namedtuple
+from threading import Lock
+import time
+from flask import g
+from flask_jwt import current_identity
+from sqlalchemy import event
 
 # Use player model to auth users
+from db import db
 from models.player import PlayerModel
+from sharding import shards
+
+#: What current_identity holds for a @jwt_required request. Game state (stats, location) is
+#: deliberately left out: resources that need it load the player through currentPlayer().
+PlayerIdentity = namedtuple('PlayerIdentity', ['id', 'playerName', 'role'])
+
+
+class IdentityCache:
+    """
+    Per-process cache of the identities looked up by the JWT identity function. It is bounded
+    in size (least recently used entries are dropped first) and every entry expires after 'ttl'
+    seconds. Entries are invalidated whenever a PlayerModel is updated or deleted.
+
+    Attributes:
+        maxSize (int): Maximum number of identities kept in memory.
+        ttl   (float): Seconds an identity can be served from memory.
+    """
+
+    def __init__(self, maxSize=1024, ttl=30):
+        self.maxSize  = maxSize
+        self.ttl      = ttl
+        self.__lock   = Lock()
+        self.__values = OrderedDict()
+
+    def configure(self, maxSize, ttl):
+        """ Changes the bounds of the cache and drops what it holds.
+
+        """
+        with self.__lock:
+            self.maxSize = maxSize
+            self.ttl     = ttl
+            self.__values.clear()
+
+    def get(self, playerId):
+        """ Returns the cached identity of 'playerId' or None if it is missing or expired.
+
+        """
+        with self.__lock:
+            entry = self.__values.get(playerId)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.__values[playerId]
+                return None
+            self.__values.move_to_end(playerId)
+            return entry[1]
+
+    def put(self, playerId, value):
+        """ Stores 'value' as the identity of 'playerId', evicting the least recently used entry if full.
+
+        """
+        if self.maxSize <= 0:
+            return
+        with self.__lock:
+            self.__values[playerId] = (time.monotonic() + self.ttl, value)
+            self.__values.move_to_end(playerId)
+            while len(self.__values) > self.maxSize:
+                self.__values.popitem(last=False)
+
+    def invalidate(self, playerId):
+        with self.__lock:
+            self.__values.pop(playerId, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__values.clear()
+
+
+#: Shared by every request of this process, configured by app.py
+identityCache = IdentityCache()
+
+
+# Any change to a player (status, lobby, deletion...) must not be hidden by a cached identity
+@event.listens_for(PlayerModel, 'after_update')
+@event.listens_for(PlayerModel, 'after_delete')
+def invalidate_identity(mapper, connection, target):
+    identityCache.invalidate(target.id)
+
 
 # Function that will be called by the /auth endpoint.
 def authenticate(playername, secretKey):
@@ -13,4 +98,43 @@ def authenticate(playername, secretKey):
 # Any function that has a @jwt_required will use the identity function
 def identity(payload):
         user_id = payload['identity']
-        return PlayerModel.findByPlayerId(user_id)
\ No newline at end of file
+        cached = identityCache.get(user_id)
+        if cached is not None:
+            return cached
+
+        g.identityMiss = True
+        if(shards.enabled):
+            # Only the account is read: the player's game state is in the shard of its lobby and
+            # the directory row must not end up in the session in its place, see sharding.py
+            player = db.session.query(PlayerModel.id, PlayerModel.playerName, PlayerModel.role).filter_by(id=user_id).first()
+        else:
+            player = PlayerModel.findByPlayerId(user_id)
+            # The resource handling this request will most likely need the player again
+            g.currentPlayer = player
+
+        if player is None:
+            return None
+
+        cached = PlayerIdentity(player.id, player.playerName, player.role)
+        identityCache.put(user_id, cached)
+        return cached
+
+def currentPlayer():
+    """ Returns the PlayerModel of the player making a @jwt_required request.
+
+        Note:
+            The player is loaded at most once per request. If the identity function already
+            loaded it (cache miss) no query is made at all.
+
+            With shards the rest of the request is routed to the shard of the player's lobby
+            (the directory if it isn't part of one) and the player is loaded from there.
+
+            player = currentPlayer()
+
+    """
+    player = g.get('currentPlayer')
+    if player is None:
+        shards.route(shards.lobbyOf(id=current_identity.id))
+        player = PlayerModel.findByPlayerId(current_identity.id)
+        g.currentPlayer = player
+    return player
@@ -0,0 +1,270 @@
+""" Per-lobby database shards (app.config['SHARDS']).
+
+With SHARDS = 0, the default, every table lives in the database of SQLALCHEMY_DATABASE_URI. SQLite
+lets one writer at a time into a file, so a busy lobby makes the moves of every other lobby wait.
+With SHARDS = N the game is spread over N more files, SHARD_DATABASE_URI formatted with 0 .. N-1
+(by default next to the database, data.db -> data-shard0.db ...), and lobbies on different
+shards are written concurrently:
+
+    - a lobby, its locations and the game state rows of its players and NPCs live in the shard
+      lobbyId % N. Lobby and location ids are allocated by their shard so that id % N is the
+      shard (see allocate_sharded_id), /lobby/<id> and /location/<id> are routed by the id alone.
+    - the database of SQLALCHEMY_DATABASE_URI becomes the directory of the player accounts (NPCs
+      included, so player ids are unique across shards) and of the lobby each player is part of.
+      security.authenticate and PlayerRegister only use the directory. Joining a lobby copies the
+      player's row into the lobby's shard, deleting the lobby deletes the copies and points the
+      directory rows back at no lobby (see enter and leave).
+
+db.session sends its statements to the database selected for the current app context:
+
+    shards.route(lobbyId)           the rest of the request uses the shard of the lobby
+    with shards.lobby(lobbyId):     the block uses the shard of the lobby
+    with shards.directory():        the block uses the directory
+
+security.currentPlayer() routes the request to the lobby of the authenticated player, resources
+that start from the current player need nothing else.
+
+Note:
+    A request that writes to the directory and to a shard (create, join and delete a lobby)
+    commits them one after the other, not atomically. SHARDS can't be changed once lobbies were
+    created, and existing single-file databases are not split: start from empty shards.
+"""
+import itertools
+import os
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+from sqlalchemy import event, false, func, inspect, select
+from sqlalchemy.engine.url import make_url
+
+from db import db, shardBind
+from schema import upgradeSchema
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+
+
+class Shards:
+    """
+    Routing of the lobby-scoped rows to their database shard.
+
+    Attributes:
+        count (int): Number of shards, 0 when sharding is off and every row is in one database.
+    """
+
+    def __init__(self):
+        self.count  = 0
+        self.__next = itertools.count()
+
+    def configure(self, count):
+        self.count = count
+
+    @property
+    def enabled(self):
+        return self.count > 0
+
+    def indexOf(self, entityId):
+        """ Shard of the lobby or location 'entityId'. None for -1 and None (no lobby) or when sharding is off.
+
+        """
+        if not self.enabled or entityId is None or entityId == -1:
+            return None
+        return entityId % self.count
+
+    def next(self):
+        """ Shard of the next lobby to be created, lobbies are spread round-robin. None when sharding is off.
+
+        """
+        if not self.enabled:
+            return None
+        return next(self.__next) % self.count
+
+    def current(self):
+        """ Shard the statements of the current app context go to, None for the directory.
+
+        """
+        return g.get('shard') if has_app_context() else None
+
+    # Routing
+
+    def use(self, index):
+        """ Sends the statements that follow to shard 'index', or to the directory if it is None.
+
+            Note:
+                Changes that are pending in the session are flushed first, to the database they
+                were made against.
+        """
+        if not self.enabled or index == self.current():
+            return
+        db.session.flush()
+        g.shard = index
+
+    def route(self, entityId):
+        """ Sends the rest of the request to the shard of the lobby or location 'entityId',
+            to the directory for -1 and None.
+
+        """
+        self.use(self.indexOf(entityId))
+
+    @contextmanager
+    def shard(self, index):
+        previous = self.current()
+        self.use(index)
+        try:
+            yield
+        except BaseException:
+            # Nothing is flushed on the way out of a failed block, its transaction is rolled back
+            if self.enabled:
+                g.shard = previous
+            raise
+        self.use(previous)
+
+    def lobby(self, entityId):
+        return self.shard(self.indexOf(entityId))
+
+    def directory(self):
+        return self.shard(None)
+
+    # Directory
+
+    def lobbyOf(self, **filters):
+        """ Lobby of the first player matching 'filters' (e.g. id=1) according to the directory.
+
+            Return:
+                lobbyId, -1 if the player isn't part of one, None if there is no such player
+                or sharding is off.
+        """
+        if not self.enabled:
+            return None
+        with self.directory():
+            row = db.session.query(PlayerModel.currentLobby).filter_by(**filters).first()
+        return row.currentLobby if row is not None else None
+
+    @staticmethod
+    def rowOf(player):
+        """ Every column of 'player' as a dict, to be copied into a shard with enter.
+
+        """
+        return {attribute.key: getattr(player, attribute.key) for attribute in inspect(player).mapper.column_attrs}
+
+    def allocateIds(self, model, count):
+        """ 'count' unused ids of 'model' in the current database, in the shard's id % SHARDS == shard sequence.
+
+            Note:
+                Takes the write lock of the database first, the ids can't be taken by anybody else
+                until the transaction ends. Used by the bulk inserts, which run as executemany and
+                can't read the ids SQLite would give each row.
+        """
+        column = inspect(model).primary_key[0]
+        # An UPDATE that matches nothing takes the lock without changing a row
+        db.session.execute(model.__table__.update().where(false()).values({column.name: column}))
+
+        shard = self.current()
+        step = self.count if shard is not None else 1
+        last = db.session.query(func.max(column)).scalar()
+        if last is None:
+            last = shard if shard is not None else 0
+        return [last + step * number for number in range(1, count + 1)]
+
+    def register(self, rows):
+        """ Inserts player accounts (dicts of PlayerModel columns) in the directory and sets their 'id'.
+
+        """
+        with self.directory():
+            for row, playerId in zip(rows, self.allocateIds(PlayerModel, len(rows))):
+                row['id'] = playerId
+            db.session.bulk_insert_mappings(PlayerModel, rows)
+
+    def enter(self, rows):
+        """ Makes players part of lobbies: their rows are inserted in the shard of their 'currentLobby'
+            and their directory rows point at it. Nothing is committed.
+
+            Args:
+                rows: dicts with every PlayerModel column, their game state in the lobby.
+        """
+        with self.directory():
+            db.session.bulk_update_mappings(PlayerModel, [{'id': row['id'], 'currentLobby': row['currentLobby']} for row in rows])
+        byShard = {}
+        for row in rows:
+            byShard.setdefault(self.indexOf(row['currentLobby']), []).append(row)
+        for shard, shardRows in byShard.items():
+            with self.shard(shard):
+                db.session.bulk_insert_mappings(PlayerModel, shardRows)
+
+    def leave(self, lobbyId):
+        """ Removes every player from 'lobbyId': their rows are deleted from the lobby's shard and their
+            directory rows get back the stats they ended with, pointing at no lobby. Nothing is committed.
+
+        """
+        with self.lobby(lobbyId):
+            stats = db.session.query(PlayerModel.id, PlayerModel.status, PlayerModel.heldItem, PlayerModel.strength,
+                                     PlayerModel.stamina, PlayerModel.version).filter_by(currentLobby=lobbyId)
+            rows = [dict(row._asdict(), currentLobby=-1, homeId=-1, locationId=-1, version=row.version + 1) for row in stats]
+            PlayerModel.query.filter_by(currentLobby=lobbyId).delete(synchronize_session=False)
+        with self.directory():
+            db.session.bulk_update_mappings(PlayerModel, rows)
+
+    # Schema
+
+    def bootstrap(self, app):
+        """ Creates the tables of every shard and the columns and indexes they are missing, see app.bootstrapSchema.
+
+        """
+        with app.app_context():
+            for index in range(self.count):
+                engine = db.get_engine(app, bind=shardBind(index))
+                db.Model.metadata.create_all(bind=engine)
+                upgradeSchema(engine)
+                engine.dispose()
+
+
+#: Shared by every request of this process, configured by app.py
+shards = Shards()
+
+
+@event.listens_for(LobbyModel, 'before_insert')
+@event.listens_for(LocationModel, 'before_insert')
+def allocate_sharded_id(mapper, connection, target):
+    """ Gives lobbies and locations inserted in shard s the next id with id % SHARDS == s.
+
+        Note:
+            The id is computed by the INSERT itself, INSERT ... VALUES ((SELECT max(id) + SHARDS ...)),
+            so concurrent inserts in the shard can't get the same one.
+    """
+    shard = shards.current()
+    column = mapper.primary_key[0]
+    key = mapper.get_property_by_column(column).key
+    if shard is None or getattr(target, key) is not None:
+        return
+    setattr(target, key, select([func.coalesce(func.max(column), shard) + shards.count]).as_scalar())
+
+
+def shardTemplate(uri):
+    """ SHARD_DATABASE_URI of the database 'uri' when none is set: files next to it named after it,
+        data.db -> data-shard0.db, data-shard1.db... In-memory databases get in-memory shards.
+
+    """
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite':
+        raise ValueError('SHARD_DATABASE_URI must be set when SQLALCHEMY_DATABASE_URI is not a SQLite database')
+    if url.database in (None, '', ':memory:'):
+        return 'sqlite://'
+    root, _ = os.path.splitext(url.database)
+    return 'sqlite:///' + root.replace('{', '{{').replace('}', '}}') + '-shard{}.db'
+
+
+def init_app(app):
+    """ Declares the shards of app.config['SHARDS'] as SQLALCHEMY_BINDS, must be called before db.init_app.
+
+        Args:
+            app: Flask application.
+    """
+    count = int(app.config.setdefault('SHARDS', 0))
+    template = app.config.get('SHARD_DATABASE_URI')
+    if not template and count > 0:
+        template = app.config['SHARD_DATABASE_URI'] = shardTemplate(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update({shardBind(index): template.format(index) for index in range(count)})
+    app.config['SQLALCHEMY_BINDS'] = binds or None
+    shards.configure(count)
@@ -0,0 +1,80 @@
+import sqlite3
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+#: Storage profiles selectable through app.config['STORAGE_PROFILE'].
+#:      engine:  options handed to SQLAlchemy's create_engine through SQLALCHEMY_ENGINE_OPTIONS.
+#:      pragmas: PRAGMA statements run on every new SQLite connection.
+STORAGE_PROFILES = {
+    # Flask-SQLAlchemy defaults: a new connection per checkout and the rollback journal.
+    'default': {
+        'engine' : {},
+        'pragmas': {}
+    },
+    # Several gunicorn workers sharing data.db: readers don't block the writer (WAL), commits
+    # don't fsync the database file (synchronous=NORMAL is safe with WAL), writers wait for the
+    # lock instead of failing with "database is locked", and connections are reused.
+    'production': {
+        'engine': {
+            'poolclass'    : QueuePool,
+            'pool_size'    : 8,
+            'max_overflow' : 8,
+            'pool_timeout' : 30,
+            'connect_args' : {'timeout': 30, 'check_same_thread': False}
+        },
+        'pragmas': {
+            'journal_mode' : 'WAL',
+            'synchronous'  : 'NORMAL',
+            'busy_timeout' : 30000,
+            'mmap_size'    : 256 * 1024 * 1024,
+            'cache_size'   : -64 * 1024,
+            'temp_store'   : 'MEMORY'
+        }
+    }
+}
+
+
+def init_app(app):
+    """ Applies the storage profile named by app.config['STORAGE_PROFILE'] to the application.
+
+        Note:
+            Must be called before the first database access, engines read SQLALCHEMY_ENGINE_OPTIONS
+            when they are created. Options and pragmas already present in the config win over
+            the ones of the profile, so single values can be tuned without a new profile.
+
+        Args:
+            app: Flask application.
+    """
+    profile = STORAGE_PROFILES[app.config.setdefault('STORAGE_PROFILE', 'default')]
+
+    options = dict(profile['engine'])
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    pragmas = dict(profile['pragmas'])
+    pragmas.update(app.config.get('SQLITE_PRAGMAS', {}))
+    app.config['SQLITE_PRAGMAS'] = pragmas
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapiConnection, connectionRecord):
+    """ Runs the SQLITE_PRAGMAS of the current application on every new SQLite connection.
+
+        Note:
+            Connections are opened lazily by the pool while a request (or app context) uses
+            the session, which is how we know what application the connection is for.
+    """
+    if not isinstance(dbapiConnection, sqlite3.Connection) or not has_app_context():
+        return
+
+    cursor = dbapiConnection.cursor()
+    for name, value in current_app.config.get('SQLITE_PRAGMAS', {}).items():
+        try:
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        except sqlite3.OperationalError:
+            # Read-only connections (see replicas.py) can't change the journal mode, they use the writers' one
+            if name != 'journal_mode':
+                raise
+    cursor.close()
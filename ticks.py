@@ -0,0 +1,185 @@
+""" Game ticks: the rules that change players as time goes by, applied every TICK_INTERVAL seconds.
+
+Without ticks a player's stamina and sleep only change through its own requests. A tick applies
+to every player that is part of a lobby:
+
+    - regen:      a sleeping player gets TICK_STAMINA_REGEN stamina back, up to TICK_MAX_STAMINA.
+    - wake:       a sleeping player with at least TICK_WAKE_STAMINA stamina wakes up.
+    - exhaustion: an awake player without stamina falls asleep.
+
+A tick is one transaction per database (the main one, or every shard) made of set-based UPDATEs,
+whatever the number of players. The lobbies and locations of the players it changes get their
+version bumped (see models/versions.py), and wake and sleep events are published to their lobby.
+In memory mode (see gamestate.py) the lobbies held in memory are ticked there and skipped by the
+UPDATEs.
+
+Every process runs the scheduler; the ticks table (see models/tick.py) lets only one of them
+apply each tick. 'flask tick' applies one tick right away. Their duration and the players every
+rule changed are reported on GET /metrics.
+
+Note:
+    A lobby loaded in memory while a tick is being written may miss that tick.
+"""
+import threading
+import time
+
+import click
+from flask import current_app
+from sqlalchemy import case, select
+
+from db import db, shardBind
+from gamestate import gameState, publish
+from metrics import metrics
+from models.player import PlayerModel
+from models.lobby import LobbyModel
+from models.locations import LocationModel
+from models.tick import TickModel
+from sharding import shards
+
+
+def tickDatabase(regen, maxStamina, wakeStamina, spacing, skipLobbyIds=()):
+    """ Applies a tick to the players of the database the session is routed to, and commits it.
+
+        Args:
+            regen, maxStamina, wakeStamina: TICK_STAMINA_REGEN, TICK_MAX_STAMINA, TICK_WAKE_STAMINA.
+            spacing: seconds that must have passed since the last tick of the database.
+            skipLobbyIds: lobbies left alone, those held in memory.
+
+        Return:
+            tuple ({rule: players changed}, [(lobbyId, events)]), None if another process ticked.
+    """
+    try:
+        if not TickModel.claim(time.time(), spacing):
+            db.session.rollback()
+            return None
+
+        inGame = (PlayerModel.currentLobby != -1) & PlayerModel.currentLobby.isnot(None)
+        if skipLobbyIds:
+            inGame = inGame & PlayerModel.currentLobby.notin_(skipLobbyIds)
+        sleeping = inGame & (PlayerModel.status == 'sleep')
+        waking = sleeping & (PlayerModel.stamina >= wakeStamina)
+        exhausted = inGame & (PlayerModel.status == 'none') & (PlayerModel.stamina <= 0)
+
+        # Lobbies and locations whose players are about to change, see models/versions.py
+        changing = (sleeping & ((PlayerModel.stamina < maxStamina) | (PlayerModel.stamina >= wakeStamina))) | exhausted
+        for column, parent in ((PlayerModel.currentLobby, LobbyModel.lobbyId), (PlayerModel.locationId, LocationModel.id)):
+            table = parent.class_.__table__
+            db.session.execute(table.update().where(parent.in_(select([column]).where(changing))).values(
+                version=parent.class_.version + 1))
+
+        changes = {}
+        changes['regen'] = PlayerModel.query.filter(sleeping & (PlayerModel.stamina < maxStamina)).update({
+            'stamina': case([(PlayerModel.stamina + regen > maxStamina, maxStamina)], else_=PlayerModel.stamina + regen),
+            'version': PlayerModel.version + 1
+        }, synchronize_session=False)
+
+        # Only the players whose status changes are read, for the lobby events
+        byLobby = {}
+        for row in db.session.query(PlayerModel.playerName, PlayerModel.currentLobby, PlayerModel.status) \
+                .filter(waking | exhausted).order_by(PlayerModel.id):
+            byLobby.setdefault(row.currentLobby, []).append(('wake' if row.status == 'sleep' else 'sleep', {'playerName': row.playerName}))
+
+        changes['wake'] = PlayerModel.query.filter(waking).update(
+            {'status': 'none', 'version': PlayerModel.version + 1}, synchronize_session=False)
+        changes['exhaustion'] = PlayerModel.query.filter(exhausted).update(
+            {'status': 'sleep', 'version': PlayerModel.version + 1}, synchronize_session=False)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    return changes, list(byLobby.items())
+
+
+def runTick(spacing=0):
+    """ Applies a tick to the lobbies in memory and to every database.
+
+        Args:
+            spacing: seconds that must have passed since the last tick of a database for it to be ticked.
+
+        Return:
+            {rule: players changed}
+    """
+    config = current_app.config
+    rules = (config['TICK_STAMINA_REGEN'], config['TICK_MAX_STAMINA'], config['TICK_WAKE_STAMINA'])
+    total = {'regen': 0, 'wake': 0, 'exhaustion': 0}
+    published = []
+
+    skipLobbyIds = set()
+    if(gameState.enabled):
+        start = time.perf_counter()
+        skipLobbyIds, changes, events = gameState.tick(*rules)
+        metrics.observeTick('memory', time.perf_counter() - start, changes)
+        published += events
+        for rule, count in changes.items():
+            total[rule] += count
+
+    for shard in (range(shards.count) if shards.enabled else [None]):
+        with shards.shard(shard):
+            start = time.perf_counter()
+            outcome = tickDatabase(*rules, spacing, [lobbyId for lobbyId in skipLobbyIds if shards.indexOf(lobbyId) == shard])
+        if outcome is None:
+            continue
+        changes, events = outcome
+        metrics.observeTick('main' if shard is None else shardBind(shard), time.perf_counter() - start, changes)
+        published += events
+        for rule, count in changes.items():
+            total[rule] += count
+
+    for lobbyId, events in published:
+        publish(lobbyId, events)
+    return total
+
+
+class TickScheduler:
+    """
+    Background thread running a tick every 'interval' seconds, see runTick.
+
+    """
+
+    def __init__(self):
+        self.__thread  = None
+        self.__stopped = threading.Event()
+
+    def start(self, app, interval):
+        self.__stopped.clear()
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__loop, args=(app, interval), name='game-tick', daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __loop(self, app, interval):
+        while not self.__stopped.wait(interval):
+            try:
+                with app.app_context():
+                    # Processes wake up at slightly different times, half an interval tells them apart
+                    runTick(spacing=interval / 2)
+            except Exception:
+                app.logger.exception('Game tick failed, retrying in %s seconds', interval)
+
+
+#: Started by init_app when app.config['TICK_INTERVAL'] is set
+tickScheduler = TickScheduler()
+
+
+def init_app(app):
+    """ Registers 'flask tick' and starts the tick scheduler if app.config['TICK_INTERVAL'] is set.
+
+        Args:
+            app: Flask application.
+    """
+    app.config.setdefault('TICK_STAMINA_REGEN', 10)
+    app.config.setdefault('TICK_MAX_STAMINA', 100)
+    app.config.setdefault('TICK_WAKE_STAMINA', 100)
+    if app.config.setdefault('TICK_INTERVAL', 0):
+        tickScheduler.start(app, app.config['TICK_INTERVAL'])
+
+    @app.cli.command('tick')
+    def tick_command():
+        """ Applies one game tick to every lobby. """
+        for rule, count in runTick().items():
+            click.echo('{:>8}  {}'.format(count, rule))
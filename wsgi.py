@@ -0,0 +1,7 @@
+# Entry point for WSGI servers: gunicorn --preload wsgi:app
+# GAME_STATE=memory needs every action served by one process (see gamestate.py): run a single worker
+# with threads and without --preload, gunicorn -w 1 --threads 8 wsgi:app. A second process refuses to
+# start, a forked worker refuses the actions.
+from app import create_app
+
+app = create_app()